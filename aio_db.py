@@ -0,0 +1,138 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import db
+import metrics
+
+
+# Чтение из PostgreSQL в asyncio без потоков: асинхронные соединения psycopg2
+# (async_=True), ожидание готовности сокета через цикл событий.
+# Асинхронное соединение работает в режиме autocommit, каждый запрос — отдельное чтение.
+# Записи асинхронного режима выполняют функции main.py в потоках (asyncio.to_thread).
+# Параметры подключения берутся из db.configure.
+
+DEFAULT_POOL_SIZE = 20
+
+
+# Ожидание завершения операции на асинхронном соединении
+async def wait(conn):
+    loop = asyncio.get_running_loop()
+    fileno = conn.fileno()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        future = loop.create_future()
+        if state == extensions.POLL_READ:
+            loop.add_reader(fileno, future.set_result, None)
+            try:
+                await future
+            finally:
+                loop.remove_reader(fileno)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fileno, future.set_result, None)
+            try:
+                await future
+            finally:
+                loop.remove_writer(fileno)
+        else:
+            raise psycopg2.OperationalError(f"Неожиданное состояние соединения: {state}")
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    async def execute(self, query, vars=None):
+        label = db.query_label(query)
+        started = time.perf_counter()
+        try:
+            self.cursor.execute(query, vars)
+            await wait(self.conn)
+        except psycopg2.Error:
+            metrics.DB_QUERY_ERRORS.inc(query=label)
+            raise
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, query=label)
+
+    # Результат уже получен в execute, выборка не блокирует цикл событий
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class Pool:
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.idle = asyncio.LifoQueue()
+        self.opened = 0
+
+    async def connect(self):
+        conn = psycopg2.connect(async_=True, **db.connection_params())
+        await wait(conn)
+        return conn
+
+    async def acquire(self):
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                return await self.connect()
+            except BaseException:
+                self.opened -= 1
+                raise
+        with metrics.DB_POOL_WAIT_SECONDS.time():
+            return await self.idle.get()
+
+    def release(self, conn, broken=False):
+        if broken or conn.closed:
+            self.opened -= 1
+            if not conn.closed:
+                conn.close()
+            return
+        self.idle.put_nowait(conn)
+
+    # Курсор для одиночных запросов на соединении из пула
+    @asynccontextmanager
+    async def cursor(self):
+        conn = await self.acquire()
+        cursor = Cursor(conn)
+        broken = False
+        try:
+            yield cursor
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except psycopg2.Error:
+            raise
+        except BaseException:
+            # Отмена могла прервать запрос на середине, соединение не возвращается в пул
+            broken = True
+            raise
+        finally:
+            cursor.close()
+            self.release(conn, broken)
+
+    async def fetchone(self, query, vars=None):
+        async with self.cursor() as cursor:
+            await cursor.execute(query, vars)
+            return cursor.fetchone()
+
+    async def fetchall(self, query, vars=None):
+        async with self.cursor() as cursor:
+            await cursor.execute(query, vars)
+            return cursor.fetchall()
+
+    async def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+            self.opened -= 1
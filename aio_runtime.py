@@ -0,0 +1,501 @@
+import asyncio
+import json
+import logging
+import time
+
+from telebot import types as telebot_types
+from telegram.constants import ChatType
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from telegram.request import HTTPXRequest
+
+import aio_db
+import broadcast
+import cooldown_store
+import dedup
+import metrics
+import outbound
+import settings
+import similarity
+import state
+from router import normalize
+
+
+# Асинхронный режим бота (BOT_MODE=async) на python-telegram-bot 20.
+# Обновления принимает Application из PTB. Массовые сценарии перенесены на asyncio:
+# /start, меню пользователя, отправка заявок, статус заявок, решения модератора и доставка
+# рассылок. Запросы к Bot API и чтение из базы данных (aio_db) в них не занимают поток, поэтому
+# один процесс держит тысячи вызовов одновременно. Записи (регистрация, заявки, решения
+# модератора) выполняют те же функции main.py, что и в остальных режимах, в потоке
+# (asyncio.to_thread): у записи одна реализация на все режимы.
+# Редкие сценарии модератора (настройки, публикация, очередь, управление рассылками)
+# выполняются прежними обработчиками TeleBot из main.py в пуле потоков.
+
+# Число одновременно обрабатываемых обновлений
+DEFAULT_CONCURRENCY = 256
+# Число HTTP-соединений с Bot API
+DEFAULT_CONNECTIONS = 256
+# Число одновременных отправок рассылки (скорость по-прежнему ограничивает BROADCAST_RATE)
+DEFAULT_IN_FLIGHT = 1000
+# Число потоков для обработчиков TeleBot
+DEFAULT_BRIDGE_THREADS = 8
+
+
+# Клавиатура TeleBot в формате Bot API (PTB передает словарь как есть)
+def markup(keyboard):
+    return json.loads(keyboard.to_json()) if keyboard is not None else None
+
+
+def retry_after_seconds(error):
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else value
+
+
+# Время и ошибки вызовов Bot API, как metrics.instrument_api в режиме TeleBot
+class TimedRequest(HTTPXRequest):
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            metrics.API_ERRORS.inc(method=api_method, code='network')
+            raise
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if code != 200:
+            metrics.API_ERRORS.inc(method=api_method, code=code)
+        return code, payload
+
+
+async def send_content(api, chat_id, content):
+    if content.get('photo'):
+        await api.send_photo(chat_id, content['photo'], caption=content.get('text'))
+    elif content.get('video'):
+        await api.send_video(chat_id, content['video'], caption=content.get('text'))
+    else:
+        await api.send_message(chat_id, content['text'])
+
+
+# Рассылка на asyncio: тысячи отправок в работе без потока на каждую.
+# Контрольная точка записывается отдельной задачей: пока идет запись, новые итоги
+# накапливаются и попадают в следующую, поэтому запись не отстает от отправок.
+class AsyncBroadcast(broadcast.Broadcast):
+    def __init__(self, api, *args, in_flight=DEFAULT_IN_FLIGHT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api = api
+        self.in_flight = in_flight
+        self.dirty = asyncio.Event()
+        self.closing = False
+
+    async def run_async(self):
+        if self.progress_message_id is None:
+            message = await self.api.send_message(self.report_chat_id, self.format_progress())
+            self.progress_message_id = message.message_id
+            await asyncio.to_thread(self.save_checkpoint)
+
+        slots = asyncio.Semaphore(self.in_flight)
+        tasks = set()
+        writer = asyncio.create_task(self.write_checkpoints())
+        after_row = self.checkpoint
+        while self.status == broadcast.RUNNING:
+            batch = await asyncio.to_thread(broadcast.fetch_recipients, after_row, self.batch_size)
+            if not batch:
+                break
+            for row_id, uid in batch:
+                if self.status != broadcast.RUNNING:
+                    break
+                after_row = row_id
+                if row_id in self.done_ahead:
+                    continue
+                await slots.acquire()
+                with self.lock:
+                    self.pending.append(row_id)
+                task = asyncio.create_task(self.deliver_async(row_id, uid, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        self.closing = True
+        self.dirty.set()
+        await writer
+        await asyncio.to_thread(self.finish, after_row)
+
+    async def deliver_async(self, row_id, uid, slots):
+        try:
+            result = await self.send_async(uid)
+        finally:
+            slots.release()
+        self.record(row_id, result, uid)
+        self.dirty.set()
+
+    # Отправка одному пользователю с учетом ответа 429; возвращает итог отправки
+    async def send_async(self, uid):
+        for attempt in range(outbound.MAX_RETRIES + 1):
+            wait = self.bucket.try_acquire()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.bucket.try_acquire()
+            try:
+                await send_content(self.api, uid, self.content)
+                return 'sent'
+            except RetryAfter as e:
+                if attempt < outbound.MAX_RETRIES:
+                    self.bucket.hold(retry_after_seconds(e))
+                    continue
+                return 'failed'
+            except Forbidden:
+                return 'blocked'
+            except Exception as e:
+                logging.warning("Ошибка рассылки пользователю %s: %s", uid, e)
+                return 'failed'
+        return 'failed'
+
+    async def write_checkpoints(self):
+        while True:
+            await self.dirty.wait()
+            self.dirty.clear()
+            await asyncio.to_thread(self.flush)
+            if self.closing and not self.dirty.is_set():
+                return
+
+    def flush(self):
+        self.save_checkpoint()
+        self.report()
+
+
+class AsyncBroadcastWorker(broadcast.BroadcastWorker):
+    def __init__(self, bot, api, bucket, in_flight=DEFAULT_IN_FLIGHT, batch_size=broadcast.DEFAULT_BATCH_SIZE):
+        super().__init__(bot, bucket, batch_size=batch_size)
+        self.api = api
+        self.in_flight = in_flight
+        self.loop = None
+
+    # Вызывается из потоков обработчиков TeleBot
+    def notify(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                job = await asyncio.to_thread(self.claim_job)
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), broadcast.POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wakeup.clear()
+                    continue
+                logging.info("Рассылка #%s: запуск с контрольной точки %s", job['id'], job['last_user_row'])
+                await AsyncBroadcast(self.api, self.bot, job, self.worker_id, self.bucket,
+                                     batch_size=self.batch_size, in_flight=self.in_flight).run_async()
+            except Exception:
+                logging.exception("Ошибка фонового обработчика рассылок")
+                await asyncio.sleep(broadcast.POLL_INTERVAL)
+
+
+class AsyncRuntime:
+    def __init__(self, main, token, config, recorder=None):
+        self.main = main
+        self.recorder = recorder
+        self.concurrency = int(config.get('ASYNC_CONCURRENCY') or DEFAULT_CONCURRENCY)
+        connections = int(config.get('ASYNC_CONNECTIONS') or DEFAULT_CONNECTIONS)
+        self.db = aio_db.Pool(int(config.get('ASYNC_DATABASE_POOL') or aio_db.DEFAULT_POOL_SIZE))
+        self.bridge_threads = int(config.get('ASYNC_BRIDGE_THREADS') or DEFAULT_BRIDGE_THREADS)
+
+        self.application = (
+            Application.builder()
+            .token(token)
+            .request(TimedRequest(connection_pool_size=connections, pool_timeout=30))
+            .concurrent_updates(self.concurrency)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        self.api = self.application.bot
+        # Рассылки берут токены из общего ведра клиента TeleBot: лимит скорости один на процесс
+        self.broadcast_worker = AsyncBroadcastWorker(
+            main.bot, self.api, main.outbound_client.bucket,
+            in_flight=int(config.get('BROADCAST_IN_FLIGHT') or DEFAULT_IN_FLIGHT),
+        )
+
+        # Клавиатуры из main.py в формате Bot API
+        self.start_menu_keyboard = markup(main.start_menu_keyboard)
+        self.moderator_keyboard = markup(main.moderator_keyboard)
+        self.send_material_keyboard = markup(main.send_material_keyboard)
+        self.exit_to_menu_keyboard = markup(main.exit_to_menu_keyboard)
+        self.about_keyboard = markup(main.about_keyboard)
+        self.contacts_keyboard = markup(main.contacts_keyboard)
+
+        # Кнопки меню и шаги диалога, перенесенные на asyncio; остальные обрабатывает TeleBot
+        self.routes = {normalize(label): metrics.timed_async_handler(handler) for label, handler in (
+            ('Отправить материал', self.send_material),
+            ('Оставить заявку', self.leave_request),
+            ('О нас', self.about),
+            ('Контакты', self.contacts),
+            ('Посмотреть статус заявок', self.check_request_status),
+        )}
+        self.steps = {name: metrics.timed_async_handler(handler, name) for name, handler in (
+            ('send_request', self.send_request),
+            ('save_rejection_reason', self.save_rejection_reason),
+        )}
+        self.register()
+
+    def register(self):
+        app = self.application
+        if self.recorder is not None:
+            app.add_handler(MessageHandler(filters.ALL, self.record), group=-1)
+            app.add_handler(CallbackQueryHandler(self.record), group=-1)
+        app.add_handler(CommandHandler('start', metrics.timed_async_handler(self.start)))
+        app.add_handler(CallbackQueryHandler(metrics.timed_async_handler(self.send_rejection_reason), pattern=r'^reason_'))
+        app.add_handler(CallbackQueryHandler(metrics.timed_async_handler(self.handle_status_page), pattern=r'^status_(older|newer)_'))
+        app.add_handler(CallbackQueryHandler(metrics.timed_async_handler(self.handle_request_action), pattern=r'^(true|false)_'))
+        app.add_handler(MessageHandler(
+            filters.ChatType.PRIVATE & (filters.TEXT | filters.PHOTO | filters.VIDEO), self.on_message))
+        app.add_handler(MessageHandler(filters.ALL, self.bridge))
+        app.add_handler(CallbackQueryHandler(self.bridge))
+
+    async def post_init(self, application):
+        self.bridge_semaphore = asyncio.Semaphore(self.bridge_threads)
+        await asyncio.to_thread(settings.load)
+        application.create_task(self.broadcast_worker.run())
+
+    async def post_shutdown(self, application):
+        await self.db.close()
+
+    def run(self):
+        logging.info("Асинхронный режим: до %s обновлений одновременно", self.concurrency)
+        self.application.run_polling(allowed_updates=['message', 'callback_query'])
+
+    async def record(self, update, context):
+        self.recorder.record_raw([update.to_dict()])
+
+    # Обновление для прежних обработчиков TeleBot: выполняется в потоке, как в режиме вебхука
+    async def bridge(self, update, context):
+        legacy_update = telebot_types.Update.de_json(update.to_dict())
+        async with self.bridge_semaphore:
+            await asyncio.to_thread(self.main.bot.process_new_updates, [legacy_update])
+
+    async def send(self, chat_id, text, reply_markup=None):
+        return await self.api.send_message(chat_id, text, reply_markup=reply_markup)
+
+    # Разбор личного сообщения: шаг диалога, кнопка меню или заявка
+    async def on_message(self, update, context):
+        message = update.effective_message
+        user_id = update.effective_user.id
+
+        current = await asyncio.to_thread(state.get_state, message.chat.id, user_id)
+        if current is not None:
+            if current[0] not in self.steps:
+                await self.bridge(update, context)
+                return
+            current = await asyncio.to_thread(state.pop_state, message.chat.id, user_id)
+            if current is not None and current[0] in self.steps:
+                name, data = current
+                await self.steps[name](update, **data)
+            return
+
+        if message.text is not None:
+            key = normalize(message.text)
+            if key in self.routes:
+                await self.routes[key](update)
+                return
+            if key in self.main.router.routes or message.text.startswith('/'):
+                await self.bridge(update, context)
+                return
+
+        if not settings.is_moderator(user_id):
+            await self.steps['send_request'](update)
+
+    async def next_step(self, update, name, **data):
+        await asyncio.to_thread(state.set_state, update.effective_chat.id, update.effective_user.id, name, **data)
+
+    # Регистрация пользователя: та же функция main.save_user (и та же групповая фиксация) в потоке
+    async def save_user(self, user):
+        return await asyncio.to_thread(self.main.save_user, user)
+
+    async def remember_user(self, user):
+        if self.main.name_cache.peek(user.id) != user.first_name:
+            await self.save_user(user)
+
+    async def start(self, update, context):
+        message = update.effective_message
+        if message.chat.type != ChatType.PRIVATE:
+            await self.send(message.chat.id, "Этот бот работает только в приватных чатах.")
+            return
+
+        user = update.effective_user
+        if settings.is_moderator(user.id):
+            await self.send(user.id, "Вы модератор.", self.moderator_keyboard)
+        else:
+            await self.send(user.id, "Вы пользователь.", self.start_menu_keyboard)
+
+        if await self.save_user(user):
+            await self.send(message.chat.id, 'Привет! \n С помощью этого бота вы можете отправить материал для Kursiv Playground.',
+                            self.start_menu_keyboard)
+
+    async def send_material(self, update):
+        await self.send(update.effective_chat.id, "Критерии материала: \n *Ограничения по символам \n *Фактчекинг \n *Оригинальность \n *Предупреждение о ненарушении законодательства РК \n *Какие материалы ожидаем (темы, формат) \n *Инфо о конкурсе ",
+                        self.send_material_keyboard)
+
+    async def leave_request(self, update):
+        await self.send(update.effective_chat.id, 'Чтобы отправить материал, введите или вставьте ниже свой контент в чат одним сообщением. Вы также можете прикрепить фото и видео к вашей статье. \n Обязательно укажите заголовок для вашей статьи и выделите в тексте ссылки на источники. \n Если вы хотите, чтобы вас упомянули как автора материала, в конце текста укажите своё имя/никнейм.',
+                        self.exit_to_menu_keyboard)
+        await self.next_step(update, 'send_request')
+
+    async def about(self, update):
+        await self.send(update.effective_chat.id, "Немного о Playground \n (Общая вводная инфо, принципы издания)", self.about_keyboard)
+
+    async def contacts(self, update):
+        await self.send(update.effective_chat.id, "Контакты для обратной связи и по вопросам сотрудничества", self.contacts_keyboard)
+
+    async def check_request_status(self, update):
+        user_id = update.effective_user.id
+        rows = await self.db.fetchall(*self.main.user_requests_query(user_id))
+        requests, has_newer, has_older = self.main.user_requests_page(rows)
+
+        if not requests:
+            await self.send(user_id, "У вас нет активных заявок.", self.start_menu_keyboard)
+            return
+        text, keyboard = self.main.status_page_message(requests, has_newer, has_older)
+        await self.send(user_id, text, markup(keyboard))
+
+    # То же, что handle_status_page в main.py
+    async def handle_status_page(self, update, context):
+        query = update.callback_query
+        await query.answer()
+        _, direction, key = query.data.split('_', 2)
+        bound = {direction: self.main.decode_queue_key(key)}
+        rows = await self.db.fetchall(*self.main.user_requests_query(query.from_user.id, **bound))
+        requests, has_newer, has_older = self.main.user_requests_page(rows, **bound)
+
+        if requests:
+            text, keyboard = self.main.status_page_message(requests, has_newer, has_older)
+        else:
+            text, keyboard = "На этой странице заявок больше нет.", None
+        await self.api.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id,
+                                         reply_markup=markup(keyboard))
+
+    async def send_rejection_reason(self, update, context):
+        query = update.callback_query
+        request_id = int(query.data.split('_')[1])
+        row = await self.db.fetchone(
+            "SELECT rejection_reason FROM requests WHERE id = %s "
+            "UNION ALL SELECT rejection_reason FROM requests_archive WHERE id = %s", (request_id, request_id))
+        if row is not None:
+            await self.send(query.message.chat.id, f"Причина отказа для заявки #{request_id}:\n{row[0]}")
+        else:
+            await self.send(query.message.chat.id, f"Для заявки #{request_id} не указана причина отказа.")
+
+    async def send_request(self, update):
+        message = update.effective_message
+        user = update.effective_user
+        await self.remember_user(user)
+
+        text = message.text or message.caption
+        if text and text.lower() == 'выход в главное меню':
+            await self.send(message.chat.id, "Выход в главное меню", self.start_menu_keyboard)
+            return
+
+        photo_id = message.photo[-1].file_id if message.photo else None
+        video_id = message.video.file_id if message.video else None
+        error_message = self.main.validate_submission(text, photo_id, video_id)
+        if error_message:
+            await self.send(message.chat.id, error_message)
+            return
+
+        cooldown_remaining = await self.cooldown('acquire', user.id, settings.get_cooldown() or 0)
+        if cooldown_remaining:
+            await self.send(message.chat.id, self.main.COOLDOWN_TEXT.format(int(cooldown_remaining) or 1),
+                            self.start_menu_keyboard)
+            return
+
+        try:
+            await self.save_request(message, user, text, photo_id, video_id)
+        except Exception as err:
+            logging.error("Заявка пользователя %s не сохранена: %s", user.id, err)
+            # Заявка не сохранена, кулдаун не расходуется
+            await self.cooldown('release', user.id)
+            await self.send(message.chat.id, self.main.SUBMISSION_FAILED_TEXT, self.start_menu_keyboard)
+            return
+        await self.send(message.chat.id, self.main.SUBMISSION_ACCEPTED_TEXT, self.start_menu_keyboard)
+
+    # Хранилище кулдауна в памяти отвечает сразу, в PostgreSQL — в потоке
+    async def cooldown(self, method, *args):
+        store = self.main.submission_cooldown
+        if isinstance(store, cooldown_store.MemoryCooldownStore):
+            return getattr(store, method)(*args)
+        return await asyncio.to_thread(getattr(store, method), *args)
+
+    async def save_request(self, message, user, text, photo_id, video_id):
+        media_key = dedup.media_key(message)
+        photo_hash = None
+        if photo_id and dedup.can_hash():
+            try:
+                file = await self.api.get_file(dedup.thumbnail_file_id(message))
+                photo_hash = await asyncio.to_thread(dedup.photo_hash, bytes(await file.download_as_bytearray()))
+            except TelegramError as err:
+                logging.warning("Не удалось загрузить фото для поиска повторов: %s", err)
+
+        text_signature = await asyncio.to_thread(similarity.signature, text)
+        # Запись, поиск повторов и похожих текстов — та же функция main.save_submission в потоке
+        await asyncio.to_thread(self.main.save_submission,
+                                (user.id, text, photo_id, video_id, media_key, photo_hash, text_signature))
+
+    # Решения модератора — те же функции main.py в потоке: статус, повторы, очереди outbox
+    # и publications в одной транзакции
+    async def approve_requests(self, request_ids):
+        return await asyncio.to_thread(self.main.approve_requests, request_ids)
+
+    async def reject_requests(self, request_ids, reason):
+        return await asyncio.to_thread(self.main.reject_requests, request_ids, reason)
+
+    # Решение модератора; уведомления уходят через очередь outbox, публикации — через очередь publications
+    async def handle_request_action(self, update, context):
+        query = update.callback_query
+        action, request_id = query.data.split('_')
+        request_id = int(request_id)
+        moder_id = query.from_user.id
+        chat_id = query.message.chat.id
+
+        if action == 'true':
+            if await self.approve_requests([request_id]):
+                text = f"Заявка #{request_id} была одобрена."
+            else:
+                text = f"Заявка #{request_id} уже рассмотрена."
+            await asyncio.gather(
+                self.send(moder_id, text),
+                self.api.edit_message_reply_markup(chat_id=chat_id, message_id=query.message.message_id, reply_markup=None),
+            )
+
+        elif action == 'false':
+            row = await self.db.fetchone("SELECT user_id FROM requests WHERE id = %s", (request_id,))
+            if row is None:
+                await asyncio.gather(
+                    self.send(moder_id, f"Заявка #{request_id} уже рассмотрена."),
+                    self.api.edit_message_reply_markup(chat_id=chat_id, message_id=query.message.message_id, reply_markup=None),
+                )
+                return
+            await asyncio.gather(
+                self.send(moder_id, f"Заявка #{request_id} отклонена. Пожалуйста, укажите причину отказа в ответ на данное сообщение."),
+                self.api.edit_message_reply_markup(chat_id=chat_id, message_id=query.message.message_id, reply_markup=None),
+                asyncio.to_thread(state.set_state, chat_id, moder_id, 'save_rejection_reason',
+                                  request_id=request_id, user_id=row[0]),
+            )
+
+    async def save_rejection_reason(self, update, request_id, user_id):
+        message = update.effective_message
+        rejection_reason = message.text
+        try:
+            rejected = await self.reject_requests([request_id], rejection_reason)
+        except Exception as e:
+            await self.send(message.chat.id, f"Произошла ошибка при сохранении причины отказа: {str(e)}")
+            return
+        if rejected:
+            await self.send(message.chat.id, f"Причина отказа для заявки #{request_id} сохранена.")
+        else:
+            await self.send(message.chat.id, f"Заявка #{request_id} уже рассмотрена.")
@@ -0,0 +1,4 @@
+# Офлайн-бенчмарк бота.
+# Бот загружается целиком (main.py) и работает против локальной заглушки Bot API
+# и одноразового PostgreSQL, поэтому замеры не зависят от сети и Telegram.
+# Запуск: python -m bench --help
@@ -0,0 +1,68 @@
+import argparse
+import os
+
+from bench.app import environment
+from bench.stats import format_table, load_baseline, save_results
+
+
+SCENARIOS = ('submit', 'queue', 'approve', 'broadcast')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench', description="Офлайн-бенчмарк бота")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="сценарий (можно указать несколько раз); по умолчанию все")
+    parser.add_argument('--requests', type=int, default=1000, help="число заявок в submit и approve")
+    parser.add_argument('--renders', type=int, default=200, help="число показов очереди в queue")
+    parser.add_argument('--pending', type=int, default=10000, help="число заявок в очереди для queue")
+    parser.add_argument('--users', default='10000,100000', help="размеры рассылки через запятую")
+    parser.add_argument('--concurrency', type=int, default=8, help="число потоков обработки обновлений")
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа заглушки Bot API")
+    parser.add_argument('--error-429', type=float, default=0, help="доля ответов 429")
+    parser.add_argument('--error-403', type=float, default=0, help="доля пользователей, заблокировавших бота")
+    parser.add_argument('--broadcast-rate', type=int, default=1000,
+                        help="лимит рассылки, сообщений в секунду (в бою 30)")
+    parser.add_argument('--cooldown-backend', default='memory', choices=('memory', 'postgres'))
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--baseline', help="файл --json прошлого запуска для сравнения")
+    return parser.parse_args()
+
+
+def run(args, bench):
+    results = []
+    scenarios = args.scenario or SCENARIOS
+    if 'submit' in scenarios:
+        results.append(bench.submit(args.requests))
+    if 'queue' in scenarios:
+        results.append(bench.queue(args.renders, args.pending))
+    if 'approve' in scenarios:
+        results.append(bench.approve(args.requests))
+    if 'broadcast' in scenarios:
+        for users in args.users.split(','):
+            results.append(bench.broadcast(int(users)))
+    return results
+
+
+def main():
+    args = parse_args()
+    # Бот работает во временном каталоге, пути к файлам результатов разрешаются заранее
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline = load_baseline(args.baseline) if args.baseline else None
+
+    env = {
+        'BROADCAST_RATE': args.broadcast_rate,
+        'COOLDOWN_BACKEND': args.cooldown_backend,
+        'DATABASE_POOL_MAX': max(args.concurrency * 2, 10),
+    }
+    with environment(args.latency_ms / 1000, args.error_429, args.error_403, env) as (bot, api, api_timer, workdir):
+        from bench.scenarios import Bench
+        results = run(args, Bench(bot, api, api_timer, args.concurrency))
+
+    print(format_table(results, baseline))
+    print(f"Журнал бота: {workdir}/bot.log")
+    if json_path:
+        save_results(json_path, results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
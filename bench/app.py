@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import telebot
+from telebot import apihelper
+
+from bench.fake_api import FakeBotAPI
+from bench.postgres import LocalPostgres
+from bench.stats import ApiTimer
+
+
+# Загрузка бота для замеров.
+# main.py читает настройки из .env в текущем каталоге, поэтому бенчмарк пишет свой .env
+# во временный каталог и переходит в него (туда же попадает bot.log).
+# BOT_MODE=webhook отключает пул потоков TeleBot: обновление обрабатывается в потоке,
+# который вызвал process_new_updates, и время обработки можно измерить.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = '100000001:BENCH'
+
+
+def write_env(workdir, values):
+    with open(os.path.join(workdir, '.env'), 'w', encoding='utf-8') as f:
+        for key, value in values.items():
+            f.write(f"{key}={value}\n")
+
+
+def load_bot(workdir, api_url, database_env, extra_env=None):
+    env = {'TELEGRAM_BOT_CODE': BENCH_TOKEN, 'BOT_MODE': 'webhook'}
+    env.update(database_env)
+    env.update(extra_env or {})
+    write_env(workdir, env)
+
+    apihelper.API_URL = api_url
+    # Соединения с заглушкой переиспользуются, как и с api.telegram.org
+    apihelper.SESSION_TIME_TO_LIVE = None
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    import main
+    main.create_app()
+    return main
+
+
+# Заглушка Bot API, одноразовый PostgreSQL и загруженный бот на время замеров.
+# Возвращает (модуль main, заглушка API, таймер вызовов API, рабочий каталог).
+@contextmanager
+def environment(latency=0.0, error_429=0.0, error_403=0.0, env=None):
+    api = FakeBotAPI(latency=latency, error_429=error_429, error_403=error_403).start()
+    postgres = LocalPostgres().start()
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        bot = load_bot(workdir, api.api_url, postgres.env(), env)
+        api_timer = ApiTimer(apihelper)
+        yield bot, api, api_timer, workdir
+        bot.db.close_all()
+    finally:
+        postgres.stop()
+        api.stop()
+
+
+def message_update(update_id, user_id, text, chat_id=None):
+    return telebot.types.Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id or user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'text': text,
+        },
+    })
+
+
+def callback_update(update_id, user_id, data):
+    return telebot.types.Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'chat_instance': 'bench',
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': 0,
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'bench',
+            },
+        },
+    })
@@ -0,0 +1,161 @@
+import json
+import logging
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Локальная заглушка Bot API.
+# Принимает запросы TeleBot вида /bot<token>/<method>, записывает вызовы и отвечает
+# минимальными корректными объектами. Умеет добавлять задержку ответа, ошибки 429
+# (с retry_after) и 403 (пользователь заблокировал бота).
+
+BOT_ID = 100000001
+# Длина начала ответа, по которому группируются ответы бота
+REPLY_PREFIX = 60
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_429=0.0, error_403=0.0, retry_after=1, seed=1):
+        # latency — задержка ответа в секундах, error_429 — доля ответов 429,
+        # error_403 — доля пользователей, заблокировавших бота
+        self.latency = latency
+        self.error_429 = error_429
+        self.error_403 = error_403
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        # Первые строки отправленных текстов: по ним видно, что отвечал бот (заявка принята, кулдаун и т. д.)
+        self.replies = Counter()
+        self.message_id = 0
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # Формат для telebot.apihelper.API_URL
+    @property
+    def api_url(self):
+        return self.url + "/bot{0}/{1}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-bot-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.replies.clear()
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.handle(self)
+
+            def do_POST(self):
+                api.handle(self)
+
+            def log_message(self, format, *args):
+                logging.debug("fake api: " + format, *args)
+
+        return Handler
+
+    # Параметры TeleBot передает в строке запроса, файлы и JSON — в теле
+    def read_params(self, request):
+        url = urlparse(request.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = request.rfile.read(length)
+            if request.headers.get('Content-Type', '').startswith('application/json'):
+                params.update(json.loads(body))
+        return url.path.rsplit('/', 1)[-1], params
+
+    def handle(self, request):
+        method, params = self.read_params(request)
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[method] += 1
+            throttled = self.error_429 and self.random.random() < self.error_429
+
+        chat_id = params.get('chat_id')
+        if throttled:
+            self.fail(request, method, 429, f"Too Many Requests: retry after {self.retry_after}",
+                      {'retry_after': self.retry_after})
+            return
+        if method.startswith('send') and chat_id is not None and self.is_blocked(chat_id):
+            self.fail(request, method, 403, "Forbidden: bot was blocked by the user")
+            return
+
+        if method == 'sendMessage' and params.get('text'):
+            with self.lock:
+                self.replies[params['text'].strip().split('\n', 1)[0][:REPLY_PREFIX]] += 1
+        self.respond(request, 200, {'ok': True, 'result': self.result(method, params)})
+
+    # Одни и те же пользователи «заблокированы» при каждом запуске (по хэшу chat_id)
+    def is_blocked(self, chat_id):
+        if not self.error_403 or str(chat_id).startswith('-'):
+            return False
+        return zlib.crc32(str(chat_id).encode()) % 10000 < self.error_403 * 10000
+
+    def fail(self, request, method, code, description, parameters=None):
+        with self.lock:
+            self.errors[code] += 1
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        self.respond(request, code, body)
+
+    def respond(self, request, code, body):
+        data = json.dumps(body).encode()
+        request.send_response(code)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'getChat':
+            chat_id = int(params.get('chat_id', 0))
+            return {'id': chat_id, 'type': 'private', 'first_name': f"User{chat_id}", 'username': f"user{chat_id}"}
+        if method.startswith('send') or method.startswith('edit'):
+            return self.message(params)
+        return True
+
+    def message(self, params):
+        with self.lock:
+            self.message_id += 1
+            message_id = self.message_id
+        chat_id = int(params.get('chat_id') or 0)
+        message = {
+            'message_id': int(params.get('message_id') or message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'channel'},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        return message
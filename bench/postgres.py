@@ -0,0 +1,76 @@
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+import psycopg2
+
+
+# Одноразовый PostgreSQL для бенчмарка: кластер создается во временном каталоге,
+# запускается на свободном порту и удаляется после замеров.
+# Каталог с initdb/pg_ctl можно указать в BENCH_PG_BIN.
+
+DATABASE_NAME = 'bench'
+DATABASE_USER = 'bench'
+
+
+def find_bin_dir():
+    candidates = [os.environ.get('BENCH_PG_BIN')]
+    initdb = shutil.which('initdb')
+    if initdb:
+        candidates.append(os.path.dirname(initdb))
+    candidates += sorted(glob.glob('/usr/lib/postgresql/*/bin'), reverse=True)
+    candidates += sorted(glob.glob('/usr/local/opt/postgresql*/bin'), reverse=True)
+    for path in candidates:
+        if path and os.path.exists(os.path.join(path, 'initdb')):
+            return path
+    raise RuntimeError("Не найден initdb. Установите PostgreSQL или укажите каталог в BENCH_PG_BIN")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalPostgres:
+    def __init__(self, bin_dir=None):
+        self.bin_dir = bin_dir or find_bin_dir()
+        self.root = tempfile.mkdtemp(prefix='bench-pg-')
+        self.data_dir = os.path.join(self.root, 'data')
+        self.port = free_port()
+
+    def run(self, tool, *args):
+        subprocess.run([os.path.join(self.bin_dir, tool), *args], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def start(self):
+        self.run('initdb', '-D', self.data_dir, '-U', DATABASE_USER, '--auth=trust', '--encoding=UTF8')
+        # Надежность записи не нужна: кластер удаляется после замеров
+        options = f"-p {self.port} -k {self.root} -c listen_addresses=127.0.0.1 -c fsync=off -c full_page_writes=off"
+        self.run('pg_ctl', '-D', self.data_dir, '-o', options, '-l', os.path.join(self.root, 'postgres.log'), '-w', 'start')
+
+        connection = psycopg2.connect(host='127.0.0.1', port=self.port, user=DATABASE_USER, dbname='postgres')
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {DATABASE_NAME}")
+        connection.close()
+        return self
+
+    def stop(self):
+        try:
+            self.run('pg_ctl', '-D', self.data_dir, '-m', 'fast', '-w', 'stop')
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    # Параметры подключения в формате .env бота
+    def env(self):
+        return {
+            'DATABASE_HOST': '127.0.0.1',
+            'DATABASE_PORT': str(self.port),
+            'DATABASE_NAME': DATABASE_NAME,
+            'DATABASE_USER': DATABASE_USER,
+            'DATABASE_PASSWORD': '',
+        }
@@ -0,0 +1,126 @@
+import argparse
+import heapq
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+
+import update_trace
+from bench.app import environment
+from bench.stats import LatencyRecorder, Result, format_table, save_results
+
+
+# Воспроизведение записанных обновлений (TRACE_FILE) в ускоренном темпе.
+# Интервалы между обновлениями сокращаются в --speed раз, что позволяет повторить
+# пики нагрузки из продакшена (например, массовую отправку заявок перед дедлайном конкурса).
+# Кулдаун отправки заявок по умолчанию тоже сокращается в --speed раз, чтобы доля
+# отклоненных заявок соответствовала реальной.
+# Запуск: python -m bench.replay trace.jsonl --speed 10
+
+TOP_REPLIES = 8
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench.replay', description="Воспроизведение записи обновлений")
+    parser.add_argument('trace', nargs='+', help="файлы JSONL, записанные с TRACE_FILE")
+    parser.add_argument('--speed', type=float, default=1, help="ускорение: 1, 10, 100")
+    parser.add_argument('--concurrency', type=int, default=8, help="число потоков обработки обновлений")
+    parser.add_argument('--moderator', type=int, action='append', default=[],
+                        help="идентификатор модератора из записи (можно указать несколько раз)")
+    parser.add_argument('--cooldown', type=int, help="кулдаун заявок в секундах (по умолчанию из базы, деленный на --speed)")
+    parser.add_argument('--cooldown-backend', default='memory', choices=('memory', 'postgres'))
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа заглушки Bot API")
+    parser.add_argument('--error-429', type=float, default=0, help="доля ответов 429")
+    parser.add_argument('--error-403', type=float, default=0, help="доля пользователей, заблокировавших бота")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    return parser.parse_args()
+
+
+# Записи из нескольких файлов (например, с разных экземпляров бота) объединяются по времени
+def load_trace(paths):
+    return list(heapq.merge(*(update_trace.read(path) for path in paths), key=lambda item: item[0]))
+
+
+def prepare(bot, args):
+    for moderator_id in args.moderator:
+        bot.settings.add_moderator(moderator_id)
+    cooldown = args.cooldown
+    if cooldown is None:
+        cooldown = max(1, round((bot.settings.get_cooldown() or 0) / args.speed))
+    bot.settings.set_cooldown(cooldown)
+    return cooldown
+
+
+def replay(bot, api, api_timer, trace, speed, concurrency):
+    latency = LatencyRecorder()
+    lag = LatencyRecorder()
+    failures = []
+
+    def process(due, update):
+        started = time.perf_counter()
+        lag.add(max(0.0, started - due))
+        try:
+            bot.bot.process_new_updates([update])
+        except Exception:
+            logging.exception("Ошибка обработки обновления %s", update.update_id)
+            failures.append(update.update_id)
+        finally:
+            latency.add(time.perf_counter() - started)
+
+    api.reset()
+    api_timer.recorder.reset()
+    first_ts = trace[0][0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for ts, raw in trace:
+            due = started + (ts - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(process, due, telebot.types.Update.de_json(raw))
+    elapsed = time.perf_counter() - started
+
+    errors = {str(code): count for code, count in api.errors.items()}
+    if failures:
+        errors['handler'] = len(failures)
+    result = Result(f'replay x{speed:g}', len(trace), elapsed, api.total_calls(), latency.summary(),
+                    api_timer.recorder.summary(), errors)
+    return result, lag.summary()
+
+
+def main():
+    args = parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    trace = load_trace([os.path.abspath(path) for path in args.trace])
+    if not trace:
+        raise SystemExit("Запись пуста")
+
+    env = {
+        'COOLDOWN_BACKEND': args.cooldown_backend,
+        'DATABASE_POOL_MAX': max(args.concurrency * 2, 10),
+    }
+    with environment(args.latency_ms / 1000, args.error_429, args.error_403, env) as (bot, api, api_timer, workdir):
+        cooldown = prepare(bot, args)
+        result, lag = replay(bot, api, api_timer, trace, args.speed, args.concurrency)
+        with bot.db.get_cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM requests")
+            saved = cursor.fetchone()[0]
+        replies = api.replies.most_common(TOP_REPLIES)
+
+    duration = trace[-1][0] - trace[0][0]
+    print(f"Обновлений: {len(trace)} за {duration:.1f} с записи, ускорение x{args.speed:g}, кулдаун {cooldown} с")
+    print(format_table([result]))
+    print(f"Отставание от расписания: p50 {lag['p50_ms']} мс, p99 {lag['p99_ms']} мс")
+    print(f"Сохранено заявок: {saved}")
+    print("Частые ответы бота:")
+    for text, count in replies:
+        print(f"  {count:>7}  {text}")
+    print(f"Журнал бота: {workdir}/bot.log")
+    if json_path:
+        save_results(json_path, [result], vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import broadcast
+import cooldown_store
+import db
+import migrations
+
+from bench.app import callback_update, message_update
+from bench.stats import LatencyRecorder, Result
+
+
+# Сценарии бенчмарка. Каждый сценарий начинается с пустых таблиц, заполняет
+# данные одним запросом generate_series и прогоняет обновления через
+# bot.process_new_updates в concurrency потоках (как рабочие потоки вебхука).
+
+MODERATOR_ID = migrations.FIRST_MODERATOR_ID
+# Идентификаторы тестовых пользователей не пересекаются с модератором
+USER_ID_BASE = 500000000
+# Текст заявки проходит проверку check_word_count (от 20 до 400 слов)
+REQUEST_TEXT = ' '.join(f"слово{number}" for number in range(40))
+BROADCAST_TIMEOUT = 3600
+
+
+class Bench:
+    def __init__(self, main, api, api_timer, concurrency=8):
+        self.main = main
+        self.api = api
+        self.api_timer = api_timer
+        self.concurrency = concurrency
+        self.update_ids = itertools.count(1)
+        self.broadcast_started = False
+
+    def reset(self):
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                TRUNCATE requests, requests_archive, request_hash_bands, request_text_buckets, users, broadcast_jobs,
+                         conversation_state, submission_cooldown, outbox, publications,
+                         request_stats_daily, request_stats_decision_times, request_stats_users
+                RESTART IDENTITY
+            """)
+        self.main.state._cache.clear()
+        self.main.name_cache.clear()
+        self.main.submission_cooldown = cooldown_store.create_store(self.main.config.get('COOLDOWN_BACKEND') or 'memory')
+
+    def seed_users(self, count):
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO users (user_id, first_name, username)
+                SELECT %s + g, 'User' || g, 'user' || g FROM generate_series(1, %s) g
+                """,
+                (USER_ID_BASE, count)
+            )
+
+    def seed_pending_requests(self, count):
+        self.seed_users(count)
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO requests (user_id, text, status, time)
+                SELECT %s + g, %s, 1, current_timestamp - (%s - g) * interval '1 second'
+                FROM generate_series(1, %s) g
+                """,
+                (USER_ID_BASE, REQUEST_TEXT, count, count)
+            )
+            cursor.execute("ANALYZE requests, users")
+
+    def message(self, user_id, text):
+        return message_update(next(self.update_ids), user_id, text)
+
+    def callback(self, user_id, data):
+        return callback_update(next(self.update_ids), user_id, data)
+
+    # Прогон обновлений с замером времени обработки каждого
+    def drive(self, name, updates):
+        latency = LatencyRecorder()
+        failures = 0
+
+        def process(update):
+            started = time.perf_counter()
+            try:
+                self.main.bot.process_new_updates([update])
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.update_id)
+                return False
+            finally:
+                latency.add(time.perf_counter() - started)
+            return True
+
+        self.api.reset()
+        self.api_timer.recorder.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for ok in executor.map(process, updates):
+                failures += not ok
+        elapsed = time.perf_counter() - started
+        return self.result(name, len(updates), elapsed, latency.summary(), failures)
+
+    def result(self, name, updates, elapsed, update_latency, failures=0):
+        errors = {str(code): count for code, count in self.api.errors.items()}
+        if failures:
+            errors['handler'] = failures
+        return Result(name, updates, elapsed, self.api.total_calls(), update_latency,
+                      self.api_timer.recorder.summary(), errors)
+
+    # Отправка заявок разными пользователями (send_request)
+    def submit(self, count):
+        self.reset()
+        updates = [self.message(USER_ID_BASE + number, REQUEST_TEXT) for number in range(1, count + 1)]
+        return self.drive('submit', updates)
+
+    # Показ первой страницы очереди модерации при pending заявках в очереди (process_requests)
+    def queue(self, count, pending):
+        self.reset()
+        self.seed_pending_requests(pending)
+        updates = [self.message(MODERATOR_ID, 'Посмотреть заявки') for _ in range(count)]
+        return self.drive(f'queue/{pending}', updates)
+
+    # Одобрение заявок модератором (handle_request_action)
+    def approve(self, count):
+        self.reset()
+        self.seed_pending_requests(count)
+        updates = [self.callback(MODERATOR_ID, f"true_{request_id}") for request_id in range(1, count + 1)]
+        return self.drive('approve', updates)
+
+    # Рассылка users пользователям (send_message_to_all и фоновый обработчик).
+    # Задержка здесь — время отправки одного сообщения рассылки.
+    def broadcast(self, users):
+        self.reset()
+        self.seed_users(users)
+        if not self.broadcast_started:
+            self.main.broadcast_worker.start()
+            self.broadcast_started = True
+
+        self.api.reset()
+        self.api_timer.recorder.reset()
+        started = time.perf_counter()
+        for text in ('Рассылка', REQUEST_TEXT):
+            self.main.bot.process_new_updates([self.message(MODERATOR_ID, text)])
+        self.wait_broadcast()
+        elapsed = time.perf_counter() - started
+        api_latency = self.api_timer.recorder.summary()
+        return self.result(f'broadcast/{users}', users, elapsed, api_latency)
+
+    def wait_broadcast(self):
+        deadline = time.monotonic() + BROADCAST_TIMEOUT
+        while time.monotonic() < deadline:
+            with db.get_cursor() as cursor:
+                cursor.execute("SELECT status FROM broadcast_jobs ORDER BY id DESC LIMIT 1")
+                row = cursor.fetchone()
+            if row and row[0] in (broadcast.DONE, broadcast.CANCELLED):
+                return
+            time.sleep(0.2)
+        raise TimeoutError("Рассылка не завершилась за отведенное время")
@@ -0,0 +1,123 @@
+import json
+import math
+import threading
+import time
+
+
+# Сбор задержек и расчет перцентилей
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    # Метод ближайшего ранга
+    index = min(len(sorted_values), max(1, math.ceil(p / 100 * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples = []
+
+    # Перцентили в миллисекундах
+    def summary(self):
+        with self.lock:
+            values = sorted(self.samples)
+        return {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+
+
+# Время вызовов Bot API со стороны бота: обертка над telebot.apihelper._make_request
+class ApiTimer:
+    def __init__(self, apihelper):
+        self.recorder = LatencyRecorder()
+        self.original = apihelper._make_request
+        apihelper._make_request = self.make_request
+
+    def make_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.original(*args, **kwargs)
+        finally:
+            self.recorder.add(time.perf_counter() - started)
+
+
+class Result:
+    def __init__(self, scenario, updates, elapsed, messages, update_latency, api_latency, errors):
+        self.scenario = scenario
+        self.updates = updates
+        self.elapsed = elapsed
+        self.messages = messages
+        self.update_latency = update_latency
+        self.api_latency = api_latency
+        self.errors = errors
+
+    def as_dict(self):
+        return {
+            'scenario': self.scenario,
+            'updates': self.updates,
+            'elapsed_s': round(self.elapsed, 3),
+            'updates_per_s': round(self.updates / self.elapsed, 1) if self.elapsed else 0.0,
+            'messages': self.messages,
+            'messages_per_s': round(self.messages / self.elapsed, 1) if self.elapsed else 0.0,
+            'latency': self.update_latency,
+            'api_latency': self.api_latency,
+            'errors': self.errors,
+        }
+
+
+COLUMNS = ('scenario', 'updates/s', 'msg/s', 'p50 ms', 'p95 ms', 'p99 ms', 'api p50', 'api p99', '429', '403')
+
+
+def format_table(results, baseline=None):
+    rows = [COLUMNS]
+    for result in results:
+        data = result.as_dict()
+        latency = data['latency']
+        rows.append((
+            data['scenario'],
+            str(data['updates_per_s']),
+            with_delta(data['messages_per_s'], baseline, data['scenario'], lambda b: b['messages_per_s']),
+            str(latency['p50_ms']),
+            str(latency['p95_ms']),
+            with_delta(latency['p99_ms'], baseline, data['scenario'], lambda b: b['latency']['p99_ms']),
+            str(data['api_latency']['p50_ms']),
+            str(data['api_latency']['p99_ms']),
+            str(data['errors'].get('429', 0)),
+            str(data['errors'].get('403', 0)),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+# Изменение относительно прошлого запуска (файл --json предыдущего релиза)
+def with_delta(value, baseline, scenario, getter):
+    previous = baseline.get(scenario) if baseline else None
+    if not previous or not getter(previous):
+        return str(value)
+    change = (value - getter(previous)) / getter(previous) * 100
+    return f"{value} ({change:+.0f}%)"
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return {item['scenario']: item for item in json.load(f)['results']}
+
+
+def save_results(path, results, options):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'options': options, 'results': [result.as_dict() for result in results]}, f,
+                  ensure_ascii=False, indent=2)
@@ -0,0 +1,405 @@
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+import db
+import outbound
+
+
+# Движок рассылки.
+# Каждая рассылка хранится в таблице broadcast_jobs вместе с контрольной точкой:
+# последним users.id, до которого все получатели обработаны (keyset-курсор),
+# и списком id, обработанных вне очереди за этой точкой. Фоновый обработчик
+# забирает задания из таблицы, поэтому после перезапуска рассылка продолжается
+# с места остановки, а уже получившие сообщение пользователи его не получают повторно.
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 500
+# Как часто обновлять сообщение с прогрессом у модератора (секунды)
+PROGRESS_INTERVAL = 5
+# Как часто фоновый обработчик ищет новые задания (секунды)
+POLL_INTERVAL = 2
+# Срок аренды задания: если процесс упал, задание подхватит другой после истечения срока
+LEASE_SECONDS = 60
+# Контрольная точка сохраняется каждые CHECKPOINT_EVERY получателей или CHECKPOINT_INTERVAL секунд
+CHECKPOINT_EVERY = 100
+CHECKPOINT_INTERVAL = 2
+
+# Состояния задания
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+STATUS_NAMES = {
+    RUNNING: 'выполняется',
+    PAUSED: 'приостановлена',
+    CANCELLED: 'отменена',
+    DONE: 'завершена',
+}
+
+
+# Создание задания рассылки; отправку выполнит фоновый обработчик
+def create_job(moder_id, report_chat_id, content):
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM users WHERE NOT blocked")
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            INSERT INTO broadcast_jobs (moder_id, report_chat_id, text, photo, video, total)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+            """,
+            (moder_id, report_chat_id, content.get('text'), content.get('photo'), content.get('video'), total)
+        )
+        return cursor.fetchone()[0]
+
+
+# Смена состояния задания модератором; возвращает False, если переход невозможен
+def set_job_status(job_id, status):
+    allowed_from = {
+        PAUSED: (RUNNING,),
+        RUNNING: (PAUSED,),
+        CANCELLED: (RUNNING, PAUSED),
+    }[status]
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            "UPDATE broadcast_jobs SET status = %s WHERE id = %s AND status = ANY(%s) RETURNING id",
+            (status, job_id, list(allowed_from))
+        )
+        return cursor.fetchone() is not None
+
+
+# Последние задания рассылки для списка у модератора
+def list_jobs(limit=10):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id, status, total, sent, failed, created_at
+            FROM broadcast_jobs
+            ORDER BY id DESC
+            LIMIT %s
+            """,
+            (limit,)
+        )
+        return cursor.fetchall()
+
+
+# Следующая пачка получателей после контрольной точки (keyset-пагинация по users.id)
+def fetch_recipients(after_row, batch_size=DEFAULT_BATCH_SIZE):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            "SELECT id, user_id FROM users WHERE id > %s AND NOT blocked ORDER BY id LIMIT %s",
+            (after_row, batch_size)
+        )
+        return cursor.fetchall()
+
+
+# Пометка пользователей, заблокировавших бота, чтобы следующие рассылки их пропускали
+def mark_blocked(user_ids):
+    if not user_ids:
+        return
+    with db.get_cursor() as cursor:
+        cursor.execute("UPDATE users SET blocked = TRUE WHERE user_id = ANY(%s)", (list(user_ids),))
+
+
+# Отправка содержимого рассылки одному получателю
+def send_content(bot, chat_id, content):
+    if content.get('photo'):
+        bot.send_photo(chat_id, content['photo'], caption=content.get('text'))
+    elif content.get('video'):
+        bot.send_video(chat_id, content['video'], caption=content.get('text'))
+    else:
+        bot.send_message(chat_id, content['text'])
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек."
+    if seconds < 3600:
+        return f"{seconds // 60} мин. {seconds % 60} сек."
+    return f"{seconds // 3600} ч. {seconds % 3600 // 60} мин."
+
+
+# Выполнение одного задания рассылки от контрольной точки до конца или до паузы/отмены
+class Broadcast:
+    def __init__(self, bot, job, worker_id, bucket, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+        self.bot = bot
+        self.job_id = job['id']
+        self.worker_id = worker_id
+        self.content = {'text': job['text'], 'photo': job['photo'], 'video': job['video']}
+        self.report_chat_id = job['report_chat_id']
+        self.progress_message_id = job['progress_message_id']
+        self.bucket = bucket
+        self.workers = workers
+        self.batch_size = batch_size
+        self.total = job['total']
+        self.sent = job['sent']
+        self.failed = job['failed']
+        self.blocked = job['blocked']
+        self.checkpoint = job['last_user_row']
+        # Получатели за контрольной точкой, обработанные раньше предыдущих
+        self.done_ahead = set(job['done_ahead'] or [])
+        self.pending = []
+        # Заблокировавшие бота, еще не отмеченные в users (записываются вместе с контрольной точкой)
+        self.blocked_users = []
+        self.status = RUNNING
+        self.started = time.monotonic()
+        self.done_at_start = self.sent + self.failed
+        self.lock = threading.Lock()
+        self.last_report = 0.0
+        self.report_lock = threading.Lock()
+        self.saved_at = time.monotonic()
+        self.saved_done = self.done_at_start
+
+    # Контрольная точка сохраняется только потоком run: записи идут по порядку,
+    # и более старое состояние не может перезаписать новое
+    def run(self):
+        if self.progress_message_id is None:
+            self.progress_message_id = self.bot.send_message(self.report_chat_id, self.format_progress()).message_id
+            self.save_checkpoint()
+
+        # Число задач в работе ограничено, чтобы не держать в памяти весь список
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast') as executor:
+            after_row = self.checkpoint
+            while self.status == RUNNING:
+                batch = fetch_recipients(after_row, self.batch_size)
+                if not batch:
+                    break
+                for row_id, uid in batch:
+                    if self.status != RUNNING:
+                        break
+                    after_row = row_id
+                    if row_id in self.done_ahead:
+                        continue
+                    # Пока все места заняты (например, общее ведро выдерживает 429), аренда продлевается
+                    while not in_flight.acquire(timeout=CHECKPOINT_INTERVAL):
+                        self.save_checkpoint()
+                    self.maybe_save_checkpoint()
+                    if self.status != RUNNING:
+                        in_flight.release()
+                        break
+                    with self.lock:
+                        self.pending.append(row_id)
+                    future = executor.submit(self.deliver, uid)
+                    future.add_done_callback(lambda f, row_id=row_id, uid=uid: self.on_done(f, row_id, uid, in_flight))
+        self.finish(after_row)
+
+    def maybe_save_checkpoint(self):
+        with self.lock:
+            done = self.sent + self.failed
+        if done - self.saved_done >= CHECKPOINT_EVERY or time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+            self.save_checkpoint()
+
+    # Завершение прохода: итоговая контрольная точка и отчет модератору
+    def finish(self, after_row):
+        # Состояние, которое видел обработчик: итоговое сохранение меняет состояние,
+        # только если модератор не изменил его с тех пор (например, не возобновил паузу)
+        observed = self.status
+        if self.status == RUNNING:
+            # Контрольная точка переносится за последнего пользователя: задание выполнено
+            with self.lock:
+                self.checkpoint = max([self.checkpoint, after_row] + list(self.done_ahead))
+                self.done_ahead.clear()
+            self.status = DONE
+        if self.status is None:
+            logging.warning("Рассылка #%s: аренда задания потеряна, выполнение остановлено", self.job_id)
+            return
+        self.save_checkpoint(final=True, observed=observed)
+        if self.status == RUNNING:
+            # Рассылку возобновили после паузы: аренда снята, и задание продолжит следующий проход
+            logging.info("Рассылка #%s возобновлена до завершения прохода", self.job_id)
+            return
+        self.report(final=True)
+        logging.info("Рассылка #%s: %s, отправлено %s, ошибок %s, заблокировали бота %s",
+                     self.job_id, self.status, self.sent, self.failed, self.blocked)
+
+    # Отправка одному пользователю; возвращает итог отправки.
+    # Лимит скорости и повторы после ответа 429 обеспечивает outbound.OutboundClient.
+    @outbound.with_priority(outbound.BROADCAST)
+    def deliver(self, uid):
+        try:
+            send_content(self.bot, uid, self.content)
+            return 'sent'
+        except ApiTelegramException as e:
+            if e.error_code == 403:
+                return 'blocked'
+            logging.warning("Ошибка рассылки пользователю %s: %s", uid, e)
+            return 'failed'
+        except Exception as e:
+            logging.warning("Ошибка рассылки пользователю %s: %s", uid, e)
+            return 'failed'
+
+    def on_done(self, future, row_id, uid, in_flight):
+        in_flight.release()
+        result = future.result()
+        self.record(row_id, result, uid)
+        self.report()
+
+    # Учет итога отправки и сдвиг контрольной точки
+    def record(self, row_id, result, uid=None):
+        with self.lock:
+            if result == 'sent':
+                self.sent += 1
+            else:
+                self.failed += 1
+                if result == 'blocked':
+                    self.blocked += 1
+                    self.blocked_users.append(uid)
+            # Контрольная точка сдвигается, только когда обработаны все получатели перед ней
+            self.pending.remove(row_id)
+            self.done_ahead.add(row_id)
+            watermark = min(self.pending) if self.pending else None
+            for done_row in sorted(self.done_ahead):
+                if watermark is not None and done_row > watermark:
+                    break
+                self.checkpoint = done_row
+                self.done_ahead.discard(done_row)
+
+    # Сохранение контрольной точки и счетчиков; заодно продлевается аренда
+    # и читается состояние задания (пауза или отмена модератором)
+    def save_checkpoint(self, final=False, observed=None):
+        with self.lock:
+            values = (self.checkpoint, sorted(self.done_ahead), self.sent, self.failed, self.blocked,
+                      self.progress_message_id)
+            blocked_users, self.blocked_users = self.blocked_users, []
+            self.saved_at = time.monotonic()
+            self.saved_done = self.sent + self.failed
+        with db.get_cursor() as cursor:
+            if blocked_users:
+                cursor.execute("UPDATE users SET blocked = TRUE WHERE user_id = ANY(%s)", (blocked_users,))
+            if final:
+                cursor.execute(
+                    """
+                    UPDATE broadcast_jobs
+                    SET last_user_row = %s, done_ahead = %s, sent = %s, failed = %s, blocked = %s,
+                        progress_message_id = %s, locked_by = NULL, locked_until = NULL,
+                        status = CASE WHEN status = %s THEN %s ELSE status END,
+                        finished_at = CASE WHEN status = %s AND %s = 'done' THEN current_timestamp
+                                           ELSE finished_at END
+                    WHERE id = %s AND locked_by = %s
+                    RETURNING status
+                    """,
+                    values + (observed, self.status, observed, self.status, self.job_id, self.worker_id)
+                )
+            else:
+                cursor.execute(
+                    """
+                    UPDATE broadcast_jobs
+                    SET last_user_row = %s, done_ahead = %s, sent = %s, failed = %s, blocked = %s,
+                        progress_message_id = %s,
+                        locked_until = current_timestamp + %s * interval '1 second'
+                    WHERE id = %s AND locked_by = %s
+                    RETURNING status
+                    """,
+                    values + (LEASE_SECONDS, self.job_id, self.worker_id)
+                )
+            row = cursor.fetchone()
+        if row is None:
+            # Задание перехвачено другим процессом после истечения аренды
+            self.status = None
+        else:
+            self.status = row[0]
+
+    def format_progress(self, final=False):
+        done = self.sent + self.failed
+        remaining = max(self.total - done, 0)
+        elapsed = time.monotonic() - self.started
+        if final:
+            title = f"Рассылка #{self.job_id} {STATUS_NAMES.get(self.status, self.status)}."
+        else:
+            title = f"Рассылка #{self.job_id} выполняется..."
+        text = (f"{title}\nОтправлено: {self.sent}\nОшибок: {self.failed} "
+                f"(заблокировали бота: {self.blocked})\nОсталось: {remaining}")
+        done_now = done - self.done_at_start
+        if not final and done_now:
+            text += f"\nОсталось времени: ~{format_duration(elapsed / done_now * remaining)}"
+        if not final:
+            text += f"\nПауза: /pause {self.job_id}  Отмена: /cancel {self.job_id}"
+        return text
+
+    # Обновление сообщения с прогрессом у модератора не чаще раза в PROGRESS_INTERVAL секунд
+    def report(self, final=False):
+        # Промежуточный отчет пропускается, если его уже отправляет другой поток
+        if not self.report_lock.acquire(blocking=final):
+            return
+        try:
+            now = time.monotonic()
+            if not final and now - self.last_report < PROGRESS_INTERVAL:
+                return
+            self.last_report = now
+            self.bot.edit_message_text(self.format_progress(final), chat_id=self.report_chat_id,
+                                       message_id=self.progress_message_id)
+        except ApiTelegramException as e:
+            # Текст не изменился или сообщение удалено — прогресс не критичен
+            logging.debug("Не удалось обновить прогресс рассылки: %s", e)
+        finally:
+            self.report_lock.release()
+
+
+# Фоновый обработчик: забирает активные задания из таблицы и выполняет их по одному.
+# Не зависит от обработчика чата модератора и переживает перезапуск процесса.
+class BroadcastWorker:
+    # bucket — общее ведро токенов outbound.OutboundClient
+    def __init__(self, bot, bucket, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+        self.bot = bot
+        self.bucket = bucket
+        self.workers = workers
+        self.batch_size = batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.wakeup = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='broadcast-worker', daemon=True)
+        thread.start()
+        return thread
+
+    # Разбудить обработчик сразу после создания или возобновления задания
+    def notify(self):
+        self.wakeup.set()
+
+    # Захват следующего активного задания, аренда которого свободна или истекла
+    def claim_job(self):
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE broadcast_jobs
+                SET locked_by = %s, locked_until = current_timestamp + %s * interval '1 second'
+                WHERE id = (
+                    SELECT id FROM broadcast_jobs
+                    WHERE status = 'running' AND (locked_until IS NULL OR locked_until < current_timestamp)
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, report_chat_id, progress_message_id, text, photo, video,
+                          total, sent, failed, blocked, last_user_row, done_ahead
+                """,
+                (self.worker_id, LEASE_SECONDS)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [column[0] for column in cursor.description]
+            return dict(zip(columns, row))
+
+    def run(self):
+        while True:
+            try:
+                job = self.claim_job()
+                if job is None:
+                    self.wakeup.wait(POLL_INTERVAL)
+                    self.wakeup.clear()
+                    continue
+                logging.info("Рассылка #%s: запуск с контрольной точки %s", job['id'], job['last_user_row'])
+                Broadcast(self.bot, job, self.worker_id, self.bucket, self.workers, self.batch_size).run()
+            except Exception:
+                logging.exception("Ошибка фонового обработчика рассылок")
+                time.sleep(POLL_INTERVAL)
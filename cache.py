@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Потокобезопасный LRU-кэш с ограниченным временем жизни записей.
+# Счетчики попаданий и промахов доступны через stats().
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Значение по ключу или default, если записи нет или она устарела
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    # Значение без учета в статистике и без продления (для сравнения перед записью)
+    def peek(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return item[0]
+            return None
+
+    def pop(self, key):
+        with self.lock:
+            item = self.data.pop(key, None)
+            return item[0] if item else None
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,93 @@
+import heapq
+import threading
+import time
+
+import db
+
+
+# Хранилища кулдауна отправки заявок.
+# Оба хранилища реализуют acquire(user_id, window): если с прошлой отправки
+# пользователя прошло не меньше window секунд, отправка фиксируется и возвращается 0,
+# иначе возвращается число секунд до конца ожидания. Проверка и запись атомарны.
+# release(user_id) отменяет зафиксированную отправку, если заявку не удалось сохранить.
+
+
+# Хранилище в памяти процесса. Записи удаляются по истечении окна кулдауна
+# (очередь с приоритетом по времени отправки), поэтому размер ограничен
+# числом пользователей, отправивших заявку за последние window секунд.
+# Истечение считается по текущему окну: если модератор увеличил кулдаун,
+# записи живут дольше, и пользователь не отправит заявку раньше нового срока.
+class MemoryCooldownStore:
+    def __init__(self):
+        self.last_sent = {}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def purge(self, now, window):
+        while self.sent and self.sent[0][0] + window <= now:
+            sent_at, user_id = heapq.heappop(self.sent)
+            # Запись могла обновиться после постановки в очередь
+            if self.last_sent.get(user_id) == sent_at:
+                del self.last_sent[user_id]
+
+    def acquire(self, user_id, window):
+        now = time.monotonic()
+        with self.lock:
+            self.purge(now, window)
+            sent_at = self.last_sent.get(user_id)
+            if sent_at is not None and now - sent_at < window:
+                return window - (now - sent_at)
+            self.last_sent[user_id] = now
+            heapq.heappush(self.sent, (now, user_id))
+            return 0
+
+    # Запись в очереди отправок удалится сама: время в ней не совпадет с last_sent
+    def release(self, user_id):
+        with self.lock:
+            self.last_sent.pop(user_id, None)
+
+    def __len__(self):
+        return len(self.last_sent)
+
+
+# Хранилище в PostgreSQL, общее для всех процессов бота.
+# Проверка и обновление выполняются одним условным upsert за один запрос:
+# строка обновляется, только если окно кулдауна истекло.
+class PostgresCooldownStore:
+    def acquire(self, user_id, window):
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                WITH acquired AS (
+                    INSERT INTO submission_cooldown (user_id, last_sent_at)
+                    VALUES (%(user_id)s, clock_timestamp())
+                    ON CONFLICT (user_id) DO UPDATE SET last_sent_at = EXCLUDED.last_sent_at
+                    WHERE submission_cooldown.last_sent_at <= EXCLUDED.last_sent_at - %(window)s * interval '1 second'
+                    RETURNING 0::float AS remaining
+                )
+                SELECT remaining FROM acquired
+                UNION ALL
+                SELECT greatest(extract(epoch FROM last_sent_at + %(window)s * interval '1 second' - clock_timestamp())::float, 1)
+                FROM submission_cooldown
+                WHERE user_id = %(user_id)s AND NOT EXISTS (SELECT 1 FROM acquired)
+                """,
+                {'user_id': user_id, 'window': window}
+            )
+            row = cursor.fetchone()
+        # Строки нет, если параллельная отправка того же пользователя только что заняла окно
+        if row is None:
+            return window
+        return row[0]
+
+    # Пока окно занято, другие отправки пользователя не меняют строку, поэтому удаляется именно эта отправка
+    def release(self, user_id):
+        with db.get_cursor() as cursor:
+            cursor.execute("DELETE FROM submission_cooldown WHERE user_id = %s", (user_id,))
+
+
+def create_store(backend):
+    if backend == 'postgres':
+        return PostgresCooldownStore()
+    if backend == 'memory':
+        return MemoryCooldownStore()
+    raise ValueError(f"Неизвестное хранилище кулдауна: {backend}")
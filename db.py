@@ -0,0 +1,236 @@
+import functools
+import logging
+import re
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+import metrics
+
+
+# Пул соединений с PostgreSQL.
+# Каждый обработчик берет из пула собственное соединение и курсор, поэтому
+# потоки TeleBot не ждут друг друга на одном соединении, а ошибка в одном
+# обработчике не оставляет прерванную транзакцию остальным.
+
+# Соединение, простаивавшее дольше этого времени, проверяется перед выдачей
+IDLE_CHECK_SECONDS = 30
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+_last_used = {}
+_params = {}
+_in_use = 0
+_in_use_lock = threading.Lock()
+
+_QUERY_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+"?(\w+)', re.IGNORECASE)
+
+
+# Метка запроса для метрик: команда и первая таблица (SELECT requests, UPDATE broadcast_jobs)
+@functools.lru_cache(maxsize=1024)
+def query_label(query):
+    words = query.split(None, 1)
+    if not words:
+        return 'EMPTY'
+    table = _QUERY_TABLE.search(query)
+    return f"{words[0].upper()} {table.group(1)}" if table else words[0].upper()
+
+
+# Курсор с замером времени каждого запроса
+class TimedCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        label = query_label(query) if isinstance(query, str) else 'SQL'
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except psycopg2.Error:
+            metrics.DB_QUERY_ERRORS.inc(query=label)
+            raise
+        finally:
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started, query=label)
+
+
+# Сохранение настроек подключения (из .env)
+def configure(config):
+    global _slots
+    _params.clear()
+    _params.update(
+        host=config['DATABASE_HOST'],
+        port=config['DATABASE_PORT'],
+        database=config['DATABASE_NAME'],
+        user=config['DATABASE_USER'],
+        password=config['DATABASE_PASSWORD'],
+    )
+    _params['minconn'] = int(config.get('DATABASE_POOL_MIN') or 1)
+    _params['maxconn'] = max(int(config.get('DATABASE_POOL_MAX') or 10), _params['minconn'])
+    # Семафор ограничивает число одновременно выданных соединений:
+    # при исчерпании пула поток ждет, а не получает PoolError
+    _slots = threading.BoundedSemaphore(_params['maxconn'])
+
+
+def pool_size():
+    return _params.get('maxconn', 0)
+
+
+# Параметры подключения без настроек пула (для соединений вне пула)
+def connection_params():
+    return {key: value for key, value in _params.items() if key not in ('minconn', 'maxconn')}
+
+
+# Число выданных соединений (для метрик)
+def in_use():
+    return _in_use
+
+
+# Ленивое создание пула при первом обращении
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                params = dict(_params)
+                minconn = params.pop('minconn')
+                maxconn = params.pop('maxconn')
+                _pool = pool.ThreadedConnectionPool(minconn, maxconn, **params)
+    return _pool
+
+
+# Проверка, что сервер не закрыл соединение, пока оно лежало в пуле
+def _is_alive(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < IDLE_CHECK_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+# Выдача живого соединения; разорванные соединения закрываются и заменяются новыми
+def _checkout():
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    while not _is_alive(conn):
+        logging.warning("Соединение с базой данных потеряно, переподключение")
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+        conn = db_pool.getconn()
+    return conn
+
+
+def _release(conn, broken=False):
+    if broken or conn.closed:
+        _last_used.pop(id(conn), None)
+        get_pool().putconn(conn, close=True)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+        get_pool().putconn(conn)
+
+
+# Контекстный менеджер: соединение из пула + курсор.
+# При успешном выходе транзакция фиксируется, при ошибке откатывается.
+# name задает серверный (именованный) курсор для построчной выборки больших таблиц.
+@contextmanager
+def get_cursor(name=None):
+    global _in_use
+    with metrics.DB_POOL_WAIT_SECONDS.time():
+        _slots.acquire()
+    with _in_use_lock:
+        _in_use += 1
+    try:
+        conn = _checkout()
+        broken = False
+        try:
+            with conn.cursor(name=name, cursor_factory=TimedCursor) as cursor:
+                yield cursor
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            _release(conn, broken)
+    finally:
+        with _in_use_lock:
+            _in_use -= 1
+        _slots.release()
+
+
+# Закрытие всех соединений пула (при остановке бота)
+def close_all():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+
+# Подписка на уведомления PostgreSQL (LISTEN/NOTIFY) в отдельном потоке.
+# Для прослушивания используется отдельное соединение вне пула в режиме autocommit.
+# После каждого подключения обработчики вызываются с payload=None: уведомления,
+# пришедшие до LISTEN или во время обрыва, потеряны, и данные нужно перечитать целиком.
+class Listener:
+    def __init__(self, poll_timeout=5):
+        self.poll_timeout = poll_timeout
+        self.callbacks = {}
+        self.thread = None
+
+    def subscribe(self, channel, callback):
+        self.callbacks.setdefault(channel, []).append(callback)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='pg-listener', daemon=True)
+            self.thread.start()
+        return self.thread
+
+    def connect(self):
+        conn = psycopg2.connect(**connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for channel in self.callbacks:
+                cursor.execute(f'LISTEN "{channel}"')
+        return conn
+
+    def dispatch(self, channel, payload):
+        for callback in self.callbacks.get(channel, []):
+            try:
+                callback(channel, payload)
+            except Exception:
+                logging.exception("Ошибка обработчика уведомления %s", channel)
+
+    def run(self):
+        while True:
+            try:
+                conn = self.connect()
+                for channel in self.callbacks:
+                    self.dispatch(channel, None)
+                while True:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.dispatch(notify.channel, notify.payload)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logging.warning("Соединение для LISTEN потеряно: %s", e)
+                time.sleep(self.poll_timeout)
+
+
+# Общий слушатель уведомлений процесса
+listener = Listener()
+
+metrics.QUEUE_DEPTH.track(in_use, queue='db_connections')
@@ -0,0 +1,162 @@
+import functools
+import importlib.util
+import logging
+from io import BytesIO
+
+
+# Поиск повторно присланных фото и видео.
+# Для фото считается перцептивный хеш dHash на 64 бита: пережатая, уменьшенная или
+# пересохраненная копия изображения дает хеш, отличающийся лишь в нескольких битах.
+# Хеш делится на полосы по 16 бит, полосы хранятся в таблице request_hash_bands под индексом.
+# Если хеши отличаются не более чем в MAX_DISTANCE битах, хотя бы одна полоса совпадает целиком,
+# поэтому кандидаты находятся поиском по индексу, а не перебором всех заявок.
+# Видео сравниваются по отпечатку (размер, длительность, разрешение), фото — еще и по file_unique_id.
+# Повтор ссылается на первую заявку (duplicate_of). Если первая заявка ждет решения, повтор
+# скрыт под ее карточкой (collapsed) и не показывается в очереди модерации отдельно.
+
+HASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+BAND_MASK = (1 << BAND_BITS) - 1
+# При BAND_COUNT полосах совпадение хотя бы одной гарантировано для BAND_COUNT - 1 отличающихся бит
+MAX_DISTANCE = BAND_COUNT - 1
+# Ограничение числа кандидатов на случай однотонных картинок с одинаковыми полосами
+MAX_CANDIDATES = 200
+
+FIND_BY_KEY = "SELECT coalesce(duplicate_of, id) FROM requests WHERE media_key = %s ORDER BY id LIMIT 1"
+
+FIND_BY_BANDS = f"""
+    SELECT DISTINCT r.id, coalesce(r.duplicate_of, r.id), r.photo_hash
+    FROM request_hash_bands b JOIN requests r ON r.id = b.request_id
+    WHERE (b.band, b.value) IN ({', '.join(['(%s, %s)'] * BAND_COUNT)})
+    ORDER BY r.id
+    LIMIT {MAX_CANDIDATES}
+"""
+
+# Первая заявка ждет решения. Блокировка строки FOR SHARE не дает решению по ней зафиксироваться
+# раньше вставки повтора: решение, принятое после, находит повтор запросом RESOLVE_DUPLICATES
+PRIMARY_PENDING = "SELECT status = 1 FROM requests WHERE id = %s FOR SHARE"
+
+INSERT_BANDS = ("INSERT INTO request_hash_bands (band, value, request_id) VALUES "
+                + ', '.join(['(%s, %s, %s)'] * BAND_COUNT))
+
+# Повторы, ожидающие модерации, получают решение вместе с первыми заявками:
+# при отклонении — ту же причину, при одобрении — отказ со ссылкой на одобренную заявку
+RESOLVE_DUPLICATES = """
+    UPDATE requests SET status = 3, rejection_reason = %s, decided_at = current_timestamp
+    WHERE duplicate_of = ANY(%s) AND status = 1
+    RETURNING id, user_id, rejection_reason
+"""
+
+RESOLVE_APPROVED_DUPLICATES = """
+    UPDATE requests SET status = 3, rejection_reason = 'Повтор заявки #' || duplicate_of || ', которая уже одобрена.',
+                        decided_at = current_timestamp
+    WHERE duplicate_of = ANY(%s) AND status = 1
+    RETURNING id, user_id, rejection_reason
+"""
+
+
+# Отпечаток медиа для точного совпадения
+def media_key(message):
+    if message.photo:
+        return f"photo:{message.photo[-1].file_unique_id}"
+    if message.video:
+        video = message.video
+        if video.file_size:
+            return f"video:{video.file_size}:{video.duration}:{video.width}x{video.height}"
+        return f"video:{video.file_unique_id}"
+    return None
+
+
+# Для хеша достаточно самой маленькой копии фото, которую хранит Telegram
+def thumbnail_file_id(message):
+    return message.photo[0].file_id if message.photo else None
+
+
+# dHash: изображение уменьшается до 9x8 в оттенках серого, каждый бит — сравнение соседних пикселей.
+# Значение приводится к диапазону BIGINT со знаком.
+# Pillow загружается при первом хешировании: без него фото сравниваются только по file_unique_id.
+def dhash(data):
+    from PIL import Image
+
+    image = Image.open(BytesIO(data)).convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+# Установлен ли Pillow; без него фото не скачиваются для хеша, сравнение идет только по file_unique_id
+@functools.cache
+def can_hash():
+    available = importlib.util.find_spec('PIL') is not None
+    if not available:
+        logging.warning("Pillow не установлен: повторные фото ищутся только по file_unique_id")
+    return available
+
+
+def photo_hash(data):
+    try:
+        return dhash(data)
+    except Exception as err:
+        logging.warning("Не удалось посчитать хеш фото: %s", err)
+        return None
+
+
+def bands(value):
+    value &= (1 << HASH_BITS) - 1
+    return [(band, (value >> (band * BAND_BITS)) & BAND_MASK) for band in range(BAND_COUNT)]
+
+
+def distance(a, b):
+    return bin((a ^ b) & ((1 << HASH_BITS) - 1)).count('1')
+
+
+def band_params(value):
+    return [part for band in bands(value) for part in band]
+
+
+def insert_band_params(value, request_id):
+    return [part for band, band_value in bands(value) for part in (band, band_value, request_id)]
+
+
+# Первая заявка, на которую похожа новая: ближайший кандидат, а из равных — самый ранний
+def pick_duplicate(value, candidates):
+    best = None
+    for request_id, original_id, candidate_hash in candidates:
+        if candidate_hash is None:
+            continue
+        candidate_distance = distance(value, candidate_hash)
+        if candidate_distance <= MAX_DISTANCE and (best is None or (candidate_distance, original_id) < best):
+            best = (candidate_distance, original_id)
+    return best[1] if best else None
+
+
+# Поиск первой заявки с тем же медиа: сначала по отпечатку, затем по полосам хеша фото
+def find_duplicate(cursor, key, value):
+    if key:
+        cursor.execute(FIND_BY_KEY, (key,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+    if value is None:
+        return None
+    cursor.execute(FIND_BY_BANDS, band_params(value))
+    return pick_duplicate(value, cursor.fetchall())
+
+
+# Повтор скрывается под карточкой первой заявки, только пока она ждет решения
+# (первая заявка могла быть уже рассмотрена и перенесена в архив)
+def is_collapsed(cursor, duplicate_of):
+    if duplicate_of is None:
+        return False
+    cursor.execute(PRIMARY_PENDING, (duplicate_of,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def index_request(cursor, request_id, value):
+    if value is not None:
+        cursor.execute(INSERT_BANDS, insert_band_params(value, request_id))
@@ -1,19 +1,42 @@
-import os
 import time
+# Начало импорта (для замера этапов запуска, см. create_app)
+import_started = time.perf_counter()
+import os
+import sys
 import logging
 import psycopg2
-from io import BytesIO
-from PIL import Image
+import db
+import metrics
+import broadcast
+import migrations
+import settings
+import cooldown_store
+import webhook
+import state
+import update_trace
+import dedup
+import similarity
+import outbound
+import outbox
+import publications
+import partitions
+import write_batch
+import stats
+from router import Router
+from cache import TTLCache
+from requests import RequestException
 from datetime import datetime
+from zoneinfo import ZoneInfo
 import telebot
 from telebot import types
-from telegram import Update
-from telegram.ext import Updater, CommandHandler, MessageHandler, CallbackContext
 from dotenv import  dotenv_values
 
 # Загружаем переменные с .env файла
 config = dotenv_values(".env")
 
+#Логирование
+logging.basicConfig(filename='bot.log', level=logging.INFO)
+
 
 # Свои настройки PostgreSQL
 db_host = (config['DATABASE_HOST'])
@@ -24,148 +47,61 @@ db_password = (config['DATABASE_PASSWORD'])
 
 # Вставить API token нашего бота
 token = (config['TELEGRAM_BOT_CODE'])
-bot = telebot.TeleBot(token)
-
-# Соединение с базой данных
-conn = psycopg2.connect(
-    host=db_host,
-    port = db_port,
-    database=db_name,
-    user=db_user,
-    password=db_password
-)
-cursor = conn.cursor()
-
-# Создание базы данных ниже
-# Таблица для хранения заявок
-cursor.execute(
-    """
-    CREATE TABLE IF NOT EXISTS requests (
-        id SERIAL PRIMARY KEY,
-        user_id BIGINT,
-        text TEXT,
-        photo TEXT,
-        video TEXT,
-        status INTEGER,
-        rejection_reason TEXT,
-        time TIMESTAMP DEFAULT current_timestamp
-    );
-    """
-)
-
-# Таблица для хранения информации о пользователе
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        user_id BIGINT
-    );
-''')
-
-# Создание таблицы модераторов, если она не существует
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS moderators (
-        id SERIAL PRIMARY KEY,
-        moder_id BIGINT
-    );
-''')
-
-# Создание таблицы групп, если она не существует
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS groups (
-        id SERIAL PRIMARY KEY,
-        group_id BIGINT
-    );
-''')
-
-# Создание таблицы кулдауна, если она не существует
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS cooldown (
-        id SERIAL PRIMARY KEY,
-        cooldown_value BIGINT
-    );
-''')
-
-conn.commit()
-
-
-#Одноразовый запуск
-# Функция для вставки данных в таблицу
-def insert_data(cursor, table_name, column_name, value):
-    try:
-        insert_query = f"INSERT INTO {table_name} ({column_name}) VALUES (%s) ON CONFLICT DO NOTHING;" #Если группа, модератор и кулдаун уже определены, база данных не будет изменена
-        cursor.execute(insert_query, (value,))
-        conn.commit()
-        print(f"Данные успешно вставлены в таблицу {table_name}.")
-    except Exception as e:
-        conn.rollback()
-        print(f"Ошибка: {e}")
 
-# Вставка группы в таблицу "groups"
-group_id = -1001965855664
-insert_data(cursor, 'groups', 'group_id', group_id)
+# Пул соединений с базой данных (размер пула задается DATABASE_POOL_MIN/DATABASE_POOL_MAX)
+db.configure(config)
 
-# Вставка значения cooldown в таблицу "cooldown"
-cooldown_int = 60
-insert_data(cursor, 'cooldown', 'cooldown_value', cooldown_int)
+# Режим получения обновлений: polling (long polling), webhook или async (python-telegram-bot, см. aio_runtime)
+bot_mode = config.get('BOT_MODE') or 'polling'
 
-# Вставка модератора в таблицу "moderators"
-first_moder_id = 1732450131
-insert_data(cursor, 'moderators', 'moder_id', first_moder_id)
+# Число рабочих потоков TeleBot; по умолчанию равно размеру пула соединений.
+# В режимах webhook и async обработчики выполняются в чужих потоках, собственный пул TeleBot не нужен.
+num_threads = int(config.get('TELEGRAM_NUM_THREADS') or db.pool_size())
+bot = telebot.TeleBot(token, threaded=bot_mode not in ('webhook', 'async'), num_threads=num_threads)
 
 
 
-#Телеграм-бот 
-
-# Извлечение идентификаторов модераторов из базы данных и заполнение списка moderator_ids
-def retrieve_moderator_ids(cursor):
-    # SQL-запрос для извлечения идентификаторов модераторов
-    cursor.execute("SELECT moder_id FROM moderators")
-    moderator_records = cursor.fetchall()
-
-    # Извлечение идентификаторов модераторов из записей и сохранение их в списке moderator_ids
-    moderator_ids = [record[0] for record in moderator_records]
-
-    return moderator_ids
 
+#Телеграм-бот 
 
-#Получение модераторов
-moderator_ids = retrieve_moderator_ids(cursor)
+# Настройки (кулдаун, группа для публикаций, модераторы) читаются из кэша settings,
+# который обновляется через LISTEN/NOTIFY при изменении в любом процессе бота
 
-# Получение данных
-def retrieve_data(cursor, table, column, record_id):
-    # SQL-запрос с параметрами
-    query = f'SELECT {column} FROM "{table}" WHERE id = %s;'
+# Многошаговые диалоги
+# Следующий шаг диалога хранится в state (PostgreSQL + кэш), а не в памяти TeleBot,
+# поэтому диалог переживает перезапуск и продолжается в любом процессе бота.
+step_handlers = {}
 
-    # Параметры для запроса
-    params = (record_id,)
+# Регистрация функции как шага диалога (по имени функции)
+def step_handler(handler):
+    step_handlers[handler.__name__] = handler
+    return handler
 
-    # Выполнение запроса и получение результата
-    cursor.execute(query, params)
-    result = cursor.fetchone()
+# Замена bot.register_next_step_handler: следующий ответ пользователя попадет в handler
+def next_step(message, handler, **data):
+    state.set_state(message.chat.id, message.from_user.id, handler.__name__, **data)
 
-    # Получение значения из результата или None, если нет данных
-    return result[0] if result else None
+# Обработчик шагов проверяется первым, как и next step handlers в TeleBot
+@bot.message_handler(content_types=['text', 'photo', 'video'], func=lambda message: message.chat.type == 'private' and state.get_state(message.chat.id, message.from_user.id) is not None)
+def handle_next_step(message):
+    current = state.pop_state(message.chat.id, message.from_user.id)
+    if current is None:
+        return
+    name, data = current
+    step_handlers[name](message, **data)
 
-# идентификатор чата группы для отправки сообщения
-# Вызов функции для безопасного получения other_group_chat_id
-other_group_chat_id = [retrieve_data(cursor, 'groups', 'group_id', 1)] # Если у заказчика будет 1 группа    
 
-# Функция получения кулдауна из базы данных
-def get_cooldown_value_from_db():
-    cursor.execute("SELECT cooldown_value FROM cooldown WHERE id = 1")
-    result = cursor.fetchone()
-    if result:
-        return result[0]
-    return None
+# Кнопки меню: один обработчик TeleBot и словарь «надпись -> обработчик».
+# Регистрируется сразу после шагов диалога, до обработчика заявок.
+router = Router(bot, settings.is_moderator)
+router.register()
 
-#Логирование
-logging.basicConfig(filename='bot.log', level=logging.INFO)
 
 #Получение команды
 @bot.message_handler(commands=['get'])
 def send_chat_id(message):
-    # Проверьте, есть ли пользователь, отправивший команду, в списке moderator_ids
-    if message.from_user.id in moderator_ids:
+    # Проверьте, есть ли пользователь, отправивший команду, среди модераторов
+    if settings.is_moderator(message.from_user.id):
         # Проверьте, находится ли сообщение в групповом или супергрупповом чате
         if message.chat.type in ["group", "supergroup"]:
             # Отправьте идентификатор чата пользователю в личном сообщении.
@@ -189,13 +125,34 @@ user_buttons = ["Отправить материал", "О нас", "Конта
 start_menu_keyboard = create_keyboard(user_buttons)
 
 # Клавиатура модератора
-moderator_buttons = ["Посмотреть заявки", "Рассылка", "Настройка бота", "Публикация на канале",]
+moderator_buttons = ["Посмотреть заявки", "Рассылка", "Настройка бота", "Публикация на канале", "Очередь публикаций", "Статистика",]
 moderator_keyboard = create_keyboard(moderator_buttons)
 
 # Настройки бота у модератора
 settings_buttons = ["Добавить модератора", "Изменить группу", "Изменить интервал отправки заявок", "Вернуться Назад"]
 settings_keyboard = create_keyboard(settings_buttons)
 
+# Клавиатура раздела «Отправить материал»
+send_material_keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+send_material_keyboard.add(types.KeyboardButton(text='Оставить заявку'), types.KeyboardButton(text='Выход в главное меню'))
+
+# Клавиатура с единственной кнопкой выхода в главное меню
+exit_to_menu_keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+exit_to_menu_keyboard.add(types.KeyboardButton(text='Выход в главное меню'))
+
+# Клавиатура с кнопкой возврата в меню модератора
+back_keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+back_keyboard.add(types.KeyboardButton(text='Вернуться Назад'))
+
+# Ссылки раздела «О нас»
+about_keyboard = types.InlineKeyboardMarkup()
+about_keyboard.add(types.InlineKeyboardButton(text='Ссылка на наш сайт', url="https://kz.kursiv.media/"))
+
+# Ссылки раздела «Контакты»
+contacts_keyboard = types.InlineKeyboardMarkup()
+contacts_keyboard.add(types.InlineKeyboardButton(text='Telegram', url="https://www.youtube.com/watch?v=Zi_XLOBDo_Y"),
+                      types.InlineKeyboardButton(text='WhatsApp', url="https://www.youtube.com/watch?v=dQw4w9WgXcQ"))
+
 # Обработчик команды "старт"
 @bot.message_handler(commands=['start'])
 def handle_start(message):
@@ -205,117 +162,167 @@ def handle_start(message):
 
   user_id = message.from_user.id
 
-  if user_id in moderator_ids:  # Проверьте, является ли пользователь модератором
+  if settings.is_moderator(user_id):  # Проверьте, является ли пользователь модератором
         bot.send_message(user_id, "Вы модератор.", reply_markup=moderator_keyboard)
   else:
         bot.send_message(user_id, "Вы пользователь.", reply_markup=start_menu_keyboard)
 
-    # Проверьте, нет ли пользователя еще в таблице «пользователи».
-  cursor.execute("SELECT id FROM users WHERE user_id = %s", (user_id,))
-  user_exists = cursor.fetchone()
+    # Регистрация пользователя одним запросом
+  is_new_user = save_user(message.from_user)
 
-  if not user_exists:
-    # Если пользователя нет в базе данных, вставьте его
-      cursor.execute("INSERT INTO users (user_id) VALUES (%s)", (user_id,))
-      conn.commit()
+  if is_new_user:
       bot.send_message(message.chat.id, 'Привет! \n С помощью этого бота вы можете отправить материал для Kursiv Playground.', 
                        reply_markup=start_menu_keyboard) # Инициация стартового меню для пользоватлей
       
 
 #Основной функционал
 #Функция для обработки команды «Отправить материал».
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'отправить материал')
+@router.route('Отправить материал')
 def send_material_command(message):
-    if message.text.lower() == 'отправить материал':
-        Keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-        button = types.KeyboardButton(text='Оставить заявку')
-        button2 = types.KeyboardButton(text='Выход в главное меню')
-        Keyboard.add(button, button2)
-        bot.send_message(message.chat.id, "Критерии материала: \n *Ограничения по символам \n *Фактчекинг \n *Оригинальность \n *Предупреждение о ненарушении законодательства РК \n *Какие материалы ожидаем (темы, формат) \n *Инфо о конкурсе ", 
-                         reply_markup=Keyboard)
+    bot.send_message(message.chat.id, "Критерии материала: \n *Ограничения по символам \n *Фактчекинг \n *Оригинальность \n *Предупреждение о ненарушении законодательства РК \n *Какие материалы ожидаем (темы, формат) \n *Инфо о конкурсе ", 
+                     reply_markup=send_material_keyboard)
         
 
 # Команда "Оставить заявку"
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'оставить заявку')
-def repeat_all_messages(message):
-    if message.text.lower() == 'оставить заявку':
-        markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-        button = types.KeyboardButton(text='Выход в главное меню')
-        markup.add(button)
-
-        if message.text and message.text.lower() == 'выход в главное меню':
-          bot.send_message(message.chat.id, "Выход в главное меню", reply_markup=start_menu_keyboard)
-        else:
-          bot.send_message(message.chat.id, 'Чтобы отправить материал, введите или вставьте ниже свой контент в чат одним сообщением. Вы также можете прикрепить фото и видео к вашей статье. \n Обязательно укажите заголовок для вашей статьи и выделите в тексте ссылки на источники. \n Если вы хотите, чтобы вас упомянули как автора материала, в конце текста укажите своё имя/никнейм.', 
-                           reply_markup=markup)
-          bot.register_next_step_handler(message, send_request)
+@router.route('Оставить заявку')
+def leave_request_command(message):
+    bot.send_message(message.chat.id, 'Чтобы отправить материал, введите или вставьте ниже свой контент в чат одним сообщением. Вы также можете прикрепить фото и видео к вашей статье. \n Обязательно укажите заголовок для вашей статьи и выделите в тексте ссылки на источники. \n Если вы хотите, чтобы вас упомянули как автора материала, в конце текста укажите своё имя/никнейм.', 
+                     reply_markup=exit_to_menu_keyboard)
+    next_step(message, send_request)
 
 
 
 # Команда "О нас"
-@bot.message_handler(content_types=['text'], func=lambda message: message.chat.type == 'private' and message.text.lower() == 'о нас')
-def repeat_all_messages(message):
-    if message.text.lower() == 'о нас':
-        Keyboard = types.InlineKeyboardMarkup()
-        Url_button = types.InlineKeyboardButton(text='Ссылка на наш сайт', url="https://kz.kursiv.media/")
-        Keyboard.add(Url_button)
-        bot.send_message(message.chat.id, "Немного о Playground \n (Общая вводная инфо, принципы издания)", reply_markup=Keyboard)
+@router.route('О нас')
+def about_command(message):
+    bot.send_message(message.chat.id, "Немного о Playground \n (Общая вводная инфо, принципы издания)", reply_markup=about_keyboard)
 
 
 # Команда "Контакты"
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'контакты')
-def repeat_all_messages(message):
-    if message.text.lower() == 'контакты':
-        Keyboard = types.InlineKeyboardMarkup()
-        Url_button1 = types.InlineKeyboardButton(text='Telegram', url="https://www.youtube.com/watch?v=Zi_XLOBDo_Y")
-        Url_button2 = types.InlineKeyboardButton(text='WhatsApp', url="https://www.youtube.com/watch?v=dQw4w9WgXcQ")
-        Keyboard.add(Url_button1, Url_button2)
-        bot.send_message(message.chat.id, "Контакты для обратной связи и по вопросам сотрудничества", reply_markup=Keyboard)
+@router.route('Контакты')
+def contacts_command(message):
+    bot.send_message(message.chat.id, "Контакты для обратной связи и по вопросам сотрудничества", reply_markup=contacts_keyboard)
 
 
 
-# Команда "Посмотреть статус заявок"
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'посмотреть статус заявок')
+# Команда "Посмотреть статус заявок": история заявок одним сообщением с перелистыванием
+@router.route('Посмотреть статус заявок')
 def check_request_status(message):
     user_id = message.from_user.id
-    print(user_id)
-    user_requests = get_user_requests(user_id)
+    requests, has_newer, has_older = get_user_requests(user_id)
 
-    if not user_requests:
+    if not requests:
         bot.send_message(user_id, "У вас нет активных заявок.", reply_markup=start_menu_keyboard)
     else:
-        bot.send_message(user_id, f"Помните, что бот отправляет лишь {request_limit} последних заявок. \n Ваши заявки:")
-
-        for request in user_requests:
-            request_id, status, timestamp = request
-            formatted_timestamp = timestamp.strftime("%d/%m/%Y")  # Format timestamp to day/month/year
-            if status == 1:
-                bot.send_message(user_id, f"Заявка #{request_id}: Ожидает модерации\nДата: {formatted_timestamp}")
-            elif status == 2:
-                bot.send_message(user_id, f"Заявка #{request_id}: Одобрена\nДата: {formatted_timestamp}")
-            elif status == 3:
-              # Send a button to retrieve rejection reason from the database
-                markup = types.InlineKeyboardMarkup()
-                button = types.InlineKeyboardButton("Причина отклонения", callback_data=f"reason_{request_id}")
-                markup.add(button)
-                bot.send_message(user_id, f"Заявка #{request_id}: Отклонена. "
-                                          f"\nДата: {formatted_timestamp}"
-                                          f"\nНажмите на кнопку, чтобы узнать причину отклонения:", reply_markup=markup)
-
-# Определение количества запросов для извлечения
-request_limit = 10
-
-def get_user_requests(user_id):
-    user_requests = []
-    # SQL-запрос, чтобы упорядочить результаты по времени и ограничить результаты
-    cursor.execute("SELECT id, status, time FROM requests WHERE user_id = %s ORDER BY time DESC LIMIT %s", (user_id, request_limit))
-    results = cursor.fetchall()
-
-    for row in results:
-        request_id, status, timestamp = row
-        user_requests.append((request_id, status, timestamp))
-
-    return user_requests
+        text, markup = status_page_message(requests, has_newer, has_older)
+        bot.send_message(user_id, text, reply_markup=markup)
+
+
+# Перелистывание истории заявок: сообщение редактируется на месте
+@bot.callback_query_handler(func=lambda call: call.data.startswith('status_'))
+def handle_status_page(call):
+    bot.answer_callback_query(call.id)
+    _, direction, key = call.data.split('_', 2)
+    if direction == 'older':
+        requests, has_newer, has_older = get_user_requests(call.from_user.id, older=decode_queue_key(key))
+    else:
+        requests, has_newer, has_older = get_user_requests(call.from_user.id, newer=decode_queue_key(key))
+
+    if requests:
+        text, markup = status_page_message(requests, has_newer, has_older)
+    else:
+        text, markup = "На этой странице заявок больше нет.", None
+    bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+
+
+STATUS_NAMES = {
+    1: "Ожидает модерации",
+    2: "Одобрена",
+    3: "Отклонена",
+}
+
+# Причина отказа длиннее этого показывается полностью по кнопке
+REASON_PREVIEW_LENGTH = 200
+
+
+# Строка истории для одной заявки; у отклоненной — причина отказа
+def request_status_line(request_id, status, timestamp, reason):
+    formatted_timestamp = timestamp.strftime("%d/%m/%Y")  # Format timestamp to day/month/year
+    line = f"Заявка #{request_id}: {STATUS_NAMES.get(status, 'Неизвестный статус')}\nДата: {formatted_timestamp}"
+    if status == 3:
+        if not reason:
+            line += "\nПричина отказа не указана."
+        elif len(reason) > REASON_PREVIEW_LENGTH:
+            line += f"\nПричина: {reason[:REASON_PREVIEW_LENGTH]}…"
+        else:
+            line += f"\nПричина: {reason}"
+    return line
+
+
+# Сообщение со страницей истории: (текст, клавиатура с полными причинами отказа и перелистыванием)
+def status_page_message(requests, has_newer, has_older):
+    text = "Ваши заявки:\n\n" + "\n\n".join(request_status_line(*request) for request in requests)
+    markup = types.InlineKeyboardMarkup()
+    markup.add(*(types.InlineKeyboardButton(f"Причина #{request_id}", callback_data=f"reason_{request_id}")
+                 for request_id, status, timestamp, reason in requests
+                 if status == 3 and reason and len(reason) > REASON_PREVIEW_LENGTH))
+    buttons = []
+    if has_newer:
+        first = requests[0]
+        buttons.append(types.InlineKeyboardButton("⬅️ Новее", callback_data=f"status_newer_{encode_queue_key(first[2], first[0])}"))
+    if has_older:
+        last = requests[-1]
+        buttons.append(types.InlineKeyboardButton("Старее ➡️", callback_data=f"status_older_{encode_queue_key(last[2], last[0])}"))
+    markup.add(*buttons)
+    return text, markup if markup.keyboard else None
+
+# Количество заявок на странице истории
+status_page_size = int(config.get('STATUS_PAGE_SIZE') or 10)
+
+USER_REQUESTS_COLUMNS = "id, status, time, CASE WHEN status = 3 THEN rejection_reason END"
+
+
+# Нижняя граница времени для запросов к недавним секциям заявок: (условие, параметры).
+# Пока начало окна неизвестно (обслуживание секций еще не выполнено), условия нет.
+def recent_condition(column='time'):
+    since = partition_maintainer.window_start
+    if since is None:
+        return "", ()
+    return f" AND {column} >= %s", (since,)
+
+
+# Запрос страницы истории заявок пользователя (новые сверху) с keyset-пагинацией по (time, id):
+# older — ключ последней заявки предыдущей страницы, newer — первой заявки следующей.
+# Возвращает (SQL, параметры). Рабочая таблица читается только в окне недавних секций,
+# заявки, перенесенные в архив, — из requests_archive; обе части идут по индексу (user_id, time).
+def user_requests_query(user_id, older=None, newer=None, limit=None):
+    limit = (limit or status_page_size) + 1
+    condition, params = "user_id = %s", (user_id,)
+    order = "time DESC, id DESC"
+    if newer:
+        condition, params = condition + " AND (time, id) > (%s, %s)", params + tuple(newer)
+        order = "time, id"
+    elif older:
+        condition, params = condition + " AND (time, id) < (%s, %s)", params + tuple(older)
+    recent, recent_params = recent_condition()
+    return (f"(SELECT {USER_REQUESTS_COLUMNS} FROM requests WHERE {condition}{recent} ORDER BY {order} LIMIT %s) "
+            f"UNION ALL (SELECT {USER_REQUESTS_COLUMNS} FROM requests_archive WHERE {condition} ORDER BY {order} LIMIT %s) "
+            f"ORDER BY {order} LIMIT %s", params + recent_params + (limit,) + params + (limit, limit))
+
+
+# Строки страницы и признаки наличия более новых и более старых заявок
+def user_requests_page(rows, older=None, newer=None, limit=None):
+    limit = limit or status_page_size
+    if newer:
+        return list(reversed(rows[:limit])), len(rows) > limit, True
+    return rows[:limit], older is not None, len(rows) > limit
+
+
+def get_user_requests(user_id, older=None, newer=None):
+    with db.get_cursor() as cursor:
+        cursor.execute(*user_requests_query(user_id, older=older, newer=newer))
+        rows = cursor.fetchall()
+    return user_requests_page(rows, older=older, newer=newer)
 
 # Обработчик коллбэк-запросов для причины отказа
 @bot.callback_query_handler(func=lambda call: call.data.startswith('reason_'))
@@ -336,25 +343,17 @@ def get_rejection_reasons(request_ids):
     # Подготавливаем список запросов вида (?, ?, ?)
     placeholders = ', '.join(['%s'] * len(request_ids))
 
-    # Выполняем SQL-запрос для извлечения причин отказа
-    query = f"SELECT id, rejection_reason FROM requests WHERE id IN ({placeholders})"
-    cursor.execute(query, tuple(request_ids))
+    # Выполняем SQL-запрос для извлечения причин отказа (старые заявки перенесены в архив)
+    query = (f"SELECT id, rejection_reason FROM requests WHERE id IN ({placeholders}) "
+             f"UNION ALL SELECT id, rejection_reason FROM requests_archive WHERE id IN ({placeholders})")
+    with db.get_cursor() as cursor:
+        cursor.execute(query, tuple(request_ids) * 2)
 
-    rejection_reasons = {request_id: reason for request_id, reason in cursor.fetchall()}
+        rejection_reasons = {request_id: reason for request_id, reason in cursor.fetchall()}
 
     return rejection_reasons
 
 
-# Функция для получения всех пользователей из базы данных
-def get_all_users():
-    users = []
-    cursor.execute("SELECT user_id FROM users")
-    result = cursor.fetchall()
-    for row in result:
-        users.append(row[0])
-    return users
-
-
 # Функция для проверки количества слов в тексте
 def check_word_count(text, min_count, max_count):
     words = text.split()
@@ -365,84 +364,105 @@ def check_word_count(text, min_count, max_count):
     return None
 
 
-user_cooldown = {}
+# Проверка заявки перед сохранением: текст ошибки для пользователя или None.
+# Фото и видео принимаются только с подписью, подпись проверяется так же, как текст.
+def validate_submission(text, photo_id=None, video_id=None):
+    if photo_id and not text:
+        return 'Вы не можете отправить пустую фотографию. Пожалуйста, добавьте подпись к фотографии.'
+    if video_id and not text:
+        return 'Вы не можете отправить пустое видео. Пожалуйста, добавьте подпись к видео.'
+    if not text:
+        return 'Вы можете отправить только изображение (фотографию) в формате JPEG/JPG/PNG, видео в формате MP4 или текст.'
+    return check_word_count(text, 20, 400)
+
+
+SUBMISSION_ACCEPTED_TEXT = 'Спасибо за отправку! Ваш файл или текст будет отправлен модератору и, при одобрении, будет опубликован на канале Kursiv Playground.'
+COOLDOWN_TEXT = 'Подождите {} секунд, прежде чем отправить еще один файл или текст. \n Возвращение в меню'
+SUBMISSION_FAILED_TEXT = 'Не удалось сохранить заявку. Пожалуйста, попробуйте отправить ее еще раз.'
+
+# Хранилище кулдауна отправки заявок: memory — в памяти процесса, postgres — общее для всех процессов
+submission_cooldown = cooldown_store.create_store(config.get('COOLDOWN_BACKEND') or 'memory')
+
 #Обработчик заявки 
-@bot.message_handler(content_types=['text', 'photo', 'video'], func=lambda message: message.chat.type == 'private' and message.from_user.id not in moderator_ids)
+@step_handler
+@bot.message_handler(content_types=['text', 'photo', 'video'], func=lambda message: message.chat.type == 'private' and not settings.is_moderator(message.from_user.id))
 def send_request(message):
     user_id = message.from_user.id
+    remember_user(message.from_user)
 
     text = message.text if message.text else message.caption
 
     if text and text.lower() == 'выход в главное меню':
         bot.send_message(message.chat.id, "Выход в главное меню", reply_markup=start_menu_keyboard)
-    else:
-        # Проверяем, находится ли пользователь в режиме ожидания
-        cooldown_value = get_cooldown_value_from_db()
-        if user_id in user_cooldown and time.time() - user_cooldown[user_id] < cooldown_value:
-            cooldown_remaining = int(cooldown_value - (time.time() - user_cooldown[user_id]))
-            bot.send_message(message.chat.id, f'Подождите {cooldown_remaining} секунд, прежде чем отправить еще один файл или текст. \n Возвращение в меню', reply_markup=start_menu_keyboard)
-            return
-
-        # Инициализируем переменные для хранения содержания файла и текста
-        user_message = None
-        user_message_photo = None
-        photo_id = None
-        video_id = None
-
-        # Проверяем тип сообщения (фото, видео или текст)
-        if message.photo:
-            photo_id = message.photo[-1].file_id
-            caption = message.caption
-            user_message_photo = caption
-            if not caption:
-                bot.send_message(message.chat.id, 'Вы не можете отправить пустую фотографию. Пожалуйста, добавьте подпись к фотографии.')
-                return
-            error_message = check_word_count(caption, 20, 400)
-            user_message = caption
-            if error_message:
-                bot.send_message(message.chat.id, error_message)
-                return
-        elif message.video:
-            video_id = message.video.file_id
-            caption = message.caption
-            user_message_video = caption
-            if not caption:
-                bot.send_message(message.chat.id, 'Вы не можете отправить пустое видео. Пожалуйста, добавьте подпись к видео.')
-                return
-            error_message = check_word_count(caption, 20, 400)
-            if error_message:
-                bot.send_message(message.chat.id, error_message)
-                return
-
-        # Получаем текст из сообщения
-        if text:
-            error_message = check_word_count(text, 20, 400)
-            if error_message:
-                bot.send_message(message.chat.id, error_message)
-                return
-
-            user_message = text
-
-        else:
-            bot.send_message(message.chat.id, 'Вы можете отправить только изображение (фотографию) в формате JPEG/JPG/PNG, видео в формате MP4 или текст.')
-
-        try:
-            if photo_id:
-                cursor.execute("INSERT INTO requests (user_id, text, photo, status) VALUES (%s, %s ,%s, 1)", (user_id, user_message_photo, photo_id))
-            elif video_id:
-                cursor.execute("INSERT INTO requests (user_id, text, video, status) VALUES (%s, %s, %s, 1)", (user_id, user_message_video , video_id))
-            elif user_message:
-                cursor.execute("INSERT INTO requests (user_id, text, status) VALUES (%s, %s, 1)", (user_id, user_message))
-
-            conn.commit()
+        return
 
-            user_cooldown[user_id] = time.time()  # Обновляем время последней отправки для пользователя
+    photo_id = message.photo[-1].file_id if message.photo else None
+    video_id = message.video.file_id if message.video else None
+    error_message = validate_submission(text, photo_id, video_id)
+    if error_message:
+        bot.send_message(message.chat.id, error_message)
+        return
 
-            bot.send_message(message.chat.id, 'Спасибо за отправку! Ваш файл или текст будет отправлен модератору и, при одобрении, будет опубликован на канале Kursiv Playground.', reply_markup=start_menu_keyboard)
+    # Проверяем, находится ли пользователь в режиме ожидания; при успехе время отправки сразу фиксируется
+    cooldown_remaining = submission_cooldown.acquire(user_id, settings.get_cooldown() or 0)
+    if cooldown_remaining:
+        bot.send_message(message.chat.id, COOLDOWN_TEXT.format(int(cooldown_remaining) or 1), reply_markup=start_menu_keyboard)
+        return
 
-        except psycopg2.connector.Error as err:
-            # Обрабатываем ошибки базы данных здесь
-            print(f"Database Error: {err}")
+    try:
+        media_key = dedup.media_key(message)
+        photo_hash = None
+        if photo_id and dedup.can_hash():
+            try:
+                file_info = bot.get_file(dedup.thumbnail_file_id(message))
+                photo_hash = dedup.photo_hash(bot.download_file(file_info.file_path))
+            except (telebot.apihelper.ApiException, RequestException) as err:
+                logging.warning("Не удалось загрузить фото для поиска повторов: %s", err)
+
+        text_signature = similarity.signature(text)
+
+        save_submission((user_id, text, photo_id, video_id, media_key, photo_hash, text_signature))
+    except Exception as err:
+        logging.error("Заявка пользователя %s не сохранена: %s", user_id, err)
+        # Заявка не сохранена, кулдаун не расходуется
+        submission_cooldown.release(user_id)
+        bot.send_message(message.chat.id, SUBMISSION_FAILED_TEXT, reply_markup=start_menu_keyboard)
+        return
+    bot.send_message(message.chat.id, SUBMISSION_ACCEPTED_TEXT, reply_markup=start_menu_keyboard)
+
+
+# Заявка записывается вместе с другими заявками порции (WRITE_BATCH_SIZE); возврат — после фиксации.
+# Возвращает id заявки.
+def save_submission(submission):
+    return submission_writer.submit(submission).result()
+
+
+# Запись порции заявок в одной транзакции: каждая заявка по очереди ищет повторы и похожие тексты,
+# записывается и попадает в индексы, поэтому следующие заявки той же порции ее уже видят
+# (наплыв одинаковых заявок обычно приходит одной порцией). Групповую фиксацию дает общий COMMIT.
+# Заявка — (user_id, text, photo, video, media_key, photo_hash, text_signature).
+# Возвращает id заявок в порядке порции.
+def insert_requests(cursor, submissions):
+    request_ids = []
+    for user_id, text, photo_id, video_id, media_key, photo_hash, text_signature in submissions:
+        # Повтор уже присланного медиа сохраняется со ссылкой на первую заявку
+        duplicate_of = dedup.find_duplicate(cursor, media_key, photo_hash)
+        collapsed = dedup.is_collapsed(cursor, duplicate_of)
+        # Похожий текст отмечается для модератора заранее, очередь только читает пометку
+        similar_to, similarity_score = similarity.find_similar(cursor, text_signature)
+        cursor.execute(
+            """
+            INSERT INTO requests (user_id, text, photo, video, status, media_key, photo_hash, duplicate_of,
+                                  collapsed, text_signature, similar_to, similarity)
+            VALUES (%s, %s, %s, %s, 1, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+            """,
+            (user_id, text, photo_id, video_id, media_key, photo_hash, duplicate_of, collapsed,
+             text_signature, similar_to, similarity_score))
+        request_id = cursor.fetchone()[0]
+        dedup.index_request(cursor, request_id, photo_hash)
+        similarity.index_request(cursor, request_id, text_signature)
+        request_ids.append(request_id)
+    return request_ids
 
 
 
@@ -456,43 +476,18 @@ def is_int(s):
         return False
     
 #Настройка бота
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'настройка бота' )#and message.from_user.id in moderator_ids)
+@router.route('Настройка бота', moderator_only=True, denied_text="У вас нет доступа к настройкам бота.")
 def settings_menu(message):
-    user_id = message.from_user.id
-
-    if user_id in moderator_ids:  # Проверка, что команду отправляет модератор
-        # Создаем клавиатуру на основе списка кнопок
-        settings_buttons = ["Добавить модератора", "Изменить группу", "Изменить интервал отправки заявок", "Вернуться Назад"]
-        settings_keyboard = create_keyboard(settings_buttons)
-
-        # Отправляем сообщение с этой клавиатурой
-        bot.send_message(message.chat.id, "Выберите действие:", reply_markup=settings_keyboard)
-    else:
-        bot.send_message(message.chat.id, "У вас нет доступа к настройкам бота.")
-
-
-# Обновить модераторский список
-def update_moderator_ids():
-    cursor.execute("SELECT moder_id FROM moderators")
-    moderator_records = cursor.fetchall()
-    moderator_ids = [record[0] for record in moderator_records]
-    return moderator_ids
+    bot.send_message(message.chat.id, "Выберите действие:", reply_markup=settings_keyboard)
 
 
 # Добавить модератора
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'добавить модератора')  # and message.from_user.id in moderator_ids)
+@router.route('Добавить модератора', moderator_only=True)
 def add_mod(message):
-    user_id = message.from_user.id
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    button_exit = types.KeyboardButton(text='Вернуться Назад')
-    markup.add(button_exit)
-
-    if user_id in moderator_ids:  # Проверка, что команду отправляет модератор
-        bot.send_message(user_id, "Введите Chat ID Модератора: \n Чтобы получить ID модератора, пройдите по ссылке \n @getmyid_bot \n Пример: 5746051320 \n или нажмите на кнопку '⬅️ Вернуться Назад'",reply_markup=markup)
-        bot.register_next_step_handler(message, mod_add)
-    else:
-        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+    bot.send_message(message.from_user.id, "Введите Chat ID Модератора: \n Чтобы получить ID модератора, пройдите по ссылке \n @getmyid_bot \n Пример: 5746051320 \n или нажмите на кнопку '⬅️ Вернуться Назад'",reply_markup=back_keyboard)
+    next_step(message, mod_add)
 
+@step_handler
 def mod_add(message):
     moder_int = message.text  # замена имени переменной здесь
     user_id = message.from_user.id
@@ -504,37 +499,23 @@ def mod_add(message):
     # Проверка, является ли moder_int целым числом
     if not moder_int.isdigit():
         bot.send_message(user_id, "Пожалуйста, введите корректный ID модератора (целое число).")
-        bot.register_next_step_handler(message, mod_add)
+        next_step(message, mod_add)
         return
 
     try:
-        # Использование параметризованного запроса для вставки модератора
-        cursor.execute("INSERT INTO moderators (moder_id) VALUES (%s)", (moder_int,))  # замена имени переменной здесь
-        conn.commit()
+        # Вставка модератора; кэш настроек обновляется во всех процессах
+        settings.add_moderator(int(moder_int))
         bot.send_message(user_id, "Модератор успешно добавлен", reply_markup=moderator_keyboard)
         bot.send_message(moder_int, "Вы теперь модератор!", reply_markup=moderator_keyboard)
-
-        # Обновить переменную moderator_ids
-        global moderator_ids
-        moderator_ids = update_moderator_ids()
     except psycopg2.Error as err:
         # Обработка ошибки базы данных, например, нарушение целостности и т. д.
-        print("Database Error:", err)
+        logging.error("Database Error: %s", err)
 
 # Функция для изменения группы
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'изменить группу')  # and message.from_user.id in moderator_ids)
+@router.route('Изменить группу', moderator_only=True)
 def add_group(message):
-    user_id = message.from_user.id
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    button_exit = types.KeyboardButton(text='Вернуться Назад')
-    markup.add(button_exit)
-
-
-    if user_id in moderator_ids:  # проверка, что команду отправляет модератор
-        bot.send_message(user_id, "Введите Chat ID Канала для Публикаций: \n Чтобы узнать ID группы необходимо добавить данного Бота в канал, выдать разрешение на все функции и написать команду /get в группу.\n Пример: -1001965855662 \n или нажмите на кнопку 'Вернуться Назад'",reply_markup=markup)
-        bot.register_next_step_handler(message, group_add)
-    else:
-        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+    bot.send_message(message.from_user.id, "Введите Chat ID Канала для Публикаций: \n Чтобы узнать ID группы необходимо добавить данного Бота в канал, выдать разрешение на все функции и написать команду /get в группу.\n Пример: -1001965855662 \n или нажмите на кнопку 'Вернуться Назад'",reply_markup=back_keyboard)
+    next_step(message, group_add)
 
 # Функция для проверки, что текст можно преобразовать в int
 def is_int(s):
@@ -544,15 +525,7 @@ def is_int(s):
     except ValueError:
         return False
 
-# Функция для обновления группы
-def update_group_chat_id(new_chat_id):
-    cursor.execute('''
-        UPDATE "groups"
-        SET group_id = %s
-        WHERE id = 1;
-    ''', (new_chat_id,))
-    conn.commit()  # Сохранение изменений в базе данных
-
+@step_handler
 def group_add(message):
     text = message.text
     user_id = message.from_user.id
@@ -564,43 +537,23 @@ def group_add(message):
     if is_int(text):
         # Преобразование в целое число и обновление группы
         new_chat_id = int(text)
-        update_group_chat_id(new_chat_id)
-
-        # Обновление переменной other_group_chat_id
-        global other_group_chat_id
-        other_group_chat_id = new_chat_id
+        settings.set_publish_target(new_chat_id)
 
         # Уведомление модератора об изменении группы
-        bot.send_message(user_id, "Группа изменена на чат с ID " + str(other_group_chat_id), reply_markup=moderator_keyboard)
+        bot.send_message(user_id, "Группа изменена на чат с ID " + str(new_chat_id), reply_markup=moderator_keyboard)
     else:
         # Неверный ввод, уведомление модератора
         bot.send_message(user_id, "Введенный текст не является целым числом. Пожалуйста, введите правильный chatid.")
-        bot.register_next_step_handler(message, group_add)
+        next_step(message, group_add)
 
 
 # Функция для изменения cooldown
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'изменить интервал отправки заявок')  # and message.from_user.id in moderator_ids)
+@router.route('Изменить интервал отправки заявок', moderator_only=True)
 def add_cooldown(message):
-    user_id = message.from_user.id
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    button_exit = types.KeyboardButton(text='Вернуться Назад')
-    markup.add(button_exit)
-
-    if user_id in moderator_ids:  # проверка, что команду отправляет модератор
-        bot.send_message(user_id, "Введите новое значение интервала отправки новых заявок в секундах. \n или нажмите кнопку 'Вернуться Назад'",reply_markup=markup)
-        bot.register_next_step_handler(message, set_cooldown)
-    else:
-        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
-
-# Функция для обновления cooldown
-def update_cooldown(new_cooldown):
-    cursor.execute('''
-        UPDATE "cooldown"
-        SET cooldown_value = %s
-        WHERE id = 1;
-    ''', (new_cooldown,))
-    conn.commit()  # Сохранение изменений в базе данных
+    bot.send_message(message.from_user.id, "Введите новое значение интервала отправки новых заявок в секундах. \n или нажмите кнопку 'Вернуться Назад'",reply_markup=back_keyboard)
+    next_step(message, set_cooldown)
 
+@step_handler
 def set_cooldown(message):
     text = message.text
     user_id = message.from_user.id
@@ -612,43 +565,38 @@ def set_cooldown(message):
     if is_int(text):
         # Преобразование в целое число и обновление cooldown
         new_cooldown = int(text)
-        update_cooldown(new_cooldown)
+        settings.set_cooldown(new_cooldown)
 
         # Уведомление модератора об изменении cooldown
         bot.send_message(user_id, "Cooldown изменен на " + str(new_cooldown) + " секунд.", reply_markup=moderator_keyboard)
     else:
         # Неверный ввод, уведомление модератора
         bot.send_message(user_id, "Введенный текст не является целым числом. Пожалуйста, введите правильное значение для cooldown.")
-        bot.register_next_step_handler(message, set_cooldown)
+        next_step(message, set_cooldown)
 
 
 #Выход в меню модератора
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'вернуться назад' )#and message.from_user.id in moderator_ids)
+@router.route('Вернуться Назад', moderator_only=True)
 def exit(message):
-    user_id = message.from_user.id
-    if user_id in moderator_ids:  # Проверка что команду выполняет модератор
-        bot.send_message(user_id, "Вы вернулись в главное меню модератора.", reply_markup=moderator_keyboard)
-    else:
-        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+    bot.send_message(message.from_user.id, "Вы вернулись в главное меню модератора.", reply_markup=moderator_keyboard)
 
 
 #Публикация на канале
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'публикация на канале')
+@step_handler
+@router.route('Публикация на канале')
 def request_text_for_publication(message):
     user_id = message.from_user.id
 
-    if user_id not in moderator_ids:
+    if not settings.is_moderator(user_id):
         bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
         return
 
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    button_exit = types.KeyboardButton(text='Вернуться Назад')
-    markup.add(button_exit)
-    bot.send_message(message.chat.id, "Введите текст для публикации или нажмите на кнопку для выхода в меню модератора", reply_markup=markup)
+    bot.send_message(message.chat.id, "Введите текст для публикации или нажмите на кнопку для выхода в меню модератора", reply_markup=back_keyboard)
 
     # Регистрация следующего шага
-    bot.register_next_step_handler(message, publish_text_to_group)
+    next_step(message, publish_text_to_group)
 
+@step_handler
 def publish_text_to_group(message):
     user_id = message.from_user.id
     text_to_publish = message.text or message.caption
@@ -657,51 +605,152 @@ def publish_text_to_group(message):
             bot.send_message(message.chat.id, "Выход в меню модератор", reply_markup=moderator_keyboard)
             return
 
-    if user_id in moderator_ids:
-        try:
-            if message.photo:
-                photo_id = message.photo[-1].file_id
-                bot.send_photo(other_group_chat_id, photo_id, caption=text_to_publish)
-            elif message.video:
-                video_id = message.video.file_id
-                bot.send_video(other_group_chat_id, video_id, caption=text_to_publish)
-            elif text_to_publish:
-                bot.send_message(other_group_chat_id, text_to_publish)
-        except Exception as e:
-            print(f"Error sending message to {other_group_chat_id}: {e}")
+    if settings.is_moderator(user_id):
+        # Первая строка вида «ДД.ММ.ГГГГ ЧЧ:ММ» задает время публикации
+        publish_at = None
+        if text_to_publish:
+            first_line, _, rest = text_to_publish.partition('\n')
+            publish_at = publications.parse_time(first_line, publication_tz)
+            if publish_at is not None:
+                text_to_publish = rest.strip() or None
+        if publish_at is not None and publications.is_past(publish_at):
+            bot.send_message(message.chat.id,
+                             f"Время {publications.format_time(publish_at, publication_tz)} ({publication_tz.key}) уже прошло. "
+                             f"Отправьте публикацию еще раз с будущим временем или без даты, чтобы выложить ее сразу.")
+            next_step(message, publish_text_to_group)
+            return
 
-        if message.photo:
-            bot.send_message(message.chat.id, "Публикация выполнена. Отправлено фото.")
-        elif message.video:
-            bot.send_message(message.chat.id, "Публикация выполнена. Отправлено видео.")
-        elif text_to_publish:
-            bot.send_message(message.chat.id, f"Публикация выполнена. Отправлено сообщение:\n{text_to_publish}")
-        else:
+        photo_id = message.photo[-1].file_id if message.photo else None
+        video_id = message.video.file_id if message.video else None
+        if not (photo_id or video_id or text_to_publish):
             bot.send_message(message.chat.id, "Неизвестный тип контента. Публикация не выполнена.")
-            bot.register_next_step_handler(message, request_text_for_publication)
+            next_step(message, request_text_for_publication)
+            return
+
+        # Публикацию выполняет планировщик с интервалом между постами
+        with db.get_cursor() as cursor:
+            publications.enqueue(cursor, [
+                publications.publication(group_chat_id, text_to_publish, photo_id, video_id,
+                                         publish_at=publish_at, created_by=user_id)
+                for group_chat_id in settings.get_publish_targets()
+            ])
+        when = (f"на {publications.format_time(publish_at, publication_tz)} ({publication_tz.key})"
+                if publish_at else "в очередь")
+        bot.send_message(message.chat.id, f"Публикация добавлена {when}. Очередь: /publications",
+                         reply_markup=moderator_keyboard)
     else:
         bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
 
 
+# Очередь публикаций: ожидающие посты с расчетным временем выхода
+publication_interval = int(config.get('PUBLICATION_INTERVAL') or publications.DEFAULT_INTERVAL)
+publication_scheduler = publications.PublicationScheduler(bot, interval=publication_interval)
+# Часовой пояс, в котором модераторы указывают и видят время публикаций
+publication_tz = ZoneInfo(config.get('PUBLICATION_TZ') or publications.DEFAULT_TIMEZONE)
+
+
+@router.route('Очередь публикаций', moderator_only=True)
+@bot.message_handler(commands=['publications'])
+def list_publications(message):
+    user_id = message.from_user.id
+
+    if not settings.is_moderator(user_id):
+        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+        return
+
+    pending = publications.list_pending(publication_interval)
+    if not pending:
+        bot.send_message(message.chat.id, "Очередь публикаций пуста.")
+        return
+
+    total = publications.count_pending()
+    lines = [f"В очереди публикаций: {total} (интервал {publication_interval} с, время {publication_tz.key})"]
+    for publication_id, chat_id, request_id, text, estimate, attempts in pending:
+        source = f"заявка #{request_id}" if request_id else "публикация модератора"
+        preview = (text or "медиа без подписи").replace('\n', ' ')
+        if len(preview) > 40:
+            preview = preview[:40] + '…'
+        line = f"#{publication_id} ~{publications.format_time(estimate, publication_tz)} в {chat_id}, {source}: {preview}"
+        if attempts:
+            line += f" (ошибок: {attempts})"
+        lines.append(line)
+    if total > len(pending):
+        lines.append(f"… и еще {total - len(pending)}")
+    lines.append("\nУправление: /publish_at <номер> <ДД.ММ.ГГГГ ЧЧ:ММ>, /unpublish <номер>")
+    bot.send_message(message.chat.id, "\n".join(lines))
+
+
+# Перенос и отмена публикации
+@bot.message_handler(commands=['publish_at', 'unpublish'])
+def control_publication(message):
+    user_id = message.from_user.id
+
+    if not settings.is_moderator(user_id):
+        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+        return
+
+    command, _, argument = message.text.partition(' ')
+    command = command.lstrip('/').split('@')[0]
+    publication_id, _, when = argument.strip().partition(' ')
+    if not is_int(publication_id):
+        example = "/publish_at 5 25.12.2024 18:30" if command == 'publish_at' else f"/{command} 5"
+        bot.send_message(message.chat.id, f"Укажите номер публикации, например: {example}")
+        return
+
+    publication_id = int(publication_id)
+    if command == 'unpublish':
+        if publications.cancel(publication_id):
+            bot.send_message(message.chat.id, f"Публикация #{publication_id} отменена.")
+        else:
+            bot.send_message(message.chat.id, f"Публикации #{publication_id} нет в очереди.")
+        return
+
+    publish_at = publications.parse_time(when, publication_tz)
+    if publish_at is None:
+        bot.send_message(message.chat.id, "Укажите время в формате ДД.ММ.ГГГГ ЧЧ:ММ, например: /publish_at 5 25.12.2024 18:30")
+        return
+    formatted = f"{publications.format_time(publish_at, publication_tz)} ({publication_tz.key})"
+    if publications.is_past(publish_at):
+        bot.send_message(message.chat.id, f"Время {formatted} уже прошло. Укажите будущее время.")
+        return
+    if publications.reschedule(publication_id, publish_at):
+        bot.send_message(message.chat.id, f"Публикация #{publication_id} перенесена на {formatted}.")
+    else:
+        bot.send_message(message.chat.id, f"Публикация #{publication_id} уже выложена, отменена или отправляется.")
+
+
 
 #Рассылка сообщений
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text and message.text.lower() == 'рассылка')
+# Общий лимит отправки (сообщений в секунду) и число потоков отправки рассылки
+broadcast_rate = int(config.get('BROADCAST_RATE') or outbound.DEFAULT_RATE)
+broadcast_workers = int(config.get('BROADCAST_WORKERS') or broadcast.DEFAULT_WORKERS)
+# Все запросы TeleBot к Bot API идут через общий клиент (подключается ниже, после метрик)
+outbound_client = outbound.OutboundClient(rate=broadcast_rate,
+                                          pool_size=int(config.get('API_POOL_SIZE') or outbound.DEFAULT_POOL_SIZE),
+                                          is_moderator=settings.is_moderator)
+broadcast_worker = broadcast.BroadcastWorker(bot, outbound_client.bucket, workers=broadcast_workers)
+# Уведомления о решениях
+outbox_worker = outbox.OutboxWorker(bot, workers=int(config.get('OUTBOX_WORKERS') or outbox.DEFAULT_WORKERS))
+# Секции заявок и перенос рассмотренных заявок в архив
+partition_maintainer = partitions.PartitionMaintainer(
+    retention_days=int(config.get('REQUESTS_RETENTION_DAYS') or partitions.DEFAULT_RETENTION_DAYS))
+
+@step_handler
+@router.route('Рассылка')
 def send_all_message(message):
     user_id = message.from_user.id
 
-    if user_id not in moderator_ids:
+    if not settings.is_moderator(user_id):
         bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
         return
 
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    button_exit = types.KeyboardButton(text='Вернуться Назад')
-    markup.add(button_exit)
-    bot.send_message(message.chat.id, "Введите текст и прикрепите медиа-файлы, чтобы осуществить рассылку всем пользователям Бота. \n или нажмите кнопку 'Вернуться Назад' ", reply_markup=markup)
+    bot.send_message(message.chat.id, "Введите текст и прикрепите медиа-файлы, чтобы осуществить рассылку всем пользователям Бота. \n или нажмите кнопку 'Вернуться Назад' ", reply_markup=back_keyboard)
 
     # После этого, регистрируем следующий шаг
-    bot.register_next_step_handler(message, send_message_to_all)
+    next_step(message, send_message_to_all)
 
 
+@step_handler
 def send_message_to_all(message):
     user_id = message.from_user.id
     text = message.text or message.caption
@@ -710,37 +759,71 @@ def send_message_to_all(message):
         bot.send_message(message.chat.id, "Выход в меню модератор", reply_markup=moderator_keyboard)
         return
 
-    if user_id in moderator_ids:
-        user_ids = get_all_users()
+    if settings.is_moderator(user_id):
+        content = {'text': text, 'photo': None, 'video': None}
+        if message.photo:
+            content['photo'] = message.photo[-1].file_id
+        elif message.video:
+            content['video'] = message.video.file_id
+        elif not text:
+            bot.send_message(message.chat.id, "Неизвестный тип контента. Рассылка не выполнена.")
+            next_step(message, send_all_message)
+            return
 
-        for uid in user_ids:
-            try:
-                if message.photo:
-                    photo_id = message.photo[-1].file_id
-                    bot.send_photo(uid, photo_id, caption=text)
+        # Рассылку выполняет фоновый обработчик, прогресс приходит модератору отдельным сообщением
+        job_id = broadcast.create_job(user_id, message.chat.id, content)
+        broadcast_worker.notify()
+        bot.send_message(message.chat.id, f"Рассылка #{job_id} запущена.", reply_markup=moderator_keyboard)
 
-                elif message.video:
-                    video_id = message.video.file_id
-                    bot.send_video(uid, video_id, caption=text)
+    else:
+        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
 
-                elif text:
-                    bot.send_message(uid, text)
 
-            except Exception as e:
-                print(f"Error sending message to {uid}: {e}")
+# Список последних рассылок
+@bot.message_handler(commands=['broadcasts'])
+def list_broadcasts(message):
+    user_id = message.from_user.id
 
-        if message.photo:
-            bot.send_message(message.chat.id, "Рассылка выполнена. Отправлено фото.")
-        elif message.video:
-            bot.send_message(message.chat.id, "Рассылка выполнена. Отправлено видео.")
-        elif text:
-            bot.send_message(message.chat.id, f"Рассылка выполнена. Отправлено сообщение:\n{text}")
-        else:
-            bot.send_message(message.chat.id, "Неизвестный тип контента. Рассылка не выполнена.")
-            bot.register_next_step_handler(message, send_all_message)
+    if not settings.is_moderator(user_id):
+        bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+        return
 
-    else:
+    jobs = broadcast.list_jobs()
+    if not jobs:
+        bot.send_message(message.chat.id, "Рассылок пока не было.")
+        return
+
+    lines = []
+    for job_id, status, total, sent, failed, created_at in jobs:
+        lines.append(f"#{job_id} от {created_at.strftime('%d/%m/%Y %H:%M')}: {broadcast.STATUS_NAMES.get(status, status)}, "
+                     f"отправлено {sent} из {total}, ошибок {failed}")
+    lines.append("\nУправление: /pause <номер>, /resume <номер>, /cancel <номер>")
+    bot.send_message(message.chat.id, "\n".join(lines))
+
+
+# Пауза, продолжение и отмена рассылки
+@bot.message_handler(commands=['pause', 'resume', 'cancel'])
+def control_broadcast(message):
+    user_id = message.from_user.id
+
+    if not settings.is_moderator(user_id):
         bot.send_message(user_id, "У вас нет прав для выполнения этой команды.")
+        return
+
+    command, _, argument = message.text.partition(' ')
+    command = command.lstrip('/').split('@')[0]
+    if not is_int(argument.strip()):
+        bot.send_message(message.chat.id, f"Укажите номер рассылки, например: /{command} 5")
+        return
+
+    job_id = int(argument)
+    new_status = {'pause': broadcast.PAUSED, 'resume': broadcast.RUNNING, 'cancel': broadcast.CANCELLED}[command]
+    if broadcast.set_job_status(job_id, new_status):
+        if new_status == broadcast.RUNNING:
+            broadcast_worker.notify()
+        bot.send_message(message.chat.id, f"Рассылка #{job_id} {broadcast.STATUS_NAMES[new_status]}.")
+    else:
+        bot.send_message(message.chat.id, f"Рассылку #{job_id} нельзя перевести в состояние «{broadcast.STATUS_NAMES[new_status]}».")
 
 
 # Рассмотрение заявок 
@@ -752,40 +835,324 @@ def create_request_buttons(request_id):
     markup.add(true_button, false_button)
     return markup
 
+# Кэш имен пользователей: user_id -> first_name
+name_cache = TTLCache(maxsize=int(config.get('NAME_CACHE_SIZE') or 10000),
+                      ttl=int(config.get('NAME_CACHE_TTL') or 3600))
+
+# Регистрация пользователя и сохранение его имени одним запросом.
+# Новый пользователь вставляется, у существующего обновляется имя, а вернувшийся
+# после блокировки бота снова получает рассылки. Возвращает True для нового пользователя.
+def save_user(from_user):
+    is_new_user = user_writer.submit((from_user.id, from_user.first_name, from_user.username)).result()
+    name_cache.set(from_user.id, from_user.first_name)
+    return is_new_user
+
+# Запись порции пользователей (user_id, first_name, username) одной многострочной вставкой;
+# возвращает признаки новых пользователей в порядке порции
+def upsert_users(cursor, users):
+    # Одна строка вставки на пользователя: повторная строка того же user_id в ON CONFLICT недопустима
+    latest = {user[0]: user for user in users}
+    values = ', '.join(['(%s, %s, %s)'] * len(latest))
+    cursor.execute(f'''
+        INSERT INTO users (user_id, first_name, username) VALUES {values}
+        ON CONFLICT (user_id) DO UPDATE
+        SET blocked = FALSE, first_name = EXCLUDED.first_name, username = EXCLUDED.username
+        WHERE users.blocked
+           OR users.first_name IS DISTINCT FROM EXCLUDED.first_name
+           OR users.username IS DISTINCT FROM EXCLUDED.username
+        RETURNING user_id, xmax = 0
+    ''', [part for user in latest.values() for part in user])
+    inserted = {user_id for user_id, is_new in cursor.fetchall() if is_new}
+    # Новым считается только первое обращение пользователя в порции
+    results = []
+    for user_id, first_name, username in users:
+        results.append(user_id in inserted)
+        inserted.discard(user_id)
+    return results
+
+# Групповая фиксация заявок и регистраций пользователей (WRITE_BATCH_SIZE > 1 включает ее)
+write_batch_size = int(config.get('WRITE_BATCH_SIZE') or 0)
+write_batch_delay = int(config.get('WRITE_BATCH_DELAY_MS') or write_batch.DEFAULT_MAX_DELAY * 1000) / 1000
+submission_writer = write_batch.create_writer('requests', insert_requests, write_batch_size, write_batch_delay)
+user_writer = write_batch.create_writer('users', upsert_users, write_batch_size, write_batch_delay)
+
+# Обновление имени пользователя, если оно изменилось с прошлого обращения
+def remember_user(from_user):
+    if name_cache.peek(from_user.id) != from_user.first_name:
+        save_user(from_user)
+
 # Функция для получение имени пользовтеля
-def get_user_name_by_id(user_id):
-    user = bot.get_chat(user_id)
-    user_name = user.first_name  # Вы также можете использовать user.last_name для фамилии
+# Сначала проверяется кэш, затем имя из базы данных (known_name), и только потом Telegram
+def get_user_name_by_id(user_id, known_name=None):
+    user_name = name_cache.get(user_id)
+    if user_name is not None:
+        return user_name
+
+    user_name = known_name
+    if user_name is None:
+        user = bot.get_chat(user_id)
+        user_name = user.first_name  # Вы также можете использовать user.last_name для фамилии
+        with db.get_cursor() as cursor:
+            cursor.execute("UPDATE users SET first_name = %s, username = %s WHERE user_id = %s",
+                           (user.first_name, user.username, user_id))
+    name_cache.set(user_id, user_name)
     return user_name
 
-# добавление кнопки для каждой заявки
-@bot.message_handler(func=lambda message: message.chat.type == 'private' and message.text.lower() == 'посмотреть заявки') #and message.from_user.id in moderator_ids)
-def process_requests(message):
-    moder_id = message.from_user.id
 
-    if moder_id in moderator_ids and message.text.lower() == 'посмотреть заявки':
-        cursor.execute("SELECT id, user_id, text, photo, video, time FROM requests WHERE status = 1")
-        requests = cursor.fetchall()
+# Статистика кэша имен пользователей
+@bot.message_handler(commands=['cache'])
+def show_cache_stats(message):
+    if not settings.is_moderator(message.from_user.id):
+        bot.send_message(message.from_user.id, "У вас нет прав для выполнения этой команды.")
+        return
 
-        if not requests:
-            bot.send_message(moder_id, "Нет новых заявок")
+    stats = name_cache.stats()
+    bot.send_message(message.chat.id, f"Кэш имен пользователей: {stats['size']} записей\n"
+                                      f"Попадания: {stats['hits']}, промахи: {stats['misses']} "
+                                      f"({stats['hit_ratio']:.0%} попаданий)")
+
+# Количество заявок на одной странице очереди модерации
+queue_page_size = int(config.get('QUEUE_PAGE_SIZE') or 5)
+
+# Ключ заявки (time, id) для callback_data кнопок перелистывания
+def encode_queue_key(timestamp, request_id):
+    return f"{timestamp.strftime('%Y%m%d%H%M%S%f')}_{request_id}"
+
+def decode_queue_key(key):
+    timestamp, request_id = key.split('_')
+    return datetime.strptime(timestamp, '%Y%m%d%H%M%S%f'), int(request_id)
+
+
+# Заявки очереди модерации: ожидающие решения, кроме повторов заявки, которая сама ждет решения
+# (повторы показываются счетчиком на ее карточке). Условие совпадает с частичным индексом
+# requests_queue_idx, поэтому размер очереди считается только по индексу.
+PENDING_CONDITION = "r.status = 1 AND NOT r.collapsed"
+
+PENDING_COLUMNS = """
+    r.id, r.user_id, r.text, r.photo, r.video, r.time, u.first_name, r.duplicate_of,
+    (SELECT count(*) FROM requests d WHERE d.duplicate_of = r.id AND d.status = 1),
+    r.similar_to, r.similarity
+"""
+
+
+# Количество заявок на модерации (по частичному индексу в окне недавних секций, повторы не учитываются)
+def count_pending_requests():
+    recent, recent_params = recent_condition('r.time')
+    with db.get_cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM requests r WHERE {PENDING_CONDITION}{recent}", recent_params)
+        return cursor.fetchone()[0]
+
+
+# Страница очереди модерации с keyset-пагинацией по (time, id).
+# after — ключ последней заявки предыдущей страницы, before — первой заявки следующей.
+# Возвращает заявки страницы и признаки наличия предыдущей и следующей страниц.
+# Ожидающие заявки не старше начала окна недавних секций, поэтому остальные секции не читаются.
+def get_pending_page(after=None, before=None, limit=None):
+    limit = limit or queue_page_size
+    recent, recent_params = recent_condition('r.time')
+    with db.get_cursor() as cursor:
+        if before:
+            cursor.execute(
+                f"""
+                SELECT {PENDING_COLUMNS}
+                FROM requests r LEFT JOIN users u ON u.user_id = r.user_id
+                WHERE {PENDING_CONDITION}{recent} AND (r.time, r.id) < (%s, %s)
+                ORDER BY r.time DESC, r.id DESC
+                LIMIT %s
+                """,
+                recent_params + (before[0], before[1], limit + 1)
+            )
+            rows = cursor.fetchall()
+            has_prev = len(rows) > limit
+            return list(reversed(rows[:limit])), has_prev, True
+
+        if after:
+            cursor.execute(
+                f"""
+                SELECT {PENDING_COLUMNS}
+                FROM requests r LEFT JOIN users u ON u.user_id = r.user_id
+                WHERE {PENDING_CONDITION}{recent} AND (r.time, r.id) > (%s, %s)
+                ORDER BY r.time, r.id
+                LIMIT %s
+                """,
+                recent_params + (after[0], after[1], limit + 1)
+            )
         else:
-            for request in requests:
-                request_id, user_id, text, photo_id, video_id, timestamp = request
-                formatted_timestamp = timestamp.strftime("%d/%m/%Y %H:%M:%S")
-                request_markup = create_request_buttons(request_id)
-                user_name = get_user_name_by_id(user_id)
-
-                # Проверяем, есть ли в запросе фото или видео и соответственно отправляем
-                if photo_id:
-                    bot.send_photo(moder_id, photo_id, caption=f"Заявка #{request_id}\nПользователь: {user_name}\nДата: {formatted_timestamp}\nСодержание: {text}", reply_markup=request_markup)
-                elif video_id:
-                    bot.send_video(moder_id, video_id, caption=f"Заявка #{request_id}\nПользователь: {user_name}\nДата: {formatted_timestamp}\nСодержание: {text}", reply_markup=request_markup)
-                else:
-                    # Если фото или видео нет, просто отправьте текст
-                    bot.send_message(moder_id, f"Заявка #{request_id}\nПользователь: {user_name}\nДата: {formatted_timestamp}\nСодержание: {text}", reply_markup=request_markup)
+            cursor.execute(
+                f"""
+                SELECT {PENDING_COLUMNS}
+                FROM requests r LEFT JOIN users u ON u.user_id = r.user_id
+                WHERE {PENDING_CONDITION}{recent}
+                ORDER BY r.time, r.id
+                LIMIT %s
+                """,
+                recent_params + (limit + 1,)
+            )
+        rows = cursor.fetchall()
+        return rows[:limit], after is not None, len(rows) > limit
+
+
+# Отправка одной заявки модератору с кнопками "Одобрить" и "Отклонить"
+def send_request_card(moder_id, request):
+    (request_id, user_id, text, photo_id, video_id, timestamp, first_name, duplicate_of, duplicates,
+     similar_to, similarity_score) = request
+    formatted_timestamp = timestamp.strftime("%d/%m/%Y %H:%M:%S")
+    request_markup = create_request_buttons(request_id)
+    user_name = get_user_name_by_id(user_id, first_name)
+    caption = f"Заявка #{request_id}\nПользователь: {user_name}\nДата: {formatted_timestamp}"
+    if duplicates:
+        caption += f"\nПовторов: {duplicates} (получат то же решение)"
+    if duplicate_of:
+        caption += f"\nПовтор заявки #{duplicate_of}"
+    if similar_to:
+        caption += f"\n{similarity.describe(similar_to, similarity_score)}"
+    caption += f"\nСодержание: {text}"
+
+    # Проверяем, есть ли в запросе фото или видео и соответственно отправляем
+    if photo_id:
+        bot.send_photo(moder_id, photo_id, caption=caption, reply_markup=request_markup)
+    elif video_id:
+        bot.send_video(moder_id, video_id, caption=caption, reply_markup=request_markup)
     else:
-          bot.send_message(moder_id, "У вас нет прав для выполнения этой команды.")
+        # Если фото или видео нет, просто отправьте текст
+        bot.send_message(moder_id, caption, reply_markup=request_markup)
+
+
+# Отметки выбора заявок на кнопках страницы очереди
+UNSELECTED_MARK = '⬜'
+SELECTED_MARK = '✅'
+
+
+# Отправка страницы очереди: заявки и сообщение с кнопками выбора и перелистывания
+def send_queue_page(moder_id, after=None, before=None):
+    requests, has_prev, has_next = get_pending_page(after=after, before=before)
+
+    if not requests:
+        if after or before:
+            bot.send_message(moder_id, "На этой странице заявок больше нет.")
+        else:
+            bot.send_message(moder_id, "Нет новых заявок")
+        return
+
+    for request in requests:
+        send_request_card(moder_id, request)
+
+    markup = types.InlineKeyboardMarkup()
+    # Выбор заявок страницы для массового решения; выбор хранится в самих кнопках сообщения
+    markup.add(*(types.InlineKeyboardButton(f"{UNSELECTED_MARK} #{request[0]}", callback_data=f"bulk_pick_{request[0]}")
+                 for request in requests))
+    markup.row(types.InlineKeyboardButton("Одобрить выбранные", callback_data="bulk_approve"),
+               types.InlineKeyboardButton("Отклонить выбранные", callback_data="bulk_reject"))
+    buttons = []
+    if has_prev:
+        first = requests[0]
+        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"queue_prev_{encode_queue_key(first[5], first[0])}"))
+    if has_next:
+        last = requests[-1]
+        buttons.append(types.InlineKeyboardButton("Вперед ➡️", callback_data=f"queue_next_{encode_queue_key(last[5], last[0])}"))
+    markup.add(*buttons)
+    bot.send_message(moder_id, f"Заявок на модерации: {count_pending_requests()}. Показано: {len(requests)}.\n"
+                               f"Отметьте заявки номерами ниже, чтобы одобрить или отклонить их разом.",
+                     reply_markup=markup)
+
+# Показ первой страницы очереди модерации
+@router.route('Посмотреть заявки', moderator_only=True)
+def process_requests(message):
+    send_queue_page(message.from_user.id)
+
+
+# Статистика заявок из сводных таблиц (см. stats.py)
+@router.route('Статистика', moderator_only=True)
+def show_statistics(message):
+    bot.send_message(message.chat.id, stats.report(pending=count_pending_requests()))
+
+
+# Перелистывание очереди модерации
+@bot.callback_query_handler(func=lambda call: call.data.startswith('queue_'))
+def handle_queue_page(call):
+    moder_id = call.from_user.id
+    bot.answer_callback_query(call.id)
+
+    if not settings.is_moderator(moder_id):
+        bot.send_message(moder_id, "У вас нет прав для выполнения этой команды.")
+        return
+
+    _, direction, key = call.data.split('_', 2)
+    # Кнопки перелистывания убираются, чтобы не листать со старой страницы
+    bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+    if direction == 'next':
+        send_queue_page(moder_id, after=decode_queue_key(key))
+    else:
+        send_queue_page(moder_id, before=decode_queue_key(key))
+
+
+# Решения модератора.
+# Заявки меняют статус одним запросом UPDATE ... WHERE id = ANY(%s) AND status = 1 (заявки,
+# уже рассмотренные другим модератором, пропускаются). Уведомления пользователей добавляются
+# в очередь outbox, публикации в группы — в очередь publications в той же транзакции;
+# отправляют их фоновые обработчики. Тот же запрос записывает время решения decided_at,
+# по которому триггеры обновляют статистику (см. stats.py).
+
+APPROVE_REQUESTS = """
+    UPDATE requests SET status = 2, decided_at = current_timestamp
+    WHERE id = ANY(%s) AND status = 1
+    RETURNING id, user_id, text, photo, video
+"""
+
+REJECT_REQUESTS = """
+    UPDATE requests SET status = 3, rejection_reason = %s, decided_at = current_timestamp
+    WHERE id = ANY(%s) AND status = 1
+    RETURNING id, user_id
+"""
+
+
+# Уведомления авторов одобренных заявок
+def approval_messages(approved):
+    return [outbox.message(user_id, f"Ваша заявка #{request_id} была одобрена.")
+            for request_id, user_id, request_text, photo_id, video_id in approved]
+
+
+# Публикации одобренных заявок во все группы публикации
+def approval_publications(approved):
+    items = []
+    for request_id, user_id, request_text, photo_id, video_id in approved:
+        caption = f"Заявка #{request_id} одобрена. Текст заявки:\n{request_text}"
+        items.extend(publications.publication(group_chat_id, caption, photo_id, video_id, request_id=request_id)
+                     for group_chat_id in settings.get_publish_targets())
+    return items
+
+
+# Уведомления об отказе: строки (id заявки, user_id, причина)
+def rejection_messages(rejected):
+    return [outbox.message(user_id, f"Ваша заявка #{request_id} была отклонена по следующей причине: {reason}")
+            for request_id, user_id, reason in rejected]
+
+
+# Одобрение заявок в одной транзакции; возвращает id одобренных
+def approve_requests(request_ids):
+    with db.get_cursor() as cursor:
+        cursor.execute(APPROVE_REQUESTS, (list(request_ids),))
+        approved = sorted(cursor.fetchall())
+        approved_ids = [row[0] for row in approved]
+        cursor.execute(dedup.RESOLVE_APPROVED_DUPLICATES, (approved_ids,))
+        outbox.enqueue(cursor, approval_messages(approved) + rejection_messages(cursor.fetchall()))
+        publications.enqueue(cursor, approval_publications(approved))
+    return approved_ids
+
+
+# Отклонение заявок с одной причиной в одной транзакции; возвращает id отклоненных
+def reject_requests(request_ids, reason):
+    with db.get_cursor() as cursor:
+        cursor.execute(REJECT_REQUESTS, (reason, list(request_ids)))
+        rejected = sorted((request_id, user_id, reason) for request_id, user_id in cursor.fetchall())
+        rejected_ids = [row[0] for row in rejected]
+        cursor.execute(dedup.RESOLVE_DUPLICATES, (reason, rejected_ids))
+        outbox.enqueue(cursor, rejection_messages(rejected) + rejection_messages(cursor.fetchall()))
+    return rejected_ids
+
+
+def format_request_ids(request_ids):
+    return ', '.join(f"#{request_id}" for request_id in request_ids)
 
 
 # Обработка нажатия на кнопки "Одобрить" и "Отклонить"
@@ -795,35 +1162,24 @@ def handle_request_action(call):
     request_id = int(request_id)
 
     if action == 'true':
-        cursor.execute("SELECT text, photo, video, user_id FROM requests WHERE id = %s", (request_id,))
-        request_data = cursor.fetchone()
-        request_text, photo_id, video_id, user_id = request_data[0], request_data[1], request_data[2], request_data[3]
-
-        # Отметьте заявку как одобренную
-        cursor.execute("UPDATE requests SET status = 2 WHERE id = %s", (request_id,))
-        conn.commit()
-
-        # Отправьте медиа или текст заявки в другой группе после одобрения
-        if photo_id:  # Если есть фото
-            bot.send_photo(other_group_chat_id, photo_id, caption=f"Заявка #{request_id} одобрена. Текст заявки:\n{request_text}")
-        elif video_id:  # Если есть видео
-            bot.send_video(other_group_chat_id, video_id, caption=f"Заявка #{request_id} одобрена. Текст заявки:\n{request_text}")
-        else:  # Если есть только текст
-            bot.send_message(other_group_chat_id, f"Заявка #{request_id} одобрена. Текст заявки:\n{request_text}")
-
-        # Уведомите пользователя о решении
-        bot.send_message(user_id, f"Ваша заявка #{request_id} была одобрена.")
-        bot.send_message(call.from_user.id, f"Заявка #{request_id} была одобрена.")
+        if approve_requests([request_id]):
+            bot.send_message(call.from_user.id, f"Заявка #{request_id} была одобрена.")
+        else:
+            bot.send_message(call.from_user.id, f"Заявка #{request_id} уже рассмотрена.")
         # Удалите кнопки после обработки действия
         bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
 
-        # Отметьте заявку как одобренную
-        cursor.execute("UPDATE requests SET status = 2 WHERE id = %s", (request_id,))
-        conn.commit()
-
     elif action == 'false':
-        cursor.execute("SELECT user_id FROM requests WHERE id = %s", (request_id,))
-        user_id = cursor.fetchone()[0]
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT user_id FROM requests WHERE id = %s", (request_id,))
+            row = cursor.fetchone()
+
+        # Заявки нет в рабочей таблице: она уже перенесена в архив или удалена
+        if row is None:
+            bot.send_message(call.from_user.id, f"Заявка #{request_id} уже рассмотрена.")
+            bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+            return
+        user_id = row[0]
 
         # Запросите причину отказа у модератора
         bot.send_message(call.from_user.id, f"Заявка #{request_id} отклонена. Пожалуйста, укажите причину отказа в ответ на данное сообщение.")
@@ -832,38 +1188,181 @@ def handle_request_action(call):
         bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
 
         # обработчик сообщений для получения причины отклонения от модератора.
-        bot.register_next_step_handler(call.message, save_rejection_reason, request_id, user_id)
+        state.set_state(call.message.chat.id, call.from_user.id, save_rejection_reason.__name__,
+                        request_id=request_id, user_id=user_id)
 
 # Определите функцию save_rejection_reason с дополнительными параметрами request_id и user_id.
+@step_handler
 def save_rejection_reason(message, request_id, user_id):
     rejection_reason = message.text
     try:
-        # Добавьте информацию о статусе отказа и тексте причины в базу данных
-        cursor.execute("UPDATE requests SET status = 3, rejection_reason = %s WHERE id = %s",
-                       (rejection_reason, request_id))
-        conn.commit()
-        bot.send_message(message.chat.id, f"Причина отказа для заявки #{request_id} сохранена.")
-
-        # Уведомите пользователя о решении
-        bot.send_message(user_id, f"Ваша заявка #{request_id} была отклонена по следующей причине: {rejection_reason}")
+        # Статус, причина отказа и уведомление пользователя сохраняются одной транзакцией
+        if reject_requests([request_id], rejection_reason):
+            bot.send_message(message.chat.id, f"Причина отказа для заявки #{request_id} сохранена.")
+        else:
+            bot.send_message(message.chat.id, f"Заявка #{request_id} уже рассмотрена.")
     except Exception as e:
         bot.send_message(message.chat.id, f"Произошла ошибка при сохранении причины отказа: {str(e)}")
 
 
+# Выбранные заявки из кнопок сообщения со страницей очереди
+def selected_requests(markup):
+    return [int(button.callback_data[len('bulk_pick_'):])
+            for row in markup.keyboard for button in row
+            if button.callback_data and button.callback_data.startswith('bulk_pick_')
+            and button.text.startswith(SELECTED_MARK)]
 
-import cProfile
 
-def my_function():
-    total = 0
-    for i in range(1000000):
-        total += i
-    return total
+# Массовая модерация: выбор заявок на странице очереди и решение по всем выбранным
+@bot.callback_query_handler(func=lambda call: call.data.startswith('bulk_'))
+def handle_bulk_action(call):
+    moder_id = call.from_user.id
+    chat_id = call.message.chat.id
+    markup = call.message.reply_markup
+
+    if not settings.is_moderator(moder_id):
+        bot.answer_callback_query(call.id)
+        bot.send_message(moder_id, "У вас нет прав для выполнения этой команды.")
+        return
+
+    if call.data.startswith('bulk_pick_'):
+        for row in markup.keyboard:
+            for button in row:
+                if button.callback_data == call.data:
+                    selected = not button.text.startswith(SELECTED_MARK)
+                    button.text = f"{SELECTED_MARK if selected else UNSELECTED_MARK} {button.text.split(' ', 1)[1]}"
+        bot.answer_callback_query(call.id)
+        bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id, reply_markup=markup)
+        return
+
+    request_ids = selected_requests(markup)
+    if not request_ids:
+        bot.answer_callback_query(call.id, "Сначала отметьте заявки кнопками с номерами.")
+        return
+    bot.answer_callback_query(call.id)
+    # Кнопки убираются, чтобы решение по той же странице не приняли дважды
+    bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id, reply_markup=None)
+
+    if call.data == 'bulk_approve':
+        approved = approve_requests(request_ids)
+        skipped = [request_id for request_id in request_ids if request_id not in approved]
+        text = f"Одобрено заявок: {len(approved)} ({format_request_ids(approved)})." if approved else "Ни одна заявка не одобрена."
+        if skipped:
+            text += f"\nУже рассмотрены: {format_request_ids(skipped)}."
+        bot.send_message(moder_id, text)
+    else:
+        bot.send_message(moder_id, f"Заявки {format_request_ids(request_ids)} будут отклонены. "
+                                   f"Пожалуйста, укажите общую причину отказа в ответ на данное сообщение.")
+        state.set_state(chat_id, moder_id, save_bulk_rejection_reason.__name__, request_ids=request_ids)
+
+
+@step_handler
+def save_bulk_rejection_reason(message, request_ids):
+    rejection_reason = message.text
+    if not rejection_reason:
+        bot.send_message(message.chat.id, "Причина отказа должна быть текстом. Попробуйте еще раз.")
+        next_step(message, save_bulk_rejection_reason, request_ids=request_ids)
+        return
+    try:
+        rejected = reject_requests(request_ids, rejection_reason)
+    except Exception as e:
+        bot.send_message(message.chat.id, f"Произошла ошибка при сохранении причины отказа: {str(e)}")
+        return
+    skipped = [request_id for request_id in request_ids if request_id not in rejected]
+    text = f"Отклонено заявок: {len(rejected)} ({format_request_ids(rejected)})." if rejected else "Ни одна заявка не отклонена."
+    if skipped:
+        text += f"\nУже рассмотрены: {format_request_ids(skipped)}."
+    bot.send_message(message.chat.id, text)
+
+
+# Метрики: время и ошибки обработчиков (в том числе кнопок меню и шагов диалога) и вызовов Bot API.
+# Запросы к базе данных замеряет курсор db.TimedCursor.
+def instrument():
+    metrics.instrument_bot(bot)
+    for route in router.routes.values():
+        route.handler = metrics.timed_handler(route.handler)
+    for name, handler in step_handlers.items():
+        step_handlers[name] = metrics.timed_handler(handler)
+    metrics.instrument_api(telebot.apihelper)
+    outbound_client.install(telebot.apihelper)
+    metrics.QUEUE_DEPTH.track(outbound_client.limiter.depth, queue='api_send')
+
+
+# Импорт main.py не обращается к базе данных и к Bot API: схема базы данных и подключение
+# метрик выполняются в create_app, один раз перед запуском (python main.py, бенчмарк).
+# Если схема актуальна, миграции ограничиваются одним запросом; с MIGRATE_ON_START=0 они
+# не выполняются вовсе и применяются отдельным шагом развертывания (python migrations.py).
+# Настройки загружаются при первом обращении, пул соединений создается при первом запросе.
+module_loaded = time.perf_counter()
+app_created = False
+
+
+def create_app(timer=None):
+    global app_created
+    if app_created:
+        return bot
+    timer = timer or metrics.StartupTimer(import_started)
+    timer.add('импорт', module_loaded - import_started)
+    if config.get('MIGRATE_ON_START') != '0':
+        with timer.step('миграции'):
+            migrations.run_migrations()
+    with timer.step('метрики'):
+        instrument()
+    app_created = True
+    return bot
+
 
 if __name__ == '__main__':
-    bot.infinity_polling()
+    startup = metrics.StartupTimer(import_started)
+    create_app(startup)
+    with startup.step('фоновые обработчики'):
+        state.subscribe()
+        # Подписки на NOTIFY outbox и publications должны появиться до запуска общего слушателя
+        outbox_worker.start()
+        publication_scheduler.start()
+        partition_maintainer.start()
+        settings.start_listener()
+        # Эндпоинт /metrics (и /profile) включается заданием METRICS_PORT
+        if config.get('METRICS_PORT'):
+            metrics.MetricsServer(config.get('METRICS_HOST') or '127.0.0.1', int(config['METRICS_PORT'])).start()
+    # Запись входящих обновлений для воспроизведения нагрузки (python -m bench.replay)
+    recorder = None
+    if config.get('TRACE_FILE'):
+        recorder = update_trace.TraceRecorder(config['TRACE_FILE'], anonymize=config.get('TRACE_ANONYMIZE') == '1',
+                                              salt=config.get('TRACE_SALT'))
+    if bot_mode == 'async':
+        # python-telegram-bot загружается только в асинхронном режиме
+        with startup.step('asyncio'):
+            import aio_runtime
+            runtime = aio_runtime.AsyncRuntime(sys.modules[__name__], token, config, recorder)
+        # Рассылки выполняет асинхронный обработчик; новые рассылки и /resume будят его
+        broadcast_worker = runtime.broadcast_worker
+        startup.report()
+        runtime.run()
+    else:
+        if recorder is not None:
+            update_trace.install(bot, recorder)
+        broadcast_worker.start()
+        if bot_mode == 'webhook':
+            # WEBHOOK_INSECURE=1 — локальная проверка без секретного токена, по умолчанию только на 127.0.0.1
+            webhook_insecure = config.get('WEBHOOK_INSECURE') == '1'
+            server = webhook.WebhookServer(
+                bot,
+                host=config.get('WEBHOOK_HOST') or ('127.0.0.1' if webhook_insecure else '0.0.0.0'),
+                port=int(config.get('WEBHOOK_PORT') or webhook.DEFAULT_PORT),
+                path=config.get('WEBHOOK_PATH') or webhook.DEFAULT_PATH,
+                secret_token=config.get('WEBHOOK_SECRET'),
+                workers=int(config.get('WEBHOOK_WORKERS') or num_threads),
+                queue_size=int(config.get('WEBHOOK_QUEUE_SIZE') or webhook.DEFAULT_QUEUE_SIZE),
+                allow_insecure=webhook_insecure,
+            )
+            metrics.QUEUE_DEPTH.track(server.updates.qsize, queue='webhook')
+            # Без WEBHOOK_URL вебхук не регистрируется в Telegram: удобно для локальной проверки
+            if config.get('WEBHOOK_URL'):
+                server.register(config['WEBHOOK_URL'])
+            startup.report()
+            server.serve_forever()
+        else:
+            startup.report()
+            bot.infinity_polling()
     logging.info('Бот успешно запущен')
-    profiler = cProfile.Profile()
-    profiler.enable()
-    result = my_function()
-    profiler.disable()
-    profiler.print_stats(sort='cumulative')
@@ -0,0 +1,388 @@
+import bisect
+import functools
+import io
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Метрики бота в формате Prometheus: время и ошибки обработчиков, запросов к базе данных
+# и вызовов Bot API, глубина очередей. Отдаются на локальном HTTP-эндпоинте /metrics;
+# там же /profile снимает выборочный профиль cProfile обработчиков.
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DEFAULT_PORT = 9100
+# Ограничения профилирования по запросу
+MAX_PROFILE_SECONDS = 300
+DEFAULT_PROFILE_SECONDS = 30
+DEFAULT_PROFILE_RATE = 0.1
+PROFILE_LIMIT = 40
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# Общая часть метрик; Counter, Histogram и Gauge задают type и samples()
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [счетчики корзин (+Inf последней), сумма]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    # Замер времени блока: with HISTOGRAM.time(handler='...'):
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# Значение читается функцией в момент запроса /metrics (глубина очереди, занятые соединения)
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.sources = {}
+
+    def track(self, func, **labels):
+        with self.lock:
+            self.sources[self.key(labels)] = func
+
+    def samples(self):
+        with self.lock:
+            sources = dict(self.sources)
+        lines = []
+        for key, func in sorted(sources.items()):
+            try:
+                value = func()
+            except Exception:
+                logging.exception("Ошибка чтения метрики %s", self.name)
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', "Время выполнения обработчика", ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', "Исключения в обработчиках", ['handler'])
+DB_QUERY_SECONDS = Histogram('db_query_seconds', "Время выполнения SQL-запроса", ['query'])
+DB_QUERY_ERRORS = Counter('db_query_errors_total', "Ошибки SQL-запросов", ['query'])
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', "Ожидание свободного соединения в пуле")
+API_SECONDS = Histogram('telegram_api_seconds', "Время вызова Bot API", ['method'])
+API_ERRORS = Counter('telegram_api_errors_total', "Ошибки Bot API (код ответа или network)", ['method', 'code'])
+QUEUE_DEPTH = Gauge('bot_queue_depth', "Число элементов в очереди", ['queue'])
+STARTUP_SECONDS = Gauge('bot_startup_seconds', "Длительность этапов запуска процесса", ['step'])
+
+
+# Выборочное профилирование: пока идет снимок, обработчик с вероятностью rate выполняется
+# под cProfile, результаты объединяются в один отчет. Профилируется не больше одного
+# обработчика одновременно: с Python 3.12 второй активный профилировщик вызывает ValueError,
+# поэтому остальные обработчики в это время выполняются без профиля
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self.stats = None
+        self.until = 0.0
+        self.rate = 0.0
+
+    def start(self, seconds, rate):
+        with self.lock:
+            if self.active():
+                return False
+            self.stats = None
+            self.rate = rate
+            self.until = time.monotonic() + seconds
+            return True
+
+    def active(self):
+        return time.monotonic() < self.until
+
+    def run(self, func, *args, **kwargs):
+        if not self.active() or random.random() >= self.rate:
+            return func(*args, **kwargs)
+        # Профиль уже снимается (в том числе внешним вызовом того же потока: маршрутизатор, шаги диалога)
+        if not self.running.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            # cProfile и pstats загружаются только при первом снимке профиля
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Активен другой профилировщик или отладчик
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self.add(profile)
+        finally:
+            self.running.release()
+
+    def add(self, profile):
+        import pstats
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def report(self, limit=PROFILE_LIMIT):
+        with self.lock:
+            if self.stats is None:
+                return "За время снимка ни один обработчик не попал в выборку\n"
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats('cumulative').print_stats(limit)
+            return stream.getvalue()
+
+
+profiler = Profiler()
+
+
+# Обертка обработчика: время, исключения и выборочный профиль
+def timed_handler(func, name=None):
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return profiler.run(func, *args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+# Обертка асинхронного обработчика (режим BOT_MODE=async); профилирование для корутин не выполняется
+def timed_async_handler(func, name=None):
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+# Замер этапов запуска: длительность каждого этапа пишется в лог одной строкой
+# и отдается метрикой bot_startup_seconds
+class StartupTimer:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.steps = []
+
+    # Этап, который уже прошел (например, импорт модулей до создания таймера)
+    def add(self, name, seconds):
+        self.steps.append((name, seconds))
+        STARTUP_SECONDS.track(lambda: seconds, step=name)
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        STARTUP_SECONDS.track(lambda: total, step='total')
+        logging.info("Запуск за %.0f мс: %s", total * 1000,
+                     ', '.join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.steps))
+        return total
+
+
+# Обертка всех зарегистрированных обработчиков TeleBot (вызывать после регистрации)
+def instrument_bot(bot):
+    for handlers in (bot.message_handlers, bot.callback_query_handlers):
+        for handler in handlers:
+            handler['function'] = timed_handler(handler['function'])
+    if bot.threaded:
+        QUEUE_DEPTH.track(bot.worker_pool.tasks.qsize, queue='telebot')
+
+
+# Обертка исходящих вызовов Bot API: время по методу, ошибки по коду ответа Telegram
+def instrument_api(apihelper):
+    make_request = apihelper._make_request
+
+    @functools.wraps(make_request)
+    def timed_request(token, method_name, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            API_ERRORS.inc(method=method_name, code=e.error_code)
+            raise
+        except Exception:
+            API_ERRORS.inc(method=method_name, code='network')
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=method_name)
+
+    apihelper._make_request = timed_request
+
+
+# Локальный HTTP-сервер метрик (не публикуйте его наружу: /profile нагружает процесс)
+class MetricsServer:
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle_get(self)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format, *args)
+
+        return Handler
+
+    def respond(self, request, code, body, content_type='text/plain; charset=utf-8'):
+        data = body.encode()
+        request.send_response(code)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def handle_get(self, request):
+        url = urlparse(request.path)
+        if url.path == '/metrics':
+            self.respond(request, 200, render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif url.path == '/profile':
+            self.handle_profile(request, parse_qs(url.query))
+        else:
+            self.respond(request, 404, "not found")
+
+    # GET /profile?seconds=30&rate=0.1 — снимок профиля за seconds секунд
+    def handle_profile(self, request, query):
+        try:
+            seconds = min(float(query.get('seconds', [DEFAULT_PROFILE_SECONDS])[0]), MAX_PROFILE_SECONDS)
+            rate = min(max(float(query.get('rate', [DEFAULT_PROFILE_RATE])[0]), 0.0), 1.0)
+        except ValueError:
+            self.respond(request, 400, "bad request")
+            return
+        if not profiler.start(seconds, rate):
+            self.respond(request, 409, "profile already running")
+            return
+        time.sleep(seconds)
+        self.respond(request, 200, profiler.report())
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True).start()
+        logging.info("Метрики доступны на %s:%s/metrics", *self.httpd.server_address[:2])
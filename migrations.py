@@ -0,0 +1,412 @@
+import logging
+
+import db
+import partitions
+import similarity
+
+
+# Версионированные миграции схемы базы данных.
+# Номер последней примененной миграции хранится в таблице schema_version;
+# если схема уже актуальна, запуск ограничивается одним запросом.
+
+# Ключ advisory-блокировки, чтобы два процесса не применяли миграции одновременно
+MIGRATION_LOCK_KEY = 7242001
+
+# Начальные данные: группа для публикаций, кулдаун и первый модератор
+DEFAULT_GROUP_ID = -1001965855664
+DEFAULT_COOLDOWN = 60
+FIRST_MODERATOR_ID = 1732450131
+
+
+# Миграция вне общей транзакции: функция без аргументов сама делит работу на шаги,
+# каждый в своей транзакции, чтобы долгие проверки не держали блокировки на рабочих таблицах.
+# Шаги должны быть повторяемыми: прерванная миграция выполняется заново.
+class NonTransactional:
+    def __init__(self, func):
+        self.func = func
+
+
+# Каждая миграция — (версия, описание, SQL, функция, принимающая курсор, или NonTransactional)
+MIGRATIONS = [
+    (1, "Базовые таблицы", """
+        CREATE TABLE IF NOT EXISTS requests (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            text TEXT,
+            photo TEXT,
+            video TEXT,
+            status INTEGER,
+            rejection_reason TEXT,
+            time TIMESTAMP DEFAULT current_timestamp
+        );
+
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT
+        );
+
+        CREATE TABLE IF NOT EXISTS moderators (
+            id SERIAL PRIMARY KEY,
+            moder_id BIGINT
+        );
+
+        CREATE TABLE IF NOT EXISTS groups (
+            id SERIAL PRIMARY KEY,
+            group_id BIGINT
+        );
+
+        CREATE TABLE IF NOT EXISTS cooldown (
+            id SERIAL PRIMARY KEY,
+            cooldown_value BIGINT
+        );
+    """),
+
+    (2, "Рассылки с контрольными точками", """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked BOOLEAN NOT NULL DEFAULT FALSE;
+
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id SERIAL PRIMARY KEY,
+            moder_id BIGINT,
+            report_chat_id BIGINT,
+            progress_message_id BIGINT,
+            text TEXT,
+            photo TEXT,
+            video TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            last_user_row INTEGER NOT NULL DEFAULT 0,
+            done_ahead INTEGER[],
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT current_timestamp,
+            finished_at TIMESTAMP
+        );
+    """),
+
+    (3, "Начальные данные", f"""
+        INSERT INTO groups (group_id)
+        SELECT {DEFAULT_GROUP_ID} WHERE NOT EXISTS (SELECT 1 FROM groups);
+
+        INSERT INTO cooldown (cooldown_value)
+        SELECT {DEFAULT_COOLDOWN} WHERE NOT EXISTS (SELECT 1 FROM cooldown);
+
+        INSERT INTO moderators (moder_id)
+        SELECT {FIRST_MODERATOR_ID} WHERE NOT EXISTS (SELECT 1 FROM moderators WHERE moder_id = {FIRST_MODERATOR_ID});
+    """),
+
+    (4, "Индексы для частых запросов и уникальность идентификаторов", """
+        -- Повторные строки остались от вставок без ограничения уникальности
+        DELETE FROM users a USING users b WHERE a.user_id = b.user_id AND a.id > b.id;
+        DELETE FROM moderators a USING moderators b WHERE a.moder_id = b.moder_id AND a.id > b.id;
+
+        ALTER TABLE users ADD CONSTRAINT users_user_id_key UNIQUE (user_id);
+        ALTER TABLE moderators ADD CONSTRAINT moderators_moder_id_key UNIQUE (moder_id);
+
+        -- Заявки пользователя: WHERE user_id = %s ORDER BY time DESC LIMIT
+        CREATE INDEX IF NOT EXISTS requests_user_id_time_idx ON requests (user_id, time DESC);
+
+        -- Очередь модерации: WHERE status = 1
+        CREATE INDEX IF NOT EXISTS requests_pending_idx ON requests (time, id) WHERE status = 1;
+    """),
+
+    (5, "Имена пользователей для отображения без запросов к Telegram", """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS first_name TEXT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;
+    """),
+
+    (6, "Уведомления об изменении настроек (LISTEN/NOTIFY)", """
+        CREATE OR REPLACE FUNCTION notify_settings_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('settings_changed', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS cooldown_settings_changed ON cooldown;
+        CREATE TRIGGER cooldown_settings_changed AFTER INSERT OR UPDATE OR DELETE ON cooldown
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_settings_changed();
+
+        DROP TRIGGER IF EXISTS groups_settings_changed ON groups;
+        CREATE TRIGGER groups_settings_changed AFTER INSERT OR UPDATE OR DELETE ON groups
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_settings_changed();
+
+        DROP TRIGGER IF EXISTS moderators_settings_changed ON moderators;
+        CREATE TRIGGER moderators_settings_changed AFTER INSERT OR UPDATE OR DELETE ON moderators
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_settings_changed();
+    """),
+
+    (7, "Общий кулдаун отправки заявок", """
+        CREATE TABLE IF NOT EXISTS submission_cooldown (
+            user_id BIGINT PRIMARY KEY,
+            last_sent_at TIMESTAMPTZ NOT NULL
+        );
+    """),
+
+    (8, "Состояние многошаговых диалогов", """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            state TEXT NOT NULL,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (chat_id, user_id)
+        );
+    """),
+
+    (9, "Поиск повторно присланных фото и видео", """
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS media_key TEXT;
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS photo_hash BIGINT;
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS duplicate_of INTEGER REFERENCES requests (id);
+
+        CREATE INDEX IF NOT EXISTS requests_media_key_idx ON requests (media_key) WHERE media_key IS NOT NULL;
+        -- Число повторов заявки в очереди: WHERE duplicate_of = %s AND status = 1
+        CREATE INDEX IF NOT EXISTS requests_duplicate_of_idx ON requests (duplicate_of) WHERE duplicate_of IS NOT NULL;
+
+        -- Полосы перцептивного хеша фото (см. dedup.py)
+        CREATE TABLE IF NOT EXISTS request_hash_bands (
+            band SMALLINT NOT NULL,
+            value INTEGER NOT NULL,
+            request_id INTEGER NOT NULL REFERENCES requests (id) ON DELETE CASCADE,
+            PRIMARY KEY (band, value, request_id)
+        );
+    """),
+
+    (10, "Поиск похожих текстов заявок (MinHash и LSH)", """
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS text_signature INTEGER[];
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS similar_to INTEGER;
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS similarity REAL;
+
+        -- Корзины LSH сигнатур текстов (см. similarity.py); заявки до этой миграции
+        -- добавляются командой python similarity.py
+        CREATE TABLE IF NOT EXISTS request_text_buckets (
+            band SMALLINT NOT NULL,
+            bucket BIGINT NOT NULL,
+            request_id INTEGER NOT NULL REFERENCES requests (id) ON DELETE CASCADE,
+            PRIMARY KEY (band, bucket, request_id)
+        );
+    """),
+
+    (11, "Очередь исходящих сообщений", """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            text TEXT,
+            photo TEXT,
+            video TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until TIMESTAMPTZ,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp
+        );
+    """),
+
+    (12, "Очередь публикаций в группы и каналы", """
+        CREATE TABLE IF NOT EXISTS publications (
+            id BIGSERIAL PRIMARY KEY,
+            request_id INTEGER,
+            chat_id BIGINT NOT NULL,
+            text TEXT,
+            photo TEXT,
+            video TEXT,
+            publish_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            retry_at TIMESTAMPTZ,
+            published_at TIMESTAMPTZ,
+            created_by BIGINT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT current_timestamp
+        );
+        CREATE INDEX IF NOT EXISTS publications_pending_idx ON publications (publish_at, id) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS publications_published_idx ON publications (chat_id, published_at)
+            WHERE status = 'published';
+    """),
+
+    (13, "Секционирование заявок по времени и архив рассмотренных заявок",
+     NonTransactional(partitions.partition_requests)),
+
+    (14, "Время решения и сводная статистика заявок", """
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS decided_at TIMESTAMP;
+        -- Архив получает строки через SELECT * из requests, набор столбцов должен совпадать
+        ALTER TABLE requests_archive ADD COLUMN IF NOT EXISTS decided_at TIMESTAMP;
+
+        -- Сводные таблицы (см. stats.py) обновляются триггерами при вставке заявок и решениях
+        CREATE TABLE IF NOT EXISTS request_stats_daily (
+            day DATE PRIMARY KEY,
+            submitted INTEGER NOT NULL DEFAULT 0,
+            approved INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS request_stats_decision_times (
+            day DATE NOT NULL,
+            bucket SMALLINT NOT NULL,
+            decided INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, bucket)
+        );
+
+        CREATE TABLE IF NOT EXISTS request_stats_users (
+            user_id BIGINT PRIMARY KEY,
+            submitted INTEGER NOT NULL DEFAULT 0,
+            approved INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS request_stats_users_submitted_idx ON request_stats_users (submitted DESC);
+
+        -- Триггеры уровня оператора: многострочная вставка или массовое решение
+        -- обновляют каждую строку сводки один раз
+        CREATE OR REPLACE FUNCTION request_stats_inserted() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO request_stats_daily (day, submitted)
+            SELECT time::date, count(*) FROM inserted GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET submitted = request_stats_daily.submitted + EXCLUDED.submitted;
+
+            INSERT INTO request_stats_users (user_id, submitted)
+            SELECT user_id, count(*) FROM inserted WHERE user_id IS NOT NULL GROUP BY 1
+            ON CONFLICT (user_id) DO UPDATE SET submitted = request_stats_users.submitted + EXCLUDED.submitted;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION request_stats_decided() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO request_stats_daily (day, approved, rejected)
+            SELECT coalesce(n.decided_at, localtimestamp)::date,
+                   count(*) FILTER (WHERE n.status = 2), count(*) FILTER (WHERE n.status = 3)
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE o.status = 1 AND n.status IN (2, 3)
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET approved = request_stats_daily.approved + EXCLUDED.approved,
+                                            rejected = request_stats_daily.rejected + EXCLUDED.rejected;
+
+            INSERT INTO request_stats_decision_times (day, bucket, decided)
+            SELECT n.decided_at::date,
+                   width_bucket(extract(epoch FROM n.decided_at - n.time)::double precision,
+                                ARRAY[60, 300, 900, 1800, 3600, 10800, 21600, 43200, 86400, 172800, 604800]::double precision[]),
+                   count(*)
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE o.status = 1 AND n.status IN (2, 3) AND n.decided_at IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (day, bucket) DO UPDATE SET decided = request_stats_decision_times.decided + EXCLUDED.decided;
+
+            INSERT INTO request_stats_users (user_id, approved, rejected)
+            SELECT n.user_id, count(*) FILTER (WHERE n.status = 2), count(*) FILTER (WHERE n.status = 3)
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE o.status = 1 AND n.status IN (2, 3) AND n.user_id IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (user_id) DO UPDATE SET approved = request_stats_users.approved + EXCLUDED.approved,
+                                                rejected = request_stats_users.rejected + EXCLUDED.rejected;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS request_stats_inserted ON requests;
+        CREATE TRIGGER request_stats_inserted AFTER INSERT ON requests
+            REFERENCING NEW TABLE AS inserted
+            FOR EACH STATEMENT EXECUTE FUNCTION request_stats_inserted();
+
+        DROP TRIGGER IF EXISTS request_stats_decided ON requests;
+        CREATE TRIGGER request_stats_decided AFTER UPDATE ON requests
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION request_stats_decided();
+
+        -- Накопленная история (включая архив). Время решения прежних заявок неизвестно:
+        -- решения учитываются днем отправки и не попадают в медиану
+        INSERT INTO request_stats_daily (day, submitted, approved, rejected)
+        SELECT time::date, count(*), count(*) FILTER (WHERE status = 2), count(*) FILTER (WHERE status = 3)
+        FROM (SELECT time, status FROM requests UNION ALL SELECT time, status FROM requests_archive) r
+        WHERE time IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (day) DO NOTHING;
+
+        INSERT INTO request_stats_users (user_id, submitted, approved, rejected)
+        SELECT user_id, count(*), count(*) FILTER (WHERE status = 2), count(*) FILTER (WHERE status = 3)
+        FROM (SELECT user_id, status FROM requests UNION ALL SELECT user_id, status FROM requests_archive) r
+        WHERE user_id IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (user_id) DO NOTHING;
+    """),
+
+    (15, "Захват публикаций на время отправки", """
+        -- Публикации в статусе sending: не больше одной на чат и истечение захвата
+        CREATE INDEX IF NOT EXISTS publications_sending_idx ON publications (chat_id, retry_at)
+            WHERE status = 'sending';
+    """),
+
+    (16, "Пересчет сигнатур текстов за один проход по шинглам",
+     NonTransactional(similarity.rebuild)),
+
+    (17, "Повторы, скрытые под карточкой первой заявки", """
+        -- Повтор скрыт, если первая заявка ждала решения, когда он пришел; решение по первой
+        -- заявке выносится вместе с повторами, поэтому флаг после вставки не меняется
+        ALTER TABLE requests ADD COLUMN IF NOT EXISTS collapsed BOOLEAN NOT NULL DEFAULT false;
+        ALTER TABLE requests_archive ADD COLUMN IF NOT EXISTS collapsed BOOLEAN NOT NULL DEFAULT false;
+        UPDATE requests r SET collapsed = true
+        WHERE r.status = 1 AND r.duplicate_of IS NOT NULL
+          AND EXISTS (SELECT 1 FROM requests o WHERE o.id = r.duplicate_of AND o.status = 1);
+
+        -- Очередь модерации: WHERE status = 1 AND NOT collapsed (размер очереди — только по индексу)
+        CREATE INDEX IF NOT EXISTS requests_queue_idx ON requests (time, id) WHERE status = 1 AND NOT collapsed;
+        DROP INDEX IF EXISTS requests_pending_idx;
+    """),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+# Текущая версия схемы (0, если миграции еще не применялись)
+def current_version(cursor):
+    cursor.execute("SELECT to_regclass('schema_version')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+# Применение недостающих миграций; каждая выполняется в своей транзакции (кроме NonTransactional)
+def run_migrations():
+    with db.get_cursor() as cursor:
+        version = current_version(cursor)
+    if version >= latest_version():
+        logging.info("Схема базы данных актуальна (версия %s), миграции пропущены", version)
+        return version
+
+    for migration_version, description, migration in MIGRATIONS:
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT current_timestamp
+                );
+            ''')
+            # Версия перечитывается под блокировкой: миграцию мог применить другой процесс
+            version = current_version(cursor)
+            if migration_version <= version:
+                continue
+
+            if isinstance(migration, NonTransactional):
+                # Блокировка миграций остается за этой транзакцией, шаги идут в других соединениях
+                migration.func()
+            elif callable(migration):
+                migration(cursor)
+            else:
+                cursor.execute(migration)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (migration_version, description))
+            logging.info("Применена миграция %s: %s", migration_version, description)
+
+    return latest_version()
+
+
+if __name__ == '__main__':
+    from dotenv import dotenv_values
+
+    logging.basicConfig(level=logging.INFO)
+    db.configure(dotenv_values(".env"))
+    print(f"Версия схемы: {run_migrations()}")
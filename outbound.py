@@ -0,0 +1,280 @@
+import functools
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot.apihelper import ApiTelegramException
+
+
+# Общий клиент исходящих запросов к Bot API для TeleBot.
+# Подключается вместо apihelper._make_request, поэтому через него проходят все вызовы
+# bot.send_message, send_photo, edit_message_* и остальные, без изменения мест вызова:
+# - одна сессия requests с пулом keep-alive соединений на все потоки;
+# - общее ведро токенов (лимит Telegram около 30 сообщений в секунду) и ведро на каждый чат;
+# - свободные токены достаются запросам по приоритету: интерфейс модератора, ответы
+#   пользователям, уведомления из очереди outbox, рассылки;
+# - ответ 429 выдерживает retry_after и повторяет запрос; сетевые ошибки и ответы 5xx
+#   повторяются с экспоненциальной паузой только для идемпотентных методов, чтобы
+#   не отправить сообщение дважды.
+# Асинхронный режим отправляет запросы через PTB, но рассылки в нем берут токены из того же ведра.
+
+# Приоритеты (меньше — раньше)
+MODERATOR = 0
+INTERACTIVE = 1
+NOTIFICATION = 2
+BROADCAST = 3
+
+DEFAULT_RATE = 30
+DEFAULT_POOL_SIZE = 32
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 0.5
+# Telegram ограничивает сообщения в один чат: около 1 в секунду, в группу — 20 в минуту
+CHAT_RATE = 1.0
+CHAT_BURST = 5
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+# Ведра чатов, простаивающих дольше этого времени, удаляются
+CHAT_BUCKET_TTL = 60
+
+# Методы, которые отправляют или меняют сообщения и расходуют лимит Telegram
+LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+# Повтор этих методов может продублировать сообщение
+NON_IDEMPOTENT_PREFIXES = ('send', 'copy', 'forward')
+
+_local = threading.local()
+
+
+# Ограничитель скорости «ведро с токенами», общий для всех потоков отправки
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    # Попытка взять токен: 0, если токен получен, иначе время до следующей попытки
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    # Ожидание свободного токена
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    # Остановка всех отправок на retry_after секунд (ответ 429 от Telegram)
+    def hold(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.blocked_until
+
+
+# Значение retry_after из ответа 429
+def get_retry_after(error):
+    parameters = (error.result_json or {}).get('parameters') or {}
+    return parameters.get('retry_after', 1)
+
+
+# Приоритет запросов текущего потока (задают фоновые обработчики)
+@contextmanager
+def priority(level):
+    previous = getattr(_local, 'priority', None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def with_priority(level):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with priority(level):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Выдача токенов общего ведра по приоритету: ожидающие потоки образуют очередь с приоритетами,
+# токен получает первый в очереди, остальные ждут
+class PriorityLimiter:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, level):
+        entry = (level, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    wait = None
+                    if self.waiting[0] == entry:
+                        wait = self.bucket.try_acquire()
+                        if not wait:
+                            return
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def depth(self):
+        return len(self.waiting)
+
+
+# chat_id запроса: числовая строка приводится к int, чтобы '-100…' и -100… были одним чатом
+def normalize_chat_id(chat_id):
+    if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+        return int(chat_id)
+    return chat_id
+
+
+# Группы и каналы: отрицательный id или имя канала вида @channel
+def is_group(chat_id):
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return isinstance(chat_id, str) and chat_id.startswith('@')
+
+
+# Ведра отдельных чатов: личные чаты — CHAT_RATE, группы и каналы — GROUP_RATE
+class ChatLimiter:
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        chat_id = normalize_chat_id(chat_id)
+        with self.lock:
+            bucket = self.buckets.get(chat_id)
+            if bucket is None:
+                if len(self.buckets) > 10000:
+                    self.prune()
+                if is_group(chat_id):
+                    bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+                else:
+                    bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+                self.buckets[chat_id] = bucket
+            return bucket
+
+    def prune(self):
+        expired = time.monotonic() - CHAT_BUCKET_TTL
+        self.buckets = {chat_id: bucket for chat_id, bucket in self.buckets.items()
+                        if max(bucket.updated, bucket.blocked_until) > expired}
+
+    def acquire(self, chat_id):
+        self.get(chat_id).acquire()
+
+    def hold(self, chat_id, seconds):
+        self.get(chat_id).hold(seconds)
+
+
+class OutboundClient:
+    # is_moderator определяет чаты модераторов: запросы в них получают приоритет MODERATOR
+    def __init__(self, rate=DEFAULT_RATE, pool_size=DEFAULT_POOL_SIZE, is_moderator=None):
+        self.bucket = TokenBucket(rate)
+        self.limiter = PriorityLimiter(self.bucket)
+        self.chats = ChatLimiter()
+        self.is_moderator = is_moderator
+        self.pool_size = pool_size
+        self.make_request = None
+
+    # Подключение к apihelper TeleBot (после metrics.instrument_api, чтобы метрики видели каждую попытку)
+    def install(self, apihelper):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        apihelper.session = session
+        self.make_request = apihelper._make_request
+        apihelper._make_request = self.request
+
+    def priority_for(self, chat_id):
+        level = getattr(_local, 'priority', None)
+        if level is not None:
+            return level
+        if chat_id is not None and self.is_moderator is not None and self.is_moderator(chat_id):
+            return MODERATOR
+        return INTERACTIVE
+
+    def request(self, token, method_name, method='get', params=None, files=None):
+        # Long polling повторяет сам TeleBot
+        if method_name == 'getUpdates':
+            return self.make_request(token, method_name, method, params=params, files=files)
+        limited = method_name.startswith(LIMITED_PREFIXES)
+        # Файлы читаются при отправке, повторить такой запрос нельзя
+        retryable = not files
+        idempotent = retryable and not method_name.startswith(NON_IDEMPOTENT_PREFIXES)
+        chat_id = normalize_chat_id(params.get('chat_id')) if params else None
+        level = self.priority_for(chat_id)
+
+        attempt = 0
+        while True:
+            if limited:
+                if chat_id is not None:
+                    self.chats.acquire(chat_id)
+                self.limiter.acquire(level)
+            try:
+                # apihelper изменяет params (timeout), для повтора нужна копия
+                return self.make_request(token, method_name, method, params=dict(params) if params else None,
+                                         files=files)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    self.hold(chat_id, level, get_retry_after(e))
+                if attempt >= MAX_RETRIES or not retryable:
+                    raise
+                if e.error_code == 429:
+                    retry_after = get_retry_after(e)
+                    logging.warning("Bot API %s: 429, повтор через %s с", method_name, retry_after)
+                    if not limited:
+                        time.sleep(retry_after)
+                elif e.error_code >= 500 and idempotent:
+                    self.backoff(method_name, attempt, e)
+                else:
+                    raise
+            except requests.exceptions.ConnectTimeout as e:
+                # Соединение не установлено, запрос не ушел — повтор безопасен для любого метода
+                if attempt >= MAX_RETRIES or not retryable:
+                    raise
+                self.backoff(method_name, attempt, e)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= MAX_RETRIES or not idempotent:
+                    raise
+                self.backoff(method_name, attempt, e)
+            attempt += 1
+
+    # Ответ 429: пауза чата, а для уведомлений, рассылок и запросов без чата — и общего ведра.
+    # В потоке массовой отправки 429 означает общий флуд-лимит: без паузы общего ведра остальные
+    # потоки продолжали бы отправлять и тоже получали бы 429
+    def hold(self, chat_id, level, retry_after):
+        if chat_id is not None:
+            self.chats.hold(chat_id, retry_after)
+        if chat_id is None or level >= NOTIFICATION:
+            self.bucket.hold(retry_after)
+
+    def backoff(self, method_name, attempt, error):
+        delay = BACKOFF_SECONDS * 2 ** attempt * (1 + random.random())
+        logging.warning("Bot API %s: %s, повтор через %.1f с", method_name, error, delay)
+        time.sleep(delay)
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from telebot.apihelper import ApiTelegramException
+
+import broadcast
+import db
+import outbound
+
+
+# Очередь исходящих уведомлений пользователям (решения по заявкам; публикации в группы
+# идут через очередь publications). Обработчики не отправляют сообщения сами, а добавляют
+# их в таблицу outbox в той же транзакции, что и изменение заявок: после отката не уходит
+# ни одно сообщение, а после фиксации сообщения не теряются даже при перезапуске процесса.
+# Фоновый обработчик отправляет их через outbound.OutboundClient с приоритетом ниже интерфейса
+# модератора и ответов пользователям; NOTIFY outbox будит его сразу после фиксации.
+
+CHANNEL = 'outbox'
+DEFAULT_WORKERS = 4
+BATCH_SIZE = 100
+# Сообщение, не отправленное за время аренды, забирается повторно; пока порция отправляется,
+# аренда неотправленных сообщений продлевается каждые LEASE_RENEW_INTERVAL секунд
+LEASE_SECONDS = 60
+LEASE_RENEW_INTERVAL = LEASE_SECONDS / 3
+MAX_ATTEMPTS = 5
+POLL_INTERVAL = 5
+
+
+# Запрос добавления сообщений: (SQL, параметры) для синхронного и асинхронного курсора.
+# Сообщение — кортеж (chat_id, text, photo, video).
+def insert_statement(messages):
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(messages))
+    params = [part for message in messages for part in message]
+    return f"INSERT INTO outbox (chat_id, text, photo, video) VALUES {values}; NOTIFY {CHANNEL}", params
+
+
+def enqueue(cursor, messages):
+    if messages:
+        cursor.execute(*insert_statement(messages))
+
+
+def message(chat_id, text, photo=None, video=None):
+    return chat_id, text, photo, video
+
+
+class OutboxWorker:
+    def __init__(self, bot, workers=DEFAULT_WORKERS):
+        self.bot = bot
+        self.workers = workers
+        self.wakeup = threading.Event()
+
+    def start(self):
+        db.listener.subscribe(CHANNEL, self.on_notify)
+        thread = threading.Thread(target=self.run, name='outbox-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def on_notify(self, channel, payload):
+        self.wakeup.set()
+
+    def claim(self):
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE outbox
+                SET locked_until = current_timestamp + %s * interval '1 second', attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE locked_until IS NULL OR locked_until < current_timestamp
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, chat_id, text, photo, video, attempts
+                """,
+                (LEASE_SECONDS, BATCH_SIZE)
+            )
+            return sorted(cursor.fetchall())
+
+    # Отправка одного сообщения; True — сообщение можно удалить из очереди.
+    # Лимиты скорости и повторы после ответа 429 обеспечивает outbound.OutboundClient.
+    @outbound.with_priority(outbound.NOTIFICATION)
+    def deliver(self, row):
+        message_id, chat_id, text, photo, video, attempts = row
+        try:
+            broadcast.send_content(self.bot, chat_id, {'text': text, 'photo': photo, 'video': video})
+            return True
+        except ApiTelegramException as e:
+            if e.error_code == 403:
+                # Заблокировавшим бота отмечается только пользователь (личный чат), не группа или канал
+                if chat_id > 0:
+                    broadcast.mark_blocked([chat_id])
+                return True
+            logging.warning("Ошибка отправки сообщения %s в чат %s: %s", message_id, chat_id, e)
+        except Exception as e:
+            logging.warning("Ошибка отправки сообщения %s в чат %s: %s", message_id, chat_id, e)
+        if attempts >= MAX_ATTEMPTS:
+            logging.error("Сообщение %s в чат %s не отправлено за %s попыток", message_id, chat_id, attempts)
+            return True
+        # Повторная попытка — после истечения аренды
+        return False
+
+    # Сообщения одного чата отправляются по порядку, разные чаты — параллельно.
+    # Отправленное сообщение удаляется сразу: после сбоя посреди порции повторно
+    # отправляются только неотправленные. После неудачной отправки остальные сообщения чата
+    # не отправляются и ждут истечения аренды вместе с ней, чтобы не обогнать ее;
+    # попытка, засчитанная им при захвате, возвращается
+    def deliver_chat(self, rows):
+        for position, row in enumerate(rows):
+            if not self.deliver(row):
+                skipped = [skipped_row[0] for skipped_row in rows[position + 1:]]
+                if skipped:
+                    with db.get_cursor() as cursor:
+                        cursor.execute("UPDATE outbox SET attempts = attempts - 1 WHERE id = ANY(%s)", (skipped,))
+                return
+            with db.get_cursor() as cursor:
+                cursor.execute("DELETE FROM outbox WHERE id = %s", (row[0],))
+
+    def renew(self, message_ids):
+        with db.get_cursor() as cursor:
+            cursor.execute("UPDATE outbox SET locked_until = current_timestamp + %s * interval '1 second' "
+                           "WHERE id = ANY(%s)", (LEASE_SECONDS, message_ids))
+
+    def process(self, rows, executor):
+        chats = {}
+        for row in rows:
+            chats.setdefault(row[1], []).append(row)
+        futures = {executor.submit(self.deliver_chat, chat_rows): [row[0] for row in chat_rows]
+                   for chat_rows in chats.values()}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=LEASE_RENEW_INTERVAL)
+            for future in done:
+                if future.exception() is not None:
+                    logging.error("Ошибка отправки сообщений из очереди: %s", future.exception())
+            # Долгая порция не отдается другому процессу: аренда оставшихся сообщений продлевается
+            if pending:
+                self.renew([message_id for future in pending for message_id in futures[future]])
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox') as executor:
+            while True:
+                try:
+                    rows = self.claim()
+                    if not rows:
+                        self.wakeup.wait(POLL_INTERVAL)
+                        self.wakeup.clear()
+                        continue
+                    self.process(rows, executor)
+                except Exception:
+                    logging.exception("Ошибка обработчика исходящих сообщений")
+                    time.sleep(POLL_INTERVAL)
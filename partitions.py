@@ -0,0 +1,344 @@
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+
+import db
+
+
+# Секционирование заявок по времени и архивирование рассмотренных заявок.
+# Таблица requests секционирована по месяцам (RANGE по time). Секции создаются заранее
+# на PARTITIONS_AHEAD месяцев вперед. Одобренные и отклоненные заявки старше срока хранения
+# переносятся в таблицу requests_archive небольшими порциями, каждая в своей транзакции,
+# поэтому ни одна таблица не блокируется надолго. Опустевшие старые секции отсоединяются
+# и удаляются. Заявки, ожидающие модерации, не архивируются независимо от возраста.
+# После обслуживания вычисляется начало окна недавних заявок: срок хранения, но не позже самой
+# старой ожидающей заявки. Ниже этой границы в requests остаются только рассмотренные заявки,
+# еще не перенесенные в архив, поэтому очередь модерации и история заявок пользователя
+# ограничивают время снизу этой границей, и планировщик отбрасывает старые секции
+# (в том числе requests_legacy, когда она целиком раньше окна). Старые страницы истории
+# читаются из архива.
+
+# Ключ advisory-блокировки создания и удаления секций
+PARTITION_LOCK_KEY = 7242022
+PARTITIONS_AHEAD = 3
+DEFAULT_RETENTION_DAYS = 180
+ARCHIVE_BATCH_SIZE = 1000
+# Пауза между порциями переноса, чтобы не отнимать ресурсы у обработчиков
+ARCHIVE_PAUSE = 0.1
+# Обслуживание секций и архивирование
+MAINTENANCE_INTERVAL = 3600
+# Отсоединение секции ждет блокировку не дольше этого времени, иначе откладывается
+LOCK_TIMEOUT = '2s'
+
+PARTITION_BOUNDS = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'requests'::regclass
+"""
+
+# Порция переноса: строки удаляются из requests и вставляются в архив одним запросом,
+# вместе с ними удаляются полосы хеша фото и корзины похожих текстов
+ARCHIVE_BATCH = """
+    WITH moved AS (
+        DELETE FROM requests WHERE id IN (
+            SELECT id FROM requests
+            WHERE status IN (2, 3) AND time < %s
+            ORDER BY time
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    ), archived AS (
+        INSERT INTO requests_archive SELECT * FROM moved RETURNING id
+    ), bands AS (
+        DELETE FROM request_hash_bands WHERE request_id IN (SELECT id FROM archived)
+    ), buckets AS (
+        DELETE FROM request_text_buckets WHERE request_id IN (SELECT id FROM archived)
+    )
+    SELECT count(*) FROM archived
+"""
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"requests_y{start.year}m{start.month:02d}"
+
+
+# Верхняя граница секции из выражения вида FOR VALUES FROM (...) TO ('2024-07-01 00:00:00')
+def upper_bound(expression):
+    match = re.search(r"TO \('([^']+)'\)", expression)
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+def list_partitions(cursor):
+    cursor.execute(PARTITION_BOUNDS)
+    return [(name, upper_bound(expression)) for name, expression in cursor.fetchall()]
+
+
+# Создание секций от последней существующей до PARTITIONS_AHEAD месяцев вперед
+def ensure_partitions(cursor, months_ahead=PARTITIONS_AHEAD):
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+    cursor.execute("SELECT localtimestamp")
+    current = month_start(cursor.fetchone()[0])
+    target = current
+    for _ in range(months_ahead + 1):
+        target = next_month(target)
+
+    bounds = [bound for name, bound in list_partitions(cursor) if bound is not None]
+    start = max(bounds) if bounds else current
+    created = []
+    while start < target:
+        end = next_month(start)
+        name = partition_name(start)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF requests (PRIMARY KEY (id)) "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (start, end)
+        )
+        created.append(name)
+        start = end
+    if created:
+        logging.info("Созданы секции заявок: %s", ', '.join(created))
+    return created
+
+
+# Перенос рассмотренных заявок старше cutoff в архив; возвращает число перенесенных
+def archive_processed(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    total = 0
+    while True:
+        with db.get_cursor() as cursor:
+            cursor.execute(ARCHIVE_BATCH, (cutoff, batch_size))
+            moved = cursor.fetchone()[0]
+        total += moved
+        if moved < batch_size:
+            break
+        time.sleep(ARCHIVE_PAUSE)
+    if total:
+        logging.info("В архив перенесено заявок: %s", total)
+    return total
+
+
+# Отсоединение и удаление пустых секций, целиком лежащих раньше cutoff
+def drop_empty_partitions(cutoff):
+    with db.get_cursor() as cursor:
+        partitions = [name for name, bound in list_partitions(cursor) if bound is not None and bound <= cutoff]
+    dropped = []
+    for name in partitions:
+        try:
+            with db.get_cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+                if cursor.fetchone()[0]:
+                    continue
+                cursor.execute(f"ALTER TABLE requests DETACH PARTITION {name}")
+                cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+        except psycopg2.errors.LockNotAvailable:
+            logging.info("Секция %s занята, удаление отложено", name)
+    if dropped:
+        logging.info("Удалены пустые секции заявок: %s", ', '.join(dropped))
+    return dropped
+
+
+def retention_cutoff(retention_days):
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT localtimestamp - %s * interval '1 day'", (retention_days,))
+        return cursor.fetchone()[0]
+
+
+# Начало окна недавних заявок; вычисляется после переноса в архив
+def window_start(cutoff):
+    with db.get_cursor() as cursor:
+        # Скрытые повторы новее своей ожидающей первой заявки, поэтому хватает индекса очереди
+        cursor.execute("SELECT least(%s, (SELECT min(time) FROM requests WHERE status = 1 AND NOT collapsed))",
+                       (cutoff,))
+        return cursor.fetchone()[0]
+
+
+# Обслуживание секций; возвращает начало окна недавних заявок
+def maintain(retention_days=DEFAULT_RETENTION_DAYS):
+    with db.get_cursor() as cursor:
+        ensure_partitions(cursor)
+    cutoff = retention_cutoff(retention_days)
+    archive_processed(cutoff)
+    drop_empty_partitions(cutoff)
+    return window_start(cutoff)
+
+
+# Фоновое обслуживание секций. window_start — начало окна недавних заявок
+# по последнему обслуживанию (None, пока обслуживание не выполнено: запросы читают все секции)
+class PartitionMaintainer:
+    def __init__(self, retention_days=DEFAULT_RETENTION_DAYS, interval=MAINTENANCE_INTERVAL):
+        self.retention_days = retention_days
+        self.interval = interval
+        self.window_start = None
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='partition-maintainer', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            try:
+                self.window_start = maintain(self.retention_days)
+            except Exception:
+                logging.exception("Ошибка обслуживания секций заявок")
+            time.sleep(self.interval)
+
+
+# Перевод существующей таблицы requests в секционированную (миграция 13).
+# Строки не копируются: прежняя таблица становится секцией requests_legacy для всего времени
+# до границы BOUNDARY. Миграция выполняется вне общей транзакции отдельными шагами, каждый
+# фиксируется сразу, поэтому бот продолжает принимать и рассматривать заявки:
+# 1. пустое время заполняется порциями;
+# 2. проверочное ограничение на time добавляется как NOT VALID — короткая блокировка каталога;
+# 3. VALIDATE проверяет строки в своей транзакции и не мешает чтению и записи;
+# 4. таблица подменяется секционированной одной короткой транзакцией: благодаря проверенному
+#    ограничению SET NOT NULL и ATTACH PARTITION не перечитывают строки.
+# Шаги, которым нужна исключительная блокировка, ждут ее не дольше LOCK_TIMEOUT и повторяются.
+# Прерванная миграция при следующем запуске продолжается с незавершенного шага.
+# Внешние ключи на requests (id) удаляются: у секционированной таблицы нет уникального ключа
+# по одному id; связанные строки удаляет архивирование.
+BACKFILL_BATCH_SIZE = 1000
+SWAP_ATTEMPTS = 30
+
+
+def is_partitioned():
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'requests'::regclass")
+        return cursor.fetchone()[0] == 'p'
+
+
+# Шаг с исключительной блокировкой: не дольше LOCK_TIMEOUT ожидания, при занятой таблице — повтор
+def locked_step(step, attempts=SWAP_ATTEMPTS):
+    for attempt in range(1, attempts + 1):
+        try:
+            with db.get_cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                return step(cursor)
+        except psycopg2.errors.LockNotAvailable:
+            if attempt == attempts:
+                raise
+            logging.info("Таблица заявок занята, повтор шага миграции (%s из %s)", attempt, attempts)
+            time.sleep(1)
+
+
+def drop_request_foreign_keys(cursor):
+    cursor.execute("""
+        ALTER TABLE request_hash_bands DROP CONSTRAINT IF EXISTS request_hash_bands_request_id_fkey;
+        ALTER TABLE request_text_buckets DROP CONSTRAINT IF EXISTS request_text_buckets_request_id_fkey;
+        ALTER TABLE requests DROP CONSTRAINT IF EXISTS requests_duplicate_of_fkey;
+    """)
+
+
+def backfill_request_times(batch_size=BACKFILL_BATCH_SIZE):
+    while True:
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE requests SET time = localtimestamp
+                WHERE id IN (SELECT id FROM requests WHERE time IS NULL LIMIT %s FOR UPDATE SKIP LOCKED)
+                """,
+                (batch_size,)
+            )
+            updated = cursor.rowcount
+        if updated < batch_size:
+            break
+        time.sleep(ARCHIVE_PAUSE)
+
+
+# Граница секции requests_legacy: начало месяца через месяц после текущего, чтобы новые заявки
+# проходили ограничение, даже если миграция идет на стыке месяцев
+def legacy_boundary():
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT date_trunc('month', localtimestamp) + interval '2 months'")
+        return cursor.fetchone()[0]
+
+
+def add_legacy_check(cursor, boundary):
+    cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = 'requests_legacy_time_check'")
+    if cursor.fetchone() is None:
+        cursor.execute("ALTER TABLE requests ADD CONSTRAINT requests_legacy_time_check "
+                       "CHECK (time IS NOT NULL AND time < %s) NOT VALID", (boundary,))
+
+
+def validate_legacy_check():
+    with db.get_cursor() as cursor:
+        cursor.execute("ALTER TABLE requests VALIDATE CONSTRAINT requests_legacy_time_check")
+
+
+# Подмена таблицы: только изменения каталога, строки не читаются
+def swap_requests(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'requests'::regclass")
+    if cursor.fetchone()[0] == 'p':
+        return
+    cursor.execute("""
+        SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conname = 'requests_legacy_time_check'
+    """)
+    boundary = re.search(r"'([^']+)'", cursor.fetchone()[0]).group(1)
+    cursor.execute("""
+        ALTER TABLE requests ALTER COLUMN time SET NOT NULL;
+
+        ALTER TABLE requests RENAME TO requests_legacy;
+        ALTER TABLE requests_legacy RENAME CONSTRAINT requests_pkey TO requests_legacy_pkey;
+        ALTER INDEX requests_user_id_time_idx RENAME TO requests_legacy_user_id_time_idx;
+        ALTER INDEX requests_pending_idx RENAME TO requests_legacy_pending_idx;
+        ALTER INDEX requests_media_key_idx RENAME TO requests_legacy_media_key_idx;
+        ALTER INDEX requests_duplicate_of_idx RENAME TO requests_legacy_duplicate_of_idx;
+
+        CREATE TABLE requests (LIKE requests_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (time);
+        ALTER SEQUENCE requests_id_seq OWNED BY requests.id;
+    """)
+    cursor.execute("ALTER TABLE requests ATTACH PARTITION requests_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+                   (boundary,))
+    # Ограничение заменено границей секции. Индексы секционированной таблицы: у requests_legacy
+    # подходящие индексы уже есть и присоединяются без построения
+    cursor.execute("""
+        ALTER TABLE requests_legacy DROP CONSTRAINT requests_legacy_time_check;
+
+        CREATE INDEX requests_user_id_time_idx ON requests (user_id, time DESC);
+        CREATE INDEX requests_pending_idx ON requests (time, id) WHERE status = 1;
+        CREATE INDEX requests_media_key_idx ON requests (media_key) WHERE media_key IS NOT NULL;
+        CREATE INDEX requests_duplicate_of_idx ON requests (duplicate_of) WHERE duplicate_of IS NOT NULL;
+    """)
+    ensure_partitions(cursor)
+
+
+def partition_requests():
+    if not is_partitioned():
+        locked_step(drop_request_foreign_keys)
+        backfill_request_times()
+        boundary = legacy_boundary()
+        locked_step(lambda cursor: add_legacy_check(cursor, boundary))
+        validate_legacy_check()
+        locked_step(swap_requests)
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT to_regclass('requests_archive')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("""
+                CREATE TABLE requests_archive (LIKE requests);
+                ALTER TABLE requests_archive ADD PRIMARY KEY (id);
+                CREATE INDEX requests_archive_user_id_time_idx ON requests_archive (user_id, time DESC);
+            """)
+
+
+if __name__ == '__main__':
+    from dotenv import dotenv_values
+
+    logging.basicConfig(level=logging.INFO)
+    config = dotenv_values(".env")
+    db.configure(config)
+    maintain(int(config.get('REQUESTS_RETENTION_DAYS') or DEFAULT_RETENTION_DAYS))
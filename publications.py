@@ -0,0 +1,263 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import broadcast
+import db
+import outbound
+
+
+# Очередь публикаций в группы и каналы.
+# Одобренные заявки и публикации модераторов сохраняются в таблицу publications,
+# а фоновый планировщик выкладывает их по одной: не раньше publish_at и не чаще одной
+# публикации в интервал на каждый чат. Ошибки повторяются с растущей паузой, после
+# MAX_ATTEMPTS публикация помечается неудачной. Публикацию выбирает только один процесс
+# (advisory-блокировка), NOTIFY publications будит планировщик после добавления.
+# Публикация сначала захватывается (статус sending) отдельной транзакцией, отправляется
+# вне транзакции и отмечается опубликованной второй транзакцией: соединение из пула не занято
+# на время отправки. Если процесс остановился между отправкой и отметкой, публикация
+# не повторяется автоматически, чтобы не выйти в группе дважды: по истечении SEND_TIMEOUT
+# она помечается неудачной, и модератор может перенести ее командой /publish_at.
+
+CHANNEL = 'publications'
+LOCK_KEY = 7242020
+DEFAULT_INTERVAL = 60
+POLL_INTERVAL = 5
+MAX_ATTEMPTS = 5
+# Сколько секунд захваченная публикация может отправляться (с учетом повторов после 429)
+SEND_TIMEOUT = 300
+# Пауза перед повтором: RETRY_SECONDS, затем вдвое больше после каждой ошибки
+RETRY_SECONDS = 30
+# Формат времени публикации у модератора. Время вводится и показывается в часовом поясе
+# редакции (PUBLICATION_TZ), а не в часовом поясе сеанса базы данных
+TIME_FORMAT = '%d.%m.%Y %H:%M'
+DEFAULT_TIMEZONE = 'Asia/Almaty'
+# Время в прошлом допускается в пределах текущей минуты
+PAST_GRACE = 60
+
+PENDING = 'pending'
+SENDING = 'sending'
+PUBLISHED = 'published'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+STATUS_NAMES = {
+    PENDING: 'в очереди',
+    SENDING: 'отправляется',
+    PUBLISHED: 'опубликована',
+    FAILED: 'не удалась',
+    CANCELLED: 'отменена',
+}
+
+NEXT_DUE = """
+    SELECT p.id, p.chat_id, p.text, p.photo, p.video, p.attempts
+    FROM publications p
+    WHERE p.status = 'pending' AND p.publish_at <= current_timestamp
+      AND (p.retry_at IS NULL OR p.retry_at <= current_timestamp)
+      AND NOT EXISTS (
+          SELECT 1 FROM publications q
+          WHERE q.chat_id = p.chat_id AND q.status = 'published'
+            AND q.published_at > current_timestamp - %s * interval '1 second'
+      )
+      AND NOT EXISTS (SELECT 1 FROM publications q WHERE q.chat_id = p.chat_id AND q.status = 'sending')
+    ORDER BY p.publish_at, p.id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Захваченные публикации, отправка которых не подтверждена за SEND_TIMEOUT
+EXPIRE_SENDING = """
+    UPDATE publications
+    SET status = 'failed', last_error = 'Отправка не подтверждена: проверьте группу и при необходимости перенесите публикацию'
+    WHERE status = 'sending' AND retry_at < current_timestamp
+    RETURNING id
+"""
+
+
+# Публикация — кортеж (request_id, chat_id, text, photo, video, publish_at, created_by);
+# publish_at None — как можно скорее
+def publication(chat_id, text, photo=None, video=None, request_id=None, publish_at=None, created_by=None):
+    return request_id, chat_id, text, photo, video, publish_at, created_by
+
+
+# Запрос добавления публикаций: (SQL, параметры) для синхронного и асинхронного курсора
+def insert_statement(items):
+    values = ', '.join(['(%s, %s, %s, %s, %s, coalesce(%s, current_timestamp), %s)'] * len(items))
+    params = [part for item in items for part in item]
+    return (f"INSERT INTO publications (request_id, chat_id, text, photo, video, publish_at, created_by) "
+            f"VALUES {values}; NOTIFY {CHANNEL}", params)
+
+
+def enqueue(cursor, items):
+    if items:
+        cursor.execute(*insert_statement(items))
+
+
+# Строка вида «25.12.2024 18:30» в часовом поясе tz или None
+def parse_time(text, tz):
+    try:
+        return datetime.strptime(text.strip(), TIME_FORMAT).replace(tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def format_time(value, tz):
+    return value.astimezone(tz).strftime(TIME_FORMAT)
+
+
+def is_past(value):
+    return value < datetime.now(timezone.utc) - timedelta(seconds=PAST_GRACE)
+
+
+# Ожидающие публикации с расчетным временем выхода (с учетом интервала между публикациями в чат)
+def list_pending(interval, limit=20):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT chat_id, max(published_at) FROM publications
+            WHERE status = 'published' AND published_at > current_timestamp - %s * interval '1 second'
+            GROUP BY chat_id
+            """,
+            (interval,)
+        )
+        last_published = {chat_id: published_at for chat_id, published_at in cursor.fetchall()}
+        cursor.execute(
+            """
+            SELECT id, chat_id, request_id, text, publish_at, greatest(publish_at, retry_at, current_timestamp), attempts
+            FROM publications
+            WHERE status = 'pending'
+            ORDER BY publish_at, id
+            LIMIT %s
+            """,
+            (limit,)
+        )
+        rows = cursor.fetchall()
+
+    pending = []
+    for publication_id, chat_id, request_id, text, publish_at, earliest, attempts in rows:
+        estimate = earliest
+        previous = last_published.get(chat_id)
+        if previous is not None:
+            estimate = max(estimate, previous + timedelta(seconds=interval))
+        last_published[chat_id] = estimate
+        pending.append((publication_id, chat_id, request_id, text, estimate, attempts))
+    return pending
+
+
+def count_pending():
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM publications WHERE status = 'pending'")
+        return cursor.fetchone()[0]
+
+
+# Перенос ожидающей или неудавшейся публикации на другое время; неудавшаяся возвращается в очередь.
+# False, если публикация уже выложена, отменена или отправляется
+def reschedule(publication_id, publish_at):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE publications
+            SET publish_at = %s, retry_at = NULL, status = 'pending',
+                attempts = CASE WHEN status = 'failed' THEN 0 ELSE attempts END
+            WHERE id = %s AND status IN ('pending', 'failed')
+            RETURNING id
+            """,
+            (publish_at, publication_id)
+        )
+        if cursor.fetchone() is None:
+            return False
+        cursor.execute(f"NOTIFY {CHANNEL}")
+        return True
+
+
+def cancel(publication_id):
+    with db.get_cursor() as cursor:
+        cursor.execute("UPDATE publications SET status = 'cancelled' WHERE id = %s AND status = 'pending' RETURNING id",
+                       (publication_id,))
+        return cursor.fetchone() is not None
+
+
+class PublicationScheduler:
+    def __init__(self, bot, interval=DEFAULT_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.wakeup = threading.Event()
+
+    def start(self):
+        db.listener.subscribe(CHANNEL, self.on_notify)
+        thread = threading.Thread(target=self.run, name='publication-scheduler', daemon=True)
+        thread.start()
+        return thread
+
+    def on_notify(self, channel, payload):
+        self.wakeup.set()
+
+    # Захват следующей публикации, время которой подошло; None, если таких нет
+    # или очередь сейчас обслуживает другой процесс
+    def claim(self):
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (LOCK_KEY,))
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute(EXPIRE_SENDING)
+            for expired_id, in cursor.fetchall():
+                logging.warning("Публикация #%s: отправка не подтверждена, публикация помечена неудачной", expired_id)
+            cursor.execute(NEXT_DUE, (self.interval,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                """
+                UPDATE publications
+                SET status = 'sending', attempts = attempts + 1,
+                    retry_at = current_timestamp + %s * interval '1 second'
+                WHERE id = %s
+                """,
+                (SEND_TIMEOUT, row[0])
+            )
+            return row
+
+    # Выкладка следующей публикации; False, если выкладывать нечего
+    def publish_next(self):
+        row = self.claim()
+        if row is None:
+            return False
+        publication_id, chat_id, text, photo, video, attempts = row
+        attempts += 1
+        try:
+            with outbound.priority(outbound.NOTIFICATION):
+                broadcast.send_content(self.bot, chat_id, {'text': text, 'photo': photo, 'video': video})
+        except Exception as e:
+            status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+            logging.warning("Публикация #%s в чат %s не удалась (попытка %s): %s", publication_id, chat_id, attempts, e)
+            with db.get_cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE publications
+                    SET last_error = %s, status = %s, retry_at = current_timestamp + %s * interval '1 second'
+                    WHERE id = %s AND status = 'sending'
+                    """,
+                    (str(e), status, RETRY_SECONDS * 2 ** (attempts - 1), publication_id)
+                )
+            return True
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE publications SET status = 'published', published_at = now(), retry_at = NULL
+                WHERE id = %s AND status = 'sending'
+                """,
+                (publication_id,)
+            )
+        return True
+
+    def run(self):
+        while True:
+            try:
+                while self.publish_next():
+                    pass
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+            except Exception:
+                logging.exception("Ошибка планировщика публикаций")
+                time.sleep(POLL_INTERVAL)
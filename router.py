@@ -0,0 +1,55 @@
+# Маршрутизатор кнопок меню.
+# Вместо цепочки message_handler с отдельным фильтром на каждую кнопку текст сообщения
+# нормализуется один раз и ищется в словаре «надпись кнопки -> обработчик».
+# Проверка прав модератора задается в метаданных маршрута.
+
+DENIED_TEXT = "У вас нет прав для выполнения этой команды."
+
+
+def normalize(text):
+    return text.strip().lower()
+
+
+class Route:
+    def __init__(self, handler, moderator_only=False, denied_text=DENIED_TEXT):
+        self.handler = handler
+        self.moderator_only = moderator_only
+        self.denied_text = denied_text
+
+
+class Router:
+    def __init__(self, bot, is_moderator):
+        self.bot = bot
+        self.is_moderator = is_moderator
+        self.routes = {}
+
+    # Декоратор: привязка обработчика к надписи кнопки
+    def route(self, label, moderator_only=False, denied_text=DENIED_TEXT):
+        def decorator(handler):
+            key = normalize(label)
+            if key in self.routes:
+                raise ValueError(f"Кнопка «{label}» уже привязана к обработчику")
+            self.routes[key] = Route(handler, moderator_only, denied_text)
+            return handler
+        return decorator
+
+    # Фильтр TeleBot: найденный маршрут сохраняется в сообщении для dispatch
+    def match(self, message):
+        if message.chat.type != 'private' or not message.text:
+            return False
+        route = self.routes.get(normalize(message.text))
+        if route is None:
+            return False
+        message.route = route
+        return True
+
+    def dispatch(self, message):
+        route = message.route
+        if route.moderator_only and not self.is_moderator(message.from_user.id):
+            self.bot.send_message(message.chat.id, route.denied_text)
+            return
+        route.handler(message)
+
+    # Регистрация единственного обработчика TeleBot для всех кнопок меню
+    def register(self):
+        self.bot.message_handler(content_types=['text'], func=self.match)(self.dispatch)
@@ -0,0 +1,108 @@
+import logging
+import threading
+
+import db
+
+
+# Кэш настроек бота в памяти процесса: кулдаун, группы для публикаций и модераторы.
+# Обработчики читают настройки без запросов к базе данных. При изменении таблиц
+# cooldown, groups или moderators триггер отправляет NOTIFY settings_changed,
+# и каждый процесс бота перечитывает настройки.
+
+CHANNEL = 'settings_changed'
+
+_lock = threading.Lock()
+_loaded = False
+_cooldown = None
+_publish_targets = []
+_moderator_ids = frozenset()
+
+
+# Загрузка всех настроек из базы данных
+def load():
+    global _loaded, _cooldown, _publish_targets, _moderator_ids
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT cooldown_value FROM cooldown WHERE id = 1")
+        row = cursor.fetchone()
+        cooldown = row[0] if row else None
+
+        # Если у заказчика будет 1 группа
+        cursor.execute("SELECT group_id FROM groups WHERE id = 1")
+        publish_targets = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("SELECT moder_id FROM moderators")
+        moderator_ids = frozenset(row[0] for row in cursor.fetchall())
+
+    with _lock:
+        _cooldown = cooldown
+        _publish_targets = publish_targets
+        _moderator_ids = moderator_ids
+        _loaded = True
+    logging.info("Настройки загружены: кулдаун %s, групп %s, модераторов %s",
+                 cooldown, len(publish_targets), len(moderator_ids))
+
+
+def _ensure_loaded():
+    if not _loaded:
+        load()
+
+
+# Обработчик NOTIFY: настройки перечитываются целиком (их всего несколько строк)
+def _on_notify(channel, payload):
+    load()
+
+
+# Подписка на изменения настроек из других процессов
+def start_listener():
+    db.listener.subscribe(CHANNEL, _on_notify)
+    db.listener.start()
+
+
+def get_cooldown():
+    _ensure_loaded()
+    return _cooldown
+
+
+def get_publish_targets():
+    _ensure_loaded()
+    return _publish_targets
+
+
+# Проверка модератора за O(1)
+def is_moderator(user_id):
+    _ensure_loaded()
+    return user_id in _moderator_ids
+
+
+# Изменение настроек: запись в базу данных и немедленное обновление локального кэша.
+# Остальные процессы узнают об изменении через NOTIFY.
+def set_cooldown(new_cooldown):
+    global _cooldown
+    with db.get_cursor() as cursor:
+        cursor.execute('''
+            UPDATE "cooldown"
+            SET cooldown_value = %s
+            WHERE id = 1;
+        ''', (new_cooldown,))
+    with _lock:
+        _cooldown = new_cooldown
+
+
+def set_publish_target(new_chat_id):
+    global _publish_targets
+    with db.get_cursor() as cursor:
+        cursor.execute('''
+            UPDATE "groups"
+            SET group_id = %s
+            WHERE id = 1;
+        ''', (new_chat_id,))
+    with _lock:
+        _publish_targets = [new_chat_id]
+
+
+def add_moderator(moder_id):
+    global _moderator_ids
+    with db.get_cursor() as cursor:
+        cursor.execute("INSERT INTO moderators (moder_id) VALUES (%s) ON CONFLICT (moder_id) DO NOTHING", (moder_id,))
+    with _lock:
+        _moderator_ids = _moderator_ids | {moder_id}
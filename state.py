@@ -0,0 +1,96 @@
+import json
+import os
+import socket
+
+import db
+from cache import TTLCache
+
+
+# Состояние многошаговых диалогов (оставить заявку, добавить модератора, причина отказа и т. д.).
+# Состояние хранится в PostgreSQL по ключу (chat_id, user_id), поэтому диалог переживает
+# перезапуск и может продолжиться в любом процессе бота. Чтение идет через кэш в памяти
+# со сквозной записью; об изменениях другие процессы узнают через NOTIFY.
+
+CHANNEL = 'conversation_state_changed'
+# Состояние старше этого срока считается брошенным и не учитывается (секунды)
+STATE_TTL = 24 * 3600
+
+# Отметка «состояния нет» в кэше, чтобы обычные сообщения не обращались к базе данных
+_EMPTY = object()
+
+_cache = TTLCache(maxsize=50000, ttl=STATE_TTL)
+_process_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Текущее состояние диалога: (имя состояния, данные) или None
+def get_state(chat_id, user_id):
+    key = (chat_id, user_id)
+    value = _cache.get(key)
+    if value is None:
+        with db.get_cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT state, data FROM conversation_state
+                WHERE chat_id = %s AND user_id = %s
+                  AND updated_at > current_timestamp - %s * interval '1 second'
+                """,
+                (chat_id, user_id, STATE_TTL)
+            )
+            row = cursor.fetchone()
+        value = (row[0], row[1]) if row else _EMPTY
+        _cache.set(key, value)
+    return None if value is _EMPTY else value
+
+
+def set_state(chat_id, user_id, state, **data):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO conversation_state (chat_id, user_id, state, data, updated_at)
+            VALUES (%s, %s, %s, %s, current_timestamp)
+            ON CONFLICT (chat_id, user_id) DO UPDATE
+            SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+            """,
+            (chat_id, user_id, state, json.dumps(data))
+        )
+        _notify(cursor, chat_id, user_id)
+    _cache.set((chat_id, user_id), (state, data))
+
+
+# Атомарное извлечение состояния: из двух параллельных сообщений шаг получит только одно
+def pop_state(chat_id, user_id):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM conversation_state
+            WHERE chat_id = %s AND user_id = %s
+            RETURNING state, data, updated_at > current_timestamp - %s * interval '1 second'
+            """,
+            (chat_id, user_id, STATE_TTL)
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            _notify(cursor, chat_id, user_id)
+    _cache.set((chat_id, user_id), _EMPTY)
+    if row is None or not row[2]:
+        return None
+    return row[0], row[1]
+
+
+# Уведомление уходит вместе с фиксацией транзакции
+def _notify(cursor, chat_id, user_id):
+    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, f"{_process_id}|{chat_id}|{user_id}"))
+
+
+# Сброс записи кэша по уведомлению другого процесса (payload=None — сброс всего кэша)
+def _on_notify(channel, payload):
+    if payload is None:
+        _cache.clear()
+        return
+    process_id, chat_id, user_id = payload.rsplit('|', 2)
+    if process_id != _process_id:
+        _cache.pop((int(chat_id), int(user_id)))
+
+
+def subscribe():
+    db.listener.subscribe(CHANNEL, _on_notify)
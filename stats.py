@@ -0,0 +1,115 @@
+import db
+
+
+# Статистика заявок для модераторов.
+# Итоги не считаются по таблице requests: триггеры уровня оператора (миграция 14) при каждой
+# вставке заявок и каждом решении прибавляют счетчики в сводные таблицы:
+# - request_stats_daily — отправлено, одобрено и отклонено за день;
+# - request_stats_decision_times — число решений за день по интервалам времени до решения;
+# - request_stats_users — отправлено, одобрено и отклонено по авторам.
+# Отчет читает несколько десятков строк сводных таблиц и не зависит от объема истории.
+# Медиана времени до решения оценивается по интервалам: отчет показывает интервал, в который она попала.
+
+# Верхние границы интервалов времени до решения, секунды (совпадают с массивом в миграции 14)
+DECISION_BUCKETS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400)
+DEFAULT_DAYS = 30
+# Дней в разбивке по дням и авторов в списке активных
+RECENT_DAYS = 7
+TOP_CONTRIBUTORS = 5
+
+
+def format_duration(seconds):
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч"
+    return f"{seconds // 86400} дн"
+
+
+# Интервал (от, до) в секундах, в который попадает медиана; до = None — больше последней границы
+def median_bucket(counts):
+    total = sum(counts.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen * 2 >= total:
+            low = DECISION_BUCKETS[bucket - 1] if bucket > 0 else 0
+            high = DECISION_BUCKETS[bucket] if bucket < len(DECISION_BUCKETS) else None
+            return low, high
+
+
+def describe_median(counts):
+    bucket = median_bucket(counts)
+    if bucket is None:
+        return "нет данных"
+    low, high = bucket
+    if high is None:
+        return f"больше {format_duration(low)}"
+    if not low:
+        return f"меньше {format_duration(high)}"
+    return f"от {format_duration(low)} до {format_duration(high)}"
+
+
+def percent(part, total):
+    return f"{part * 100 // total}%" if total else "—"
+
+
+def load(days=DEFAULT_DAYS):
+    with db.get_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT day, submitted, approved, rejected FROM request_stats_daily
+            WHERE day > current_date - %s
+            ORDER BY day DESC
+            """,
+            (days,)
+        )
+        daily = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT bucket, sum(decided) FROM request_stats_decision_times
+            WHERE day > current_date - %s
+            GROUP BY bucket
+            """,
+            (days,)
+        )
+        decision_times = {bucket: count for bucket, count in cursor.fetchall()}
+        cursor.execute(
+            """
+            SELECT s.user_id, u.first_name, s.submitted, s.approved
+            FROM request_stats_users s LEFT JOIN users u ON u.user_id = s.user_id
+            ORDER BY s.submitted DESC
+            LIMIT %s
+            """,
+            (TOP_CONTRIBUTORS,)
+        )
+        contributors = cursor.fetchall()
+    return daily, decision_times, contributors
+
+
+# Текст отчета; pending — число заявок в очереди модерации
+def report(pending, days=DEFAULT_DAYS):
+    daily, decision_times, contributors = load(days)
+    submitted = sum(row[1] for row in daily)
+    approved = sum(row[2] for row in daily)
+    rejected = sum(row[3] for row in daily)
+    decided = approved + rejected
+
+    lines = [
+        f"Статистика за {days} дней",
+        f"Отправлено заявок: {submitted} (в среднем {submitted / days:.1f} в день)",
+        f"Одобрено: {approved} ({percent(approved, decided)}), отклонено: {rejected} ({percent(rejected, decided)})",
+        f"Ожидают модерации: {pending}",
+        f"Медиана времени до решения: {describe_median(decision_times)}",
+    ]
+    if daily:
+        lines.append("\nПо дням (отправлено / одобрено / отклонено):")
+        lines.extend(f"{day.strftime('%d.%m')}: {day_submitted} / {day_approved} / {day_rejected}"
+                     for day, day_submitted, day_approved, day_rejected in daily[:RECENT_DAYS])
+    if contributors:
+        lines.append("\nАктивные авторы (за все время):")
+        lines.extend(f"{place}. {first_name or 'id ' + str(user_id)} — заявок {user_submitted}, одобрено {user_approved}"
+                     for place, (user_id, first_name, user_submitted, user_approved) in enumerate(contributors, 1))
+    return "\n".join(lines)
@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENV = """
+DATABASE_HOST=localhost
+DATABASE_PORT=5432
+DATABASE_NAME=bot
+DATABASE_USER=bot
+DATABASE_PASSWORD=bot
+TELEGRAM_BOT_CODE=123456:test
+"""
+
+
+# main.py читает .env из текущего каталога; импорт не обращается к базе данных и к Bot API
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('bot')
+    (directory / '.env').write_text(ENV)
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        return importlib.import_module('main')
+    finally:
+        os.chdir(previous)
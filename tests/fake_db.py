@@ -0,0 +1,53 @@
+import dedup
+import similarity
+
+
+# Курсор с заявками, полосами хеша фото и корзинами текстов в памяти:
+# отвечает на запросы поиска повторов и записи заявки, которые выполняет main.insert_requests
+class RequestsCursor:
+    def __init__(self):
+        self.requests = {}
+        self.bands = set()
+        self.buckets = set()
+        self.result = []
+
+    def execute(self, query, params=()):
+        params = list(params)
+        if query == dedup.FIND_BY_KEY:
+            self.result = [(row['duplicate_of'] or request_id,) for request_id, row in sorted(self.requests.items())
+                           if row['media_key'] == params[0]][:1]
+        elif query == dedup.FIND_BY_BANDS:
+            wanted = set(zip(params[::2], params[1::2]))
+            ids = sorted({request_id for band, value, request_id in self.bands if (band, value) in wanted})
+            self.result = [(request_id, self.requests[request_id]['duplicate_of'] or request_id,
+                            self.requests[request_id]['photo_hash']) for request_id in ids]
+        elif query == similarity.FIND_SIMILAR:
+            wanted = set(zip(params[::2], params[1::2]))
+            ids = sorted({request_id for band, bucket, request_id in self.buckets if (band, bucket) in wanted},
+                         reverse=True)
+            self.result = [(request_id, self.requests[request_id]['text_signature']) for request_id in ids]
+        elif query == dedup.PRIMARY_PENDING:
+            row = self.requests.get(params[0])
+            self.result = [(row['status'] == 1,)] if row else []
+        elif query == dedup.INSERT_BANDS:
+            self.bands.update(zip(params[::3], params[1::3], params[2::3]))
+        elif query == similarity.INSERT_BUCKETS:
+            self.buckets.update(zip(params[::3], params[1::3], params[2::3]))
+        elif 'INSERT INTO requests' in query:
+            (user_id, text, photo, video, media_key, photo_hash, duplicate_of, collapsed,
+             text_signature, similar_to, score) = params
+            request_id = len(self.requests) + 1
+            self.requests[request_id] = {
+                'user_id': user_id, 'text': text, 'media_key': media_key, 'photo_hash': photo_hash,
+                'status': 1, 'duplicate_of': duplicate_of, 'collapsed': collapsed,
+                'text_signature': text_signature, 'similar_to': similar_to,
+            }
+            self.result = [(request_id,)]
+        else:
+            raise AssertionError(f"Неожиданный запрос: {query}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
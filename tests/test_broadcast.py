@@ -0,0 +1,24 @@
+import broadcast
+
+
+def make_broadcast():
+    job = {
+        'id': 1, 'text': 'Новость', 'photo': None, 'video': None, 'report_chat_id': 10,
+        'progress_message_id': 5, 'total': 5, 'sent': 0, 'failed': 0, 'blocked': 0,
+        'last_user_row': 0, 'done_ahead': [],
+    }
+    return broadcast.Broadcast(None, job, 'test', None)
+
+
+def test_checkpoint_waits_for_earlier_recipients():
+    job = make_broadcast()
+    job.pending = [1, 2, 3]
+    job.record(2, 'sent', 102)
+    job.record(3, 'blocked', 103)
+    assert job.checkpoint == 0
+    assert job.done_ahead == {2, 3}
+    job.record(1, 'failed', 101)
+    assert job.checkpoint == 3
+    assert job.done_ahead == set()
+    assert (job.sent, job.failed, job.blocked) == (1, 2, 1)
+    assert job.blocked_users == [103]
@@ -0,0 +1,24 @@
+import cooldown_store
+
+
+def test_raised_cooldown_keeps_earlier_submissions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cooldown_store.time, 'monotonic', lambda: now[0])
+    store = cooldown_store.MemoryCooldownStore()
+    assert store.acquire(1, 60) == 0
+    # Модератор увеличил кулдаун до 10 минут: прежнее окно истекло, новое — нет
+    now[0] += 120
+    assert store.acquire(2, 600) == 0
+    assert store.acquire(1, 600) == 480
+    now[0] += 600
+    assert store.acquire(1, 600) == 0
+    assert len(store) == 1
+
+
+def test_release_gives_back_the_window(monkeypatch):
+    monkeypatch.setattr(cooldown_store.time, 'monotonic', lambda: 1000.0)
+    store = cooldown_store.MemoryCooldownStore()
+    assert store.acquire(1, 60) == 0
+    assert store.acquire(1, 60) == 60
+    store.release(1)
+    assert store.acquire(1, 60) == 0
@@ -0,0 +1,41 @@
+import random
+
+import dedup
+
+
+# Хеш с измененными битами в диапазоне BIGINT со знаком, как у dedup.dhash
+def flip(value, bits):
+    value &= (1 << dedup.HASH_BITS) - 1
+    for bit in bits:
+        value ^= 1 << bit
+    return value - (1 << dedup.HASH_BITS) if value >= 1 << (dedup.HASH_BITS - 1) else value
+
+
+def test_close_hashes_share_a_band():
+    rng = random.Random(1)
+    for _ in range(500):
+        value = rng.randrange(-(1 << 63), 1 << 63)
+        changed = flip(value, rng.sample(range(dedup.HASH_BITS), dedup.MAX_DISTANCE))
+        assert dedup.distance(value, changed) == dedup.MAX_DISTANCE
+        # Принцип Дирихле: MAX_DISTANCE отличающихся бит не могут задеть все BAND_COUNT полос
+        assert set(dedup.bands(value)) & set(dedup.bands(changed))
+
+
+def test_band_params_match_insert_params():
+    value = flip(0, [1, 20, 40, 63])
+    assert dedup.band_params(value) == [part for band in dedup.bands(value) for part in band]
+    assert dedup.insert_band_params(value, 7)[2::3] == [7] * dedup.BAND_COUNT
+
+
+def test_pick_duplicate_prefers_nearest_then_earliest():
+    value = 0b1111
+    candidates = [
+        (5, 5, value ^ 0b1),        # 1 бит
+        (6, 2, value ^ 0b10),       # 1 бит, повтор заявки #2 — раньше
+        (7, 7, value),              # совпадает
+        (8, 8, None),
+    ]
+    assert dedup.pick_duplicate(value, candidates) == 7
+    assert dedup.pick_duplicate(value, candidates[:2]) == 2
+    assert dedup.pick_duplicate(value, [(9, 9, value ^ 0b1111)]) is None
+    assert dedup.pick_duplicate(value, [(8, 8, None)]) is None
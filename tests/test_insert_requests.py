@@ -0,0 +1,34 @@
+import similarity
+from fake_db import RequestsCursor
+
+TEXT = "Жители района просят отремонтировать дорогу на улице Абая, ямы не засыпают уже третий год подряд"
+
+
+def submission(user_id, text, media_key=None, photo_hash=None):
+    return user_id, text, None, None, media_key, photo_hash, similarity.signature(text)
+
+
+def test_batch_rows_see_each_other(main):
+    cursor = RequestsCursor()
+    ids = main.insert_requests(cursor, [
+        submission(1, TEXT, media_key='photo:abc', photo_hash=0x0F0F0F0F0F0F0F0F),
+        submission(2, TEXT + '!', media_key='photo:abc'),
+        submission(3, "Другая заявка о концерте в парке в эту субботу, вход свободный для всех", photo_hash=0x0F0F0F0F0F0F0F0E),
+    ])
+    assert ids == [1, 2, 3]
+    assert cursor.requests[2]['duplicate_of'] == 1
+    assert cursor.requests[2]['similar_to'] == 1
+    # Хеш фото отличается одним битом: повтор первой заявки из той же порции
+    assert cursor.requests[3]['duplicate_of'] == 1
+    assert cursor.requests[3]['similar_to'] is None
+    # Повторы ожидающей заявки скрыты под ее карточкой
+    assert [cursor.requests[request_id]['collapsed'] for request_id in ids] == [False, True, True]
+
+
+def test_duplicate_of_decided_request_stays_in_queue(main):
+    cursor = RequestsCursor()
+    first, = main.insert_requests(cursor, [submission(1, TEXT, media_key='photo:abc')])
+    cursor.requests[first]['status'] = 2
+    second, = main.insert_requests(cursor, [submission(2, TEXT, media_key='photo:abc')])
+    assert cursor.requests[second]['duplicate_of'] == first
+    assert not cursor.requests[second]['collapsed']
@@ -0,0 +1,29 @@
+import threading
+
+import metrics
+
+
+def test_profiler_profiles_one_handler_at_a_time():
+    profiler = metrics.Profiler()
+    profiler.start(seconds=60, rate=1.0)
+    inside = threading.Barrier(4, timeout=5)
+    results = []
+
+    def handler(value):
+        inside.wait()
+        return value * 2
+
+    threads = [threading.Thread(target=lambda value=value: results.append(profiler.run(handler, value)))
+               for value in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(results) == [0, 2, 4, 6]
+    assert 'handler' in profiler.report()
+
+
+def test_nested_handler_runs_inside_outer_profile():
+    profiler = metrics.Profiler()
+    profiler.start(seconds=60, rate=1.0)
+    assert profiler.run(lambda: profiler.run(lambda: 42)) == 42
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+import outbound
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException('sendMessage', None, {
+        'error_code': 429,
+        'description': 'Too Many Requests',
+        'parameters': {'retry_after': retry_after},
+    })
+
+
+def make_client(monkeypatch, error):
+    monkeypatch.setattr(outbound, 'MAX_RETRIES', 0)
+    client = outbound.OutboundClient(rate=30)
+
+    def make_request(token, method_name, method='get', params=None, files=None):
+        raise error
+    client.make_request = make_request
+    return client
+
+
+def test_429_in_broadcast_holds_global_bucket(monkeypatch):
+    client = make_client(monkeypatch, too_many_requests(30))
+    with outbound.priority(outbound.BROADCAST):
+        with pytest.raises(ApiTelegramException):
+            client.request('token', 'sendMessage', params={'chat_id': 1})
+    assert client.bucket.try_acquire() > 25
+    assert client.chats.get(1).try_acquire() > 25
+    # Другие чаты тоже ждут: общий лимит исчерпан
+    assert client.chats.get(2).try_acquire() == 0
+    assert client.bucket.try_acquire() > 25
+
+
+def test_429_in_interactive_reply_holds_only_chat(monkeypatch):
+    client = make_client(monkeypatch, too_many_requests(30))
+    with pytest.raises(ApiTelegramException):
+        client.request('token', 'sendMessage', params={'chat_id': 1})
+    assert client.chats.get(1).try_acquire() > 25
+    assert client.bucket.try_acquire() == 0
+
+
+def test_429_without_chat_holds_global_bucket(monkeypatch):
+    client = make_client(monkeypatch, too_many_requests(30))
+    with pytest.raises(ApiTelegramException):
+        client.request('token', 'sendMediaGroup')
+    assert client.bucket.try_acquire() > 25
+
+
+def test_token_bucket_rate():
+    bucket = outbound.TokenBucket(10, 2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 0.1
+
+
+def test_priority_limiter_serves_higher_priority_first():
+    bucket = outbound.TokenBucket(5, 1)
+    limiter = outbound.PriorityLimiter(bucket)
+    limiter.acquire(outbound.INTERACTIVE)
+    order = []
+
+    def take(level):
+        limiter.acquire(level)
+        order.append(level)
+
+    threads = [threading.Thread(target=take, args=(outbound.BROADCAST,))]
+    threads[0].start()
+    # Рассылка уже ждет, когда приходит сообщение модератору
+    time.sleep(0.01)
+    threads.append(threading.Thread(target=take, args=(outbound.MODERATOR,)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    assert order == [outbound.MODERATOR, outbound.BROADCAST]
+    assert limiter.depth() == 0
+
+
+def test_string_chat_ids_use_group_limit():
+    chats = outbound.ChatLimiter()
+    assert chats.get('-1001965855664') is chats.get(-1001965855664)
+    assert chats.get('-1001965855664').rate == outbound.GROUP_RATE
+    assert chats.get('@kursiv_media').rate == outbound.GROUP_RATE
+    assert chats.get('7').rate == outbound.CHAT_RATE
@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+
+from telebot.apihelper import ApiTelegramException
+
+import broadcast
+import db
+import outbox
+
+
+def forbidden():
+    return ApiTelegramException('sendMessage', None, {'error_code': 403, 'description': 'Forbidden'})
+
+
+class Recorder:
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query, params=()):
+        self.queries.append((query, params))
+
+
+def patch(monkeypatch, failures):
+    recorder, sent, blocked = Recorder(), [], []
+
+    @contextmanager
+    def get_cursor():
+        yield recorder
+
+    def send_content(bot, chat_id, content):
+        if content['text'] in failures:
+            raise failures[content['text']]
+        sent.append(content['text'])
+
+    monkeypatch.setattr(db, 'get_cursor', get_cursor)
+    monkeypatch.setattr(broadcast, 'send_content', send_content)
+    monkeypatch.setattr(broadcast, 'mark_blocked', blocked.extend)
+    return recorder, sent, blocked
+
+
+def test_failed_message_holds_back_the_rest_of_the_chat(monkeypatch):
+    recorder, sent, blocked = patch(monkeypatch, {'второе': RuntimeError('timeout')})
+    rows = [(1, 7, 'первое', None, None, 1), (2, 7, 'второе', None, None, 1), (3, 7, 'третье', None, None, 1)]
+    outbox.OutboxWorker(None).deliver_chat(rows)
+    assert sent == ['первое']
+    assert recorder.queries == [
+        ("DELETE FROM outbox WHERE id = %s", (1,)),
+        ("UPDATE outbox SET attempts = attempts - 1 WHERE id = ANY(%s)", ([3],)),
+    ]
+
+
+def test_forbidden_marks_only_private_chats_blocked(monkeypatch):
+    recorder, sent, blocked = patch(monkeypatch, {'группе': forbidden(), 'пользователю': forbidden()})
+    worker = outbox.OutboxWorker(None)
+    assert worker.deliver((1, -1001965855664, 'группе', None, None, 1))
+    assert worker.deliver((2, 7, 'пользователю', None, None, 1))
+    assert blocked == [7]
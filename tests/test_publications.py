@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import publications
+
+
+def test_parse_time_uses_publication_timezone():
+    tz = ZoneInfo('Asia/Almaty')
+    value = publications.parse_time('25.12.2030 18:30', tz)
+    assert value.utcoffset() == tz.utcoffset(datetime(2030, 12, 25, 18, 30))
+    assert publications.format_time(value.astimezone(timezone.utc), tz) == '25.12.2030 18:30'
+    assert publications.parse_time('завтра', tz) is None
+
+
+def test_is_past_allows_current_minute():
+    now = datetime.now(timezone.utc)
+    assert not publications.is_past(now - timedelta(seconds=30))
+    assert publications.is_past(now - timedelta(minutes=5))
+    assert not publications.is_past(now + timedelta(days=1))
@@ -0,0 +1,39 @@
+import time
+
+import similarity
+
+TEXT = ("В субботу в центральном парке пройдет благотворительная ярмарка: жители принесут книги, "
+        "игрушки и одежду, а все вырученные деньги передадут детскому дому")
+
+
+def test_short_text_has_no_signature():
+    assert similarity.signature("Новость") == []
+    assert similarity.find_similar(None, []) == (None, None)
+
+
+def test_edited_copy_shares_bucket_and_passes_threshold():
+    original = similarity.signature(TEXT)
+    edited = similarity.signature(TEXT.replace("В субботу", "В это воскресенье").upper())
+    assert len(original) == similarity.NUM_HASHES
+    assert set(similarity.buckets(original)) & set(similarity.buckets(edited))
+    assert similarity.estimate(original, edited) >= similarity.SIMILARITY_THRESHOLD
+
+
+def test_pick_similar_returns_best_candidate_above_threshold():
+    sig = similarity.signature(TEXT)
+    half = sig[:64] + [value + 1 for value in sig[64:]]
+    mostly = sig[:100] + [value + 1 for value in sig[100:]]
+    other = [value + 1 for value in sig]
+    assert similarity.pick_similar(sig, [(1, half), (2, mostly), (3, other), (4, [])]) == (2, 100 / 128)
+    assert similarity.pick_similar(sig, [(3, other)]) == (None, None)
+
+
+def test_signature_of_long_text_is_cheap():
+    text = ' '.join(f"слово{number % 300}" for number in range(400))
+    timings = []
+    for _ in range(5):
+        started = time.perf_counter()
+        similarity.signature(text)
+        timings.append(time.perf_counter() - started)
+    # Прежний подсчет (128 перестановок на каждый шингл) занимал около 75 мс
+    assert min(timings) < 0.02
@@ -0,0 +1,25 @@
+class UsersCursor:
+    def __init__(self, existing):
+        self.existing = existing
+        self.params = None
+
+    def execute(self, query, params):
+        self.params = params
+        rows = list(zip(params[::3], params[1::3], params[2::3]))
+        self.result = [(user_id, user_id not in self.existing) for user_id, first_name, username in rows]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_one_row_per_user_and_new_flag_on_first_occurrence(main):
+    cursor = UsersCursor(existing={2})
+    results = main.upsert_users(cursor, [
+        (1, 'Айгерим', 'aigerim'),
+        (2, 'Данияр', None),
+        (1, 'Айгерим К.', 'aigerim'),
+        (3, 'Руслан', 'ruslan'),
+    ])
+    assert results == [True, False, False, True]
+    # Повтор пользователя в порции записывается одной строкой с последним именем
+    assert cursor.params == [1, 'Айгерим К.', 'aigerim', 2, 'Данияр', None, 3, 'Руслан', 'ruslan']
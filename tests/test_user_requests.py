@@ -0,0 +1,25 @@
+from datetime import datetime
+
+
+def placeholders(query):
+    return query.count('%s')
+
+
+def test_history_reads_recent_partitions_and_archive(main, monkeypatch):
+    since = datetime(2024, 1, 1)
+    monkeypatch.setattr(main.partition_maintainer, 'window_start', since)
+    query, params = main.user_requests_query(7, older=(datetime(2024, 5, 1), 42), limit=10)
+    assert placeholders(query) == len(params)
+    recent, archive = query.split('UNION ALL')
+    # Рабочая таблица ограничена окном недавних секций, архив — нет
+    assert 'FROM requests WHERE' in recent and 'time >= %s' in recent
+    assert 'FROM requests_archive WHERE' in archive and 'time >=' not in archive
+    assert params == (7, datetime(2024, 5, 1), 42, since, 11, 7, datetime(2024, 5, 1), 42, 11, 11)
+
+
+def test_history_without_window_reads_all_partitions(main, monkeypatch):
+    monkeypatch.setattr(main.partition_maintainer, 'window_start', None)
+    query, params = main.user_requests_query(7, newer=(datetime(2024, 5, 1), 42), limit=10)
+    assert placeholders(query) == len(params)
+    assert 'time >=' not in query
+    assert 'ORDER BY time, id LIMIT' in query
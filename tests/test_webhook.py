@@ -0,0 +1,37 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import webhook
+
+
+def test_refuses_to_start_without_secret():
+    with pytest.raises(ValueError):
+        webhook.WebhookServer(None, host='127.0.0.1', port=0)
+
+
+def post(server, headers):
+    url = f"http://127.0.0.1:{server.httpd.server_address[1]}{server.path}"
+    body = json.dumps({'update_id': 1}).encode()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json', **headers})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_rejects_requests_without_secret_header():
+    server = webhook.WebhookServer(None, host='127.0.0.1', port=0, secret_token='s3cret')
+    threading.Thread(target=server.httpd.serve_forever, daemon=True).start()
+    try:
+        assert post(server, {}) == 403
+        assert post(server, {webhook.SECRET_HEADER: 'wrong'}) == 403
+        assert post(server, {webhook.SECRET_HEADER: 's3cret'}) == 200
+        assert server.updates.qsize() == 1
+    finally:
+        server.httpd.shutdown()
+        server.httpd.server_close()
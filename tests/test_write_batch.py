@@ -0,0 +1,55 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import write_batch
+
+
+@pytest.fixture
+def cursors(monkeypatch):
+    transactions = []
+
+    @contextmanager
+    def get_cursor():
+        transactions.append(object())
+        yield transactions[-1]
+    monkeypatch.setattr(write_batch.db, 'get_cursor', get_cursor)
+    return transactions
+
+
+def test_batches_are_limited_and_failures_isolated(cursors):
+    batches = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def flush(cursor, items):
+        if items == ['block']:
+            started.set()
+            release.wait(5)
+        batches.append(list(items))
+        if 'bad' in items:
+            raise ValueError('bad row')
+        return [item.upper() for item in items]
+
+    batcher = write_batch.WriteBatcher('test', flush, max_size=3, max_delay=0.01)
+    # Пока первая порция пишется, следующие записи копятся
+    first = batcher.submit('block')
+    assert started.wait(5)
+    futures = [batcher.submit(item) for item in ['a', 'b', 'bad', 'c', 'd']]
+    release.set()
+
+    assert first.result(5) == 'BLOCK'
+    assert [future.result(5) for future in futures if future is not futures[2]] == ['A', 'B', 'C', 'D']
+    with pytest.raises(ValueError):
+        futures[2].result(5)
+    assert all(len(batch) <= 3 for batch in batches)
+    # Порция с ошибкой повторена по одной записи
+    assert ['a', 'b', 'bad'] in batches and ['bad'] in batches and ['a'] in batches
+
+
+def test_direct_writer_writes_each_item(cursors):
+    writer = write_batch.create_writer('direct', lambda cursor, items: [len(items)], max_size=1)
+    assert isinstance(writer, write_batch.DirectWriter)
+    assert writer.submit('x').result() == 1
+    assert len(cursors) == 1
@@ -0,0 +1,117 @@
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+
+
+# Запись входящих обновлений в JSONL для воспроизведения нагрузки (python -m bench.replay).
+# Каждая строка: {"ts": время получения, "update": обновление в формате Bot API}.
+# Бот обрабатывает только сообщения и нажатия inline-кнопок, поэтому записываются они.
+# При анонимизации идентификаторы пользователей заменяются стабильными псевдонимами,
+# а имена и юзернеймы удаляются (имя заменяется псевдонимом); тексты сообщений сохраняются.
+
+# Поля пользователя, которые удаляются при анонимизации
+PERSONAL_FIELDS = ('first_name', 'last_name', 'username', 'phone_number', 'bio')
+# Псевдонимы попадают в диапазон обычных идентификаторов пользователей Telegram
+PSEUDONYM_RANGE = 10 ** 9
+
+
+class TraceRecorder:
+    def __init__(self, path, anonymize=False, salt=None):
+        self.path = path
+        self.anonymize = anonymize
+        # Без заданной соли псевдонимы стабильны только в пределах одного файла
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.count = 0
+        logging.info("Запись обновлений в %s (анонимизация: %s)", path, 'да' if anonymize else 'нет')
+
+    def pseudonym(self, user_id):
+        digest = hmac.new(self.salt, str(user_id).encode(), hashlib.sha256).digest()
+        return PSEUDONYM_RANGE + int.from_bytes(digest[:8], 'big') % PSEUDONYM_RANGE
+
+    # Обезличивание пользователей и личных чатов; группы и каналы не меняются
+    def scrub(self, value):
+        if isinstance(value, list):
+            return [self.scrub(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, item in value.items():
+            if key in PERSONAL_FIELDS:
+                continue
+            if key in ('from', 'user', 'forward_from'):
+                item = self.scrub(item)
+                if isinstance(item.get('id'), int):
+                    item['id'] = self.pseudonym(item['id'])
+                    # first_name обязателен в объекте User
+                    item['first_name'] = f"User{item['id']}"
+            elif key == 'chat' and isinstance(item, dict):
+                item = self.scrub(item)
+                if item.get('type') == 'private':
+                    item['id'] = self.pseudonym(item['id'])
+            elif key == 'contact':
+                continue
+            else:
+                item = self.scrub(item)
+            result[key] = item
+        return result
+
+    def to_json(self, update):
+        raw = {'update_id': update.update_id}
+        if update.message is not None:
+            raw['message'] = update.message.json
+        elif update.callback_query is not None:
+            raw['callback_query'] = update.callback_query.json
+        else:
+            return None
+        return self.scrub(raw) if self.anonymize else raw
+
+    def record(self, updates):
+        self.write([raw for raw in map(self.to_json, updates) if raw is not None])
+
+    # Запись обновлений, уже представленных в формате Bot API (асинхронный режим)
+    def record_raw(self, updates):
+        self.write([self.scrub(raw) if self.anonymize else raw for raw in updates])
+
+    def write(self, raws):
+        if not raws:
+            return
+        received = time.time()
+        lines = [json.dumps({'ts': received, 'update': raw}, ensure_ascii=False) for raw in raws]
+        with self.lock:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            self.count += len(lines)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# Подключение записи к боту: обновления записываются перед обработкой
+# (и в режиме long polling, и в режиме вебхука)
+def install(bot, recorder):
+    process_new_updates = bot.process_new_updates
+
+    def process_and_record(updates):
+        try:
+            recorder.record(updates)
+        except Exception:
+            logging.exception("Не удалось записать обновления в %s", recorder.path)
+        process_new_updates(updates)
+
+    bot.process_new_updates = process_and_record
+
+
+# Чтение записи: пары (время получения, обновление в формате Bot API)
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                yield item['ts'], item['update']
@@ -0,0 +1,130 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+
+# Прием обновлений через вебхук вместо long polling.
+# HTTP-сервер проверяет секретный токен Telegram, кладет обновление в ограниченную
+# очередь и сразу отвечает 200; обновления обрабатывает пул рабочих потоков.
+# Если очередь переполнена, сервер отвечает 503, и Telegram повторит доставку позже.
+# Без секретного токена любой POST на путь вебхука был бы принят как обновление Telegram
+# (в том числе поддельные нажатия кнопок модератора), поэтому сервер без токена не запускается.
+# Для локальной проверки токен можно отключить явно (allow_insecure), но не вместе с регистрацией в Telegram.
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+DEFAULT_PORT = 8443
+DEFAULT_PATH = '/webhook'
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 1000
+# Ограничение размера тела запроса (обновления Telegram намного меньше)
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    def __init__(self, bot, host='0.0.0.0', port=DEFAULT_PORT, path=DEFAULT_PATH, secret_token=None,
+                 workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, allow_insecure=False):
+        if not secret_token and not allow_insecure:
+            raise ValueError("Не задан WEBHOOK_SECRET: без секретного токена вебхук принимает запросы от кого угодно")
+        if not secret_token:
+            logging.warning("Вебхук запущен без секретного токена, только для локальной проверки")
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.handle_post(self)
+
+            def do_GET(self):
+                # Проверка состояния для балансировщика нагрузки
+                if self.path == '/healthz':
+                    server.respond(self, 200, f"ok queue={server.updates.qsize()}")
+                else:
+                    server.respond(self, 404, "not found")
+
+            def log_message(self, format, *args):
+                logging.debug("webhook: " + format, *args)
+
+        return Handler
+
+    def respond(self, request, code, body=''):
+        data = body.encode()
+        request.send_response(code)
+        request.send_header('Content-Type', 'text/plain; charset=utf-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def handle_post(self, request):
+        if request.path != self.path:
+            self.respond(request, 404, "not found")
+            return
+
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                self.respond(request, 403, "forbidden")
+                return
+
+        length = int(request.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self.respond(request, 400, "bad request")
+            return
+
+        try:
+            update = types.Update.de_json(json.loads(request.rfile.read(length)))
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning("Некорректное обновление во вебхуке: %s", e)
+            self.respond(request, 400, "bad request")
+            return
+
+        try:
+            self.updates.put_nowait(update)
+        except queue.Full:
+            logging.warning("Очередь обновлений переполнена, обновление %s отклонено", update.update_id)
+            self.respond(request, 503, "busy")
+            return
+
+        self.respond(request, 200, "ok")
+
+    # Рабочий поток: обработка обновлений из очереди
+    def work(self):
+        while True:
+            update = self.updates.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.update_id)
+            finally:
+                self.updates.task_done()
+
+    def start_workers(self):
+        for number in range(self.workers):
+            threading.Thread(target=self.work, name=f'webhook-worker-{number}', daemon=True).start()
+
+    # Регистрация вебхука в Telegram (не нужна при локальной проверке)
+    def register(self, url):
+        if not self.secret_token:
+            raise ValueError("Вебхук без секретного токена не регистрируется в Telegram")
+        self.bot.remove_webhook()
+        self.bot.set_webhook(url=url, secret_token=self.secret_token)
+        logging.info("Вебхук зарегистрирован: %s", url)
+
+    def serve_forever(self):
+        self.start_workers()
+        logging.info("Вебхук слушает %s:%s%s", self.host, self.port, self.path)
+        self.httpd.serve_forever()
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+import metrics
+
+
+# Групповая фиксация записей (group commit).
+# При наплыве заявок каждая отдельная транзакция ждет fsync журнала PostgreSQL, и именно
+# fsync ограничивает число заявок в секунду. WriteBatcher собирает записи из разных
+# обработчиков и записывает их одной транзакцией: не больше max_size записей и не дольше
+# max_delay после первой. Обработчик ждет результата своей записи (Future) и отвечает
+# пользователю только после фиксации порции. Пока порция записывается, следующая уже копится.
+# Если порция не записалась, записи повторяются по одной, чтобы ошибка одной строки
+# не отменила остальные.
+
+DEFAULT_MAX_SIZE = 100
+# Секунды; задается в миллисекундах параметром WRITE_BATCH_DELAY_MS
+DEFAULT_MAX_DELAY = 0.005
+
+FLUSH_SECONDS = metrics.Histogram('db_batch_flush_seconds', "Время записи порции", ['batch'])
+BATCH_SIZE = metrics.Histogram('db_batch_size', "Число записей в порции", ['batch'],
+                               buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+class WriteBatcher:
+    # flush(cursor, items) записывает порцию и возвращает результаты в порядке items
+    def __init__(self, name, flush, max_size=DEFAULT_MAX_SIZE, max_delay=DEFAULT_MAX_DELAY):
+        self.name = name
+        self.flush = flush
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        metrics.QUEUE_DEPTH.track(lambda: len(self.pending), queue=f'write_{name}')
+
+    def submit(self, item):
+        future = Future()
+        with self.condition:
+            # Поток записи запускается при первой записи, а не при импорте
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=f'write-{self.name}', daemon=True)
+                self.thread.start()
+            self.pending.append((item, future, time.monotonic()))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_size:
+                self.condition.notify()
+        return future
+
+    # Ожидание порции: max_size записей или max_delay с момента первой записи
+    def take(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = self.pending[0][2] + self.max_delay
+            while len(self.pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_size]
+            del self.pending[:self.max_size]
+            return batch
+
+    def write(self, batch):
+        started = time.perf_counter()
+        try:
+            with db.get_cursor() as cursor:
+                results = self.flush(cursor, [item for item, future, submitted in batch])
+        except Exception as err:
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+                return
+            logging.warning("Порция %s из %s записей не записана, записи повторяются по одной: %s",
+                            self.name, len(batch), err)
+            for entry in batch:
+                self.write([entry])
+            return
+        finally:
+            FLUSH_SECONDS.observe(time.perf_counter() - started, batch=self.name)
+            BATCH_SIZE.observe(len(batch), batch=self.name)
+        for (item, future, submitted), result in zip(batch, results):
+            future.set_result(result)
+
+    def run(self):
+        while True:
+            batch = self.take()
+            try:
+                self.write(batch)
+            except Exception as err:
+                logging.exception("Ошибка записи порции %s", self.name)
+                for item, future, submitted in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+
+# Запись без накопления (групповая фиксация выключена): каждая запись — своя транзакция
+class DirectWriter:
+    def __init__(self, name, flush):
+        self.name = name
+        self.flush = flush
+
+    def submit(self, item):
+        future = Future()
+        try:
+            with db.get_cursor() as cursor:
+                future.set_result(self.flush(cursor, [item])[0])
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+# max_size 0 — групповая фиксация выключена
+def create_writer(name, flush, max_size=0, max_delay=DEFAULT_MAX_DELAY):
+    if max_size and max_size > 1:
+        return WriteBatcher(name, flush, max_size=max_size, max_delay=max_delay)
+    return DirectWriter(name, flush)